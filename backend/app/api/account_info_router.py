@@ -1,20 +1,47 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
-from app.db.database import get_db
+from fastapi import APIRouter, Depends, Query, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from app.db.database import get_db, session_factory
 from app.db.models import User, Account, Transaction, BankRequisition
-from dotenv import load_dotenv
-from app.dependencies import get_current_user
+from app.core.config import settings
+from app.dependencies import get_current_user, get_read_db
+from app.api.response_cache import cached_response
+from app.services.pagination import TRANSACTION_ORDER, encode_cursor, keyset_page_query, transaction_listing, listing_dicts
+from app.services.transaction_counts import count_transactions
+from app.services.export import EXPORT_MEDIA_TYPES, export_transactions
+from app.services.columnar import columnar_cache
+from app.services.statement_import import detect_format, import_statement
+from app.services.analytics import (
+    account_summaries, revenue_chart, top_transactions, top_transactions_by_account, user_accounts, dashboard
+)
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
-from sqlalchemy import func, case
 from typing import Literal
-from datetime import datetime, timedelta, timezone
-load_dotenv()
+from datetime import datetime
+from decimal import InvalidOperation
+from xml.etree.ElementTree import ParseError
+import asyncio
+import codecs
+import csv
+import tempfile
+
+# Largest statement file accepted by the import endpoint, and how much of it is kept in memory before spooling to disk
+IMPORT_MAX_BYTES = settings.import_max_bytes
+IMPORT_SPOOL_BYTES = settings.import_spool_bytes
+
+IMPORT_CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/xml": "camt053",
+    "text/xml": "camt053",
+    "application/json": "gocardless",
+}
 
 router = APIRouter()
 
 @router.get("/accounts")
+@cached_response
 async def get_accounts(
+    request: Request,
     current_user: User = Depends(get_current_user),
     db=Depends(get_db)
 ):
@@ -26,7 +53,9 @@ async def get_accounts(
     return {"accounts": accounts}
 
 @router.get("/accounts/{account_id}")
+@cached_response
 async def get_account(
+    request: Request,
     account_id: str,
     current_user: User = Depends(get_current_user),
     db=Depends(get_db)
@@ -40,15 +69,71 @@ async def get_account(
         return {"error": "Account not found or does not belong to the current user."}
     return {"account": account}
 
+@router.post("/accounts/{account_id}/import", summary="Import a bank statement file into an account")
+async def import_statement_file(
+    request: Request,
+    account_id: str,
+    format: Literal["csv", "camt053", "gocardless"] = Query(None, description="File format, detected from the content type or filename when left out"),
+    filename: str = Query(None, description="Name of the uploaded file, used to detect the format"),
+    encoding: str = Query("utf-8-sig", description="Text encoding of CSV files, fx cp1252 for older Danish bank exports"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Import a CSV export, an ISO 20022 CAMT.053 statement or a saved GoCardless transactions response.
+    The file is sent as the request body. Transactions already stored are updated, not duplicated.
+    """
+    result = await db.execute(
+        select(Account)
+        .join(BankRequisition)
+        .where(Account.id == account_id, BankRequisition.user_id == current_user.id)
+    )
+    account = result.scalar_one_or_none()
+    if not account:
+        raise HTTPException(404, detail="Account not found or does not belong to the current user.")
+    format = format or IMPORT_CONTENT_TYPES.get(request.headers.get("content-type", "").split(";")[0]) or detect_format(filename or "")
+    if format is None:
+        raise HTTPException(400, detail="Unknown file format, set format to csv, camt053 or gocardless")
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        raise HTTPException(400, detail=f"Unknown encoding {encoding}")
+
+    # Spooled to disk past IMPORT_SPOOL_BYTES, the body is never held in memory as a whole
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as file:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > IMPORT_MAX_BYTES:
+                raise HTTPException(413, detail="Statement file too large")
+            # Once spilled to disk a write can block, so writes run off the event loop like the parsing does
+            await asyncio.to_thread(file.write, chunk)
+        file.seek(0)
+        options = {"encoding": encoding} if format == "csv" else {}
+        try:
+            counts = await import_statement(file, format, account.id, account.currency, db, **options)
+        except (ValueError, KeyError, InvalidOperation, csv.Error, ParseError, UnicodeDecodeError) as e:
+            raise HTTPException(400, detail=f"Could not read the statement file: {e}")
+    return {"account_id": account.id, "format": format, **counts}
+
 # AIO transaction endpoint with filtering and pagination
 @router.get("/transactions", summary="Get transactions with filtering and pagination and optionally filtered by account")
+@cached_response
 async def get_transactions_filter(
+    request: Request,
     account_id: str = Query("all", description="The ID of the account to retrieve transactions for, or 'all' for all accounts"),
     page: int = Query(1, ge=1,description="The page number for pagination"),
     page_size: int = Query(10, ge=1, description="The number of transactions per page"),
+    cursor: str = Query(None, description="next_cursor from the previous response, or empty for the first page. When set, page is ignored"),
+    status: Literal["booked", "pending"] = Query(None, description="Only return transactions with this status"),
+    include_total: bool = Query(True, description="Set to false to skip the total, fx when scrolling with a cursor"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
+    """
+    Transactions ordered by booking date, newest first.
+    Pages can be requested by number (page) or by following next_cursor, which stays fast however deep the page is.
+    """
     # Find relevant account_ids
     if account_id == "all":
         # Get all account IDs associated with the current user
@@ -71,33 +156,101 @@ async def get_transactions_filter(
             raise HTTPException(403, detail="You do not have permission to access this account.")
         account_ids = [account.id]
 
-    # Total count for pagination
-    count_result = await db.execute(
-        select(func.count(Transaction.id))
-        .where(Transaction.account_id.in_(account_ids))
-    )
-    total = count_result.scalar_one_or_none()
+    # Total count for pagination, read from the maintained per-account counts
+    total = await count_transactions(account_ids, db, status=status) if include_total else None
+
+    if cursor is not None:
+        # Keyset pagination, continues after the last transaction of the previous page
+        transactions = []
+        if account_ids:
+            try:
+                stmt = keyset_page_query(account_ids, page_size, cursor, status=status)
+            except ValueError:
+                raise HTTPException(400, detail="Invalid cursor")
+            result = await db.execute(stmt)
+            transactions = listing_dicts(result)
+        return {
+            "transactions": transactions,
+            "total": total,
+            "next_cursor": encode_cursor(transactions[-1]) if len(transactions) == page_size else None,
+            "page_size": page_size,
+        }
 
     # Paginated transactions
-    result = await db.execute(
-        select(Transaction)
-        .options(selectinload(Transaction.account)) # Eager load account to avoid N+1 queries
+    stmt = (
+        transaction_listing()  # Only the needed columns, with the account name joined in
         .where(Transaction.account_id.in_(account_ids))
-        .order_by(Transaction.booking_date.desc())
+    )
+    if status is not None:
+        stmt = stmt.where(Transaction.status == status)
+    result = await db.execute(
+        stmt
+        .order_by(*TRANSACTION_ORDER)
         .offset((page - 1) * page_size)
         .limit(page_size)
     )
-    transactions = result.scalars().all()
+    transactions = listing_dicts(result)
 
     return {
-        "transactions": [tx.as_dict() for tx in transactions],
+        "transactions": transactions,
         "total": total,
         "page": page,
         "page_size": page_size,
+        # Lets clients switch to cursor pagination from any page
+        "next_cursor": encode_cursor(transactions[-1]) if len(transactions) == page_size else None,
     }
 
+@router.get("/transactions/export", summary="Download transactions as CSV or NDJSON")
+async def export_transactions_file(
+    account_id: str = Query("all", description="The ID of the account to export transactions for, or 'all' for all accounts"),
+    date_from: datetime = Query(None, description="Only transactions booked at or after this date"),
+    date_to: datetime = Query(None, description="Only transactions booked before this date"),
+    status: Literal["booked", "pending"] = Query(None, description="Only export transactions with this status"),
+    format: Literal["csv", "ndjson"] = Query("csv", description="csv, or ndjson for one JSON object per line"),
+    gzip: bool = Query(False, description="Compress the file with gzip"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    All matching transactions, newest first, streamed as they are read from the database.
+    Not paginated and not cached, the response is written batch by batch however large the export is.
+    """
+    if account_id == "all":
+        result = await db.execute(
+            select(Account.id)
+            .join(BankRequisition)
+            .where(BankRequisition.user_id == current_user.id)
+        )
+        account_ids = [row[0] for row in result.all()]
+    else:
+        result = await db.execute(
+            select(Account)
+            .options(selectinload(Account.requisition))
+            .where(Account.id == account_id)
+        )
+        account = result.scalar_one_or_none()
+        if not account:
+            raise HTTPException(404, detail="Account not found")
+        if account.requisition.user_id != current_user.id:
+            raise HTTPException(403, detail="You do not have permission to access this account.")
+        account_ids = [account.id]
+
+    filename = f"transactions.{format}" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_transactions(
+            account_ids, format=format, gzip=gzip, sessions=session_factory(db),
+            date_from=date_from, date_to=date_to, status=status
+        ),
+        # A .gz download rather than Content-Encoding, so clients save the compressed file as is
+        media_type="application/gzip" if gzip else EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
+
+
 @router.get("/accounts/{account_id}/summary")
+@cached_response
 async def get_account_summary(
+    request: Request,
     account_id: str,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
@@ -115,37 +268,20 @@ async def get_account_summary(
     if account.requisition.user_id != current_user.id:
         raise HTTPException(403, detail="You do not have permission to access this account.")
     
-    # Calculate the summary
-    thirty_days_ago = datetime.now() - timedelta(days=30)
-    money_out_query = await db.execute(
-        select(func.sum(Transaction.amount))
-        .where(
-            Transaction.account_id == account_id,
-            Transaction.booking_date >= thirty_days_ago,
-            Transaction.amount < 0
-        )
-    )
-    money_out = money_out_query.scalar() or 0
-    money_in_query = await db.execute(
-        select(func.sum(Transaction.amount))
-        .where(
-            Transaction.account_id == account_id,
-            Transaction.booking_date >= thirty_days_ago,
-            Transaction.amount > 0
-        )
-    )
-    money_in = money_in_query.scalar() or 0
-
+    # Calculate the summary from the cached columns, or from the daily rollups, one row per day instead of one per transaction
+    columns = await columnar_cache.get(current_user, db)
+    summary = (await account_summaries([account_id], db, columns=columns)).get(account_id, {"money_out": 0.0, "money_in": 0.0})
     return {
         "account_id": account_id,
-        "money_out": float(money_out),
-        "money_in": abs(float(money_in)), # absolute value for money in
+        **summary,
         "currency": account.currency,
     }
 
 
 @router.get("/revenue_chart_data", summary="Get revenue chart data")
+@cached_response
 async def get_revenue_chart_data(
+    request: Request,
     interval: Literal["daily", "weekly", "monthly", "yearly"] = Query("weekly"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
@@ -164,58 +300,16 @@ async def get_revenue_chart_data(
     if not account_ids:
         raise HTTPException(404, detail="No accounts found for the current user.")
 
-    # Brug naive datetimes (uden timezone)
-    now = datetime.utcnow()  # i stedet for datetime.now(timezone.utc)
-    
-    if interval == "daily":
-        start_date = now - timedelta(days=7)
-        trunc_func = func.date_trunc('day', Transaction.booking_date)
-    elif interval == "weekly":
-        start_date = now - timedelta(weeks=6)
-        trunc_func = func.date_trunc("week", Transaction.booking_date)
-    elif interval == "monthly":
-        start_date = now - timedelta(days=30 * 6)
-        trunc_func = func.date_trunc("month", Transaction.booking_date)
-    elif interval == "yearly":
-        start_date = now - timedelta(days=365 * 5)
-        trunc_func = func.date_trunc("year", Transaction.booking_date)
-    else:
-        raise HTTPException(400, detail="Invalid interval")
-
-    # Byg query
-    stmt = (
-        select(
-            trunc_func.label("period"),
-            func.sum(
-                case((Transaction.amount > 0, Transaction.amount), else_=0)
-            ).label("income"),
-            func.sum(
-                case((Transaction.amount < 0, Transaction.amount), else_=0)
-            ).label("expenses"),
-        )
-        .where(
-            Transaction.account_id.in_(account_ids),
-            Transaction.booking_date >= start_date
-        )
-        .group_by("period")
-        .order_by("period")
-    )
-
-    result = await db.execute(stmt)
-    rows = result.all()
-
-    return [
-        {
-            "date": period.strftime("%d %b" if interval != "yearly" else "%Y"),
-            "income": float(income),
-            "expenses": abs(float(expenses)),
-        }
-        for period, income, expenses in rows
-    ]
+    columns = await columnar_cache.get(current_user, db)
+    return await revenue_chart(account_ids, interval, db, columns=columns)
 
 @router.get("/top_transactions", summary="Get top 3 income and top 3 expenses for the current")
-async def top_transactions(
+@cached_response
+async def get_top_transactions(
+    request: Request,
     account_id: str = Query(..., description="The ID of the account to retrieve transactions for"),
+    n: int = Query(3, ge=1, le=50, description="Number of incomes and expenses to return"),
+    period: Literal["week", "month", "quarter", "year", "all"] = Query("month", description="Only transactions booked since the start of this period"),
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
@@ -229,38 +323,49 @@ async def top_transactions(
     if not account:
         raise HTTPException(404, detail="Account not found or does not belong to the current user.")
     
-    # Calculate first day of the current month
-    today = datetime.utcnow()
-    first_day_of_month = today.replace(day=1)
+    columns = await columnar_cache.get(current_user, db)
+    return await top_transactions(account_id, db, n=n, period=period, columns=columns)
 
-    # Get top 3 income transactions
-    income_stmt = (
-        select(Transaction)
-        .where(
-            Transaction.account_id == account_id,
-            Transaction.booking_date >= first_day_of_month,
-            Transaction.amount > 0
-        )
-        .order_by(Transaction.amount.desc()
-        ).limit(3)
-    )
-    top_income = (await db.execute(income_stmt)).scalars().all()
-    
-    # Get top 3 expense transactions
-    expense_stmt = (
-        select(Transaction)
-        .where(
-            Transaction.account_id == account_id,
-            Transaction.booking_date >= first_day_of_month,
-            Transaction.amount < 0
-        )
-        .order_by(Transaction.amount.asc()  # Most negative = highest expense
-        ).limit(3)
-    )
-    top_expenses = (await db.execute(expense_stmt)).scalars().all()
 
+@router.get("/top_transactions_by_account", summary="Get top income and expenses for several accounts at once")
+@cached_response
+async def get_top_transactions_by_account(
+    request: Request,
+    account_id: list[str] = Query(None, description="IDs of the accounts to include, all of the user's accounts if left out"),
+    n: int = Query(3, ge=1, le=50, description="Number of incomes and expenses to return per account"),
+    period: Literal["week", "month", "quarter", "year", "all"] = Query("month", description="Only transactions booked since the start of this period"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Top incomes and expenses for every requested account, computed in a single query
+    """
+    account_ids = [account.id for account in await user_accounts(current_user.id, db)]
+    if account_id:
+        if not set(account_id) <= set(account_ids):
+            raise HTTPException(404, detail="Account not found or does not belong to the current user.")
+        account_ids = list(dict.fromkeys(account_id))
+    columns = await columnar_cache.get(current_user, db)
+    top = await top_transactions_by_account(account_ids, db, n=n, period=period, columns=columns)
     return {
-        "income": [tx.as_dict() for tx in top_income],
-        "expenses": [tx.as_dict() for tx in top_expenses],
-        "account_id": account_id,
+        "accounts": [{"account_id": account_id, **top[account_id]} for account_id in account_ids],
+        "n": n,
+        "period": period,
     }
+
+
+@router.get("/dashboard", summary="Get everything the dashboard page needs in one request")
+@cached_response
+async def get_dashboard(
+    request: Request,
+    interval: Literal["daily", "weekly", "monthly", "yearly"] = Query("weekly"),
+    latest: int = Query(10, ge=1, le=100, description="Number of latest transactions to include"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Accounts with their 30 day summary and top transactions, the revenue chart and the latest transactions.
+    Replaces the separate calls to /accounts, /accounts/{account_id}/summary, /revenue_chart_data and /top_transactions.
+    """
+    columns = await columnar_cache.get(current_user, db)
+    return await dashboard(current_user.id, db, interval=interval, latest=latest, columns=columns)
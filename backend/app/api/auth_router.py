@@ -4,17 +4,13 @@ from app.db.database import get_db
 from app.db.models import User
 from app.services.auth import verify_google_token
 from jose import jwt
-import os
-from dotenv import load_dotenv
+from app.core.config import settings
 from sqlalchemy.future import select
 from app.dependencies import get_current_user
-load_dotenv()
 
 router = APIRouter()
 
-JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret")
-if not JWT_SECRET:
-    raise ValueError("JWT_SECRET not set in environment variables")
+JWT_SECRET = settings.jwt_secret
 
 @router.post("/auth/google")
 async def google_login(
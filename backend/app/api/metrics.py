@@ -0,0 +1,115 @@
+from fastapi import APIRouter, Response
+from app.api.response_cache import response_cache
+from app.core.metrics import Counter, Gauge, Histogram, registry
+from app.db.query_stats import current_stats, start_request
+from app.db.replica import replica_router
+from app.core.cache import user_cache
+from app.services.columnar import columnar_cache
+import time
+
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time to handle a request until its response is sent, per route",
+    ("method", "route"),
+)
+REQUESTS = Counter("http_requests_total", "Requests handled per route and status code", ("method", "route", "status"))
+REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "Requests being handled right now")
+
+
+def cache_stats() -> dict:
+    return {"user": user_cache.stats(), "response": response_cache.stats(), "columnar": columnar_cache.stats()}
+
+
+def cache_values(*keys):
+    """
+    Scrape time values of a stat of every cache, under the first of keys the cache has
+    """
+    def values():
+        stats = cache_stats()
+        return {(name,): next((cache[key] for key in keys if key in cache), None) for name, cache in stats.items()}
+    return values
+
+
+Gauge("cache_entries", "Entries in each in-process cache, users for the columnar cache", ("cache",),
+      function=cache_values("size", "entries", "users"))
+Gauge("cache_bytes", "Memory budget used by the caches bounded by size", ("cache",), function=cache_values("bytes"))
+Counter("cache_hits_total", "Lookups served from each cache", ("cache",), function=cache_values("hits"))
+Counter("cache_misses_total", "Lookups each cache couldn't serve", ("cache",), function=cache_values("misses"))
+Gauge("db_replica_lag_seconds", "Last measured replay lag of the read replica", function=lambda: replica_router.lag)
+Counter("db_reads_total", "Read-only requests by the database their queries went to", ("database",),
+        function=lambda: {(database,): count for database, count in replica_router.reads.items()})
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording the latency, status and number in flight of HTTP requests.
+    Requests are labelled with the path template of the route that handled them, requests no route matched
+    share the route "unmatched" so scanners can't create a series per URL.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500  # When the app raises before a response is started
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            path = route.path if route is not None else "unmatched"
+            REQUEST_DURATION.observe(time.perf_counter() - start, scope["method"], path)
+            REQUESTS.inc(scope["method"], path, str(status))
+
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware collecting the statements each request runs into a QueryStats.
+    Sampled requests get a Server-Timing header with the statement count and database time up to the response start,
+    and a log line with the totals when they finish, plus a warning for statements repeated like an N+1.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = start_request(f"{scope['method']} {scope['path']}")
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), (b"server-timing", stats.server_timing().encode())]
+            await send(message)
+
+        token = current_stats.set(stats)
+        try:
+            await self.app(scope, receive, send_with_timing if stats.sampled else send)
+        finally:
+            current_stats.reset(token)
+            if stats.sampled:
+                stats.report()
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Metrics of this process in the Prometheus text format
+    """
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
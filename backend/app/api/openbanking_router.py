@@ -1,23 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header, Query
-from dotenv import load_dotenv
-import os
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Response
 import httpx
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.db.database import get_db
 from app.db.models import User, BankRequisition, Account, Transaction
 from app.services.openbanking import OpenBankingService
+from app.services.rate_limit import RateLimitExceeded
+from app.services.institution_cache import InstitutionCache, INSTITUTIONS_BROWSER_MAX_AGE
 from app.services.save_transactions import save_transactions
-from app.dependencies import get_current_user
+from app.services.save_accounts import save_accounts, extract_balance_amount
+from app.services.sync_transactions import sync_date_from, advance_watermarks
+from app.dependencies import get_current_user, get_openbanking_service, get_institution_cache
 from sqlalchemy.orm import Session
 from datetime import datetime, timezone
 from pydantic import BaseModel
 from sqlalchemy.orm import selectinload
 import logging
 
-# Load environment variables
-load_dotenv()  # Should be changed for production to use a more secure method of handling secrets
-
 # configure logging
 logger = logging.getLogger(__name__)  # Set up a logger for this module
 # Set to log everything at INFO level and above
@@ -26,30 +25,41 @@ logger.setLevel(logging.INFO)
 # Deactivate SQLAlchemy's echo feature to avoid logging SQL queries
 logging.getLogger("sqlalchemy.engine").setLevel(logging.WARNING)
 
-GOCARDLESS_SECRET_ID = os.getenv("GOCARDLESS_SECRET_ID")
-GOCARDLESS_SECRET_NAME = os.getenv("GOCARDLESS_SECRET_NAME")
-GOCARDLESS_SECRET_KEY = os.getenv("GOCARDLESS_SECRET_KEY")
-
 # Initialize FastAPI router
 router = APIRouter()
 
+def rate_limited_exception(retry_after: float) -> HTTPException:
+    """
+    429 response for when GoCardless' rate limit for the account has been reached
+    """
+    headers = {"Retry-After": str(int(retry_after) + 1)} if retry_after else None
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Bank data rate limit reached, please try again later",
+        headers=headers
+    )
+
 @router.get("/get_banks", summary="Get a list of available danish banks")
-async def get_banks():
+async def get_banks(
+    if_none_match: str = Header(None),
+    cache: InstitutionCache = Depends(get_institution_cache),
+):
+    """
+    Served from the institution cache, GoCardless is only called when the cached list is missing or stale.
+    The body is serialized once per refresh and browsers can revalidate it with If-None-Match.
+    """
     try:
-        logger.info("Attempting to fetch list og Danish banks from GoCardless")
-        service = OpenBankingService(
-            secret_id=os.getenv("GOCARDLESS_SECRET_ID"),
-            secret_name=os.getenv("GOCARDLESS_SECRET_NAME"),
-            secret_key=os.getenv("GOCARDLESS_SECRET_KEY"),
-        )
-        banks = await service.get_banks(country_code="DK")
-        return {"banks": banks}
+        entry = await cache.get("DK")
     except Exception as e:
         logger.error("Error while fetching banks: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to fetch bank list from GoCardless"
         )
+    headers = {"ETag": entry.etag, "Cache-Control": f"public, max-age={INSTITUTIONS_BROWSER_MAX_AGE}"}
+    if if_none_match and entry.etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
 
 class RequisitionRequest(BaseModel):
     institution_id: str
@@ -60,16 +70,12 @@ async def create_requisition(
     payload: RequisitionRequest,
     db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
+    service: OpenBankingService = Depends(get_openbanking_service),
 ):
     """
     This route is used after a user has selected a bank. The user is redirected to the bank's login page, and the requisition is created in the DB
     """
     try:
-        service = OpenBankingService(
-            secret_id=os.getenv("GOCARDLESS_SECRET_ID"),
-            secret_name=os.getenv("GOCARDLESS_SECRET_NAME"),
-            secret_key=os.getenv("GOCARDLESS_SECRET_KEY"),
-        )
         logger.info("Attempting to create a new requisition for institution_id: %s", payload.institution_id)
         requisition = await service.create_requisition(
             institution_id=payload.institution_id,
@@ -110,6 +116,7 @@ async def process_requisition(
     payload: RequisitionProcessRequest,
     db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
+    service: OpenBankingService = Depends(get_openbanking_service),
 ):
     # Find requisition based on reference
     logger.info("Processing requisition with reference: %s", payload.ref)
@@ -132,12 +139,6 @@ async def process_requisition(
         )
     
     # Fetch accounts using the OpenBankingService
-    service = OpenBankingService(
-        secret_id=os.getenv("GOCARDLESS_SECRET_ID"),
-        secret_name=os.getenv("GOCARDLESS_SECRET_NAME"),
-        secret_key=os.getenv("GOCARDLESS_SECRET_KEY"),
-    )
-
     try:
         accounts = await service.list_accounts(requisition_id=requisition.requisition_id)
         if not accounts or "accounts" not in accounts:
@@ -149,12 +150,10 @@ async def process_requisition(
         logger.info("Accounts fetched successfully for requisition %s", requisition.id)
         account_nos = accounts["accounts"]  # List of account numbers used to call the API
         logger.info("Account numbers to process: %s", account_nos)
-        created_new = False  # Flag to check if new accounts were created
         account_infos = []  # List to store the details from get_account_details
-        for account in account_nos:
-            logger.info("Processing account number: %s", account)
-            account_info = await service.get_account_details(account_number=account)
-            account_balance = await service.get_account_balance(account_number=account)
+        # Fetch details and balances for all accounts concurrently
+        snapshots = await service.get_account_snapshots(account_nos)
+        for account, account_info, account_balance in snapshots:
             if not account_info or "account" not in account_info:
                 logger.warning("No account details found for account number: %s", account)
                 continue
@@ -163,69 +162,51 @@ async def process_requisition(
                 continue
             logger.info("Account info and account balance fetched for: %s", account)
             # Extract balance amount from the account balance
-            balance_entry = next(
-                (b for b in account_balance.get("balances", []) if b["balanceType"] in ["expected", "interimAvailable"]),
-                None
-            )
-            balance_amount = balance_entry["balanceAmount"]["amount"] if balance_entry else None
+            balance_amount = extract_balance_amount(account_balance)
 
             acc_data = account_info["account"]
-
-            # Check if the account already exists in the database
-            result = await db.execute(
-                select(Account)
-                .options(selectinload(Account.requisition))
-                .where(Account.account_id==acc_data["resourceId"])
-            )
-            existing_account = result.scalar_one_or_none()
-            # Check if the account exists and belongs to another user, if so block the connection
-            if existing_account and existing_account.requisition.user_id != user.id:
-                logger.warning("Account %s is already connected to another user", acc_data["resourceId"])
-                raise HTTPException(
-                    status_code=403,
-                    detail="This account is already connected to another user"
-                )
-            if existing_account:
-                logger.info("Updating existing account with ID: %s", existing_account.id)
-                # Update existing account
-                existing_account.name = acc_data.get("name", "Ukendt konto")
-                existing_account.iban = acc_data.get("iban")
-                existing_account.currency = acc_data.get("currency", "DKK")
-                existing_account.requisition_id = requisition.id
-            else:
-                logger.info("Creating new account with ID: %s", acc_data["resourceId"])
-                created_new = True  # Set flag to indicate a new account was created
-                # Create new account
-                new_account = Account(
-                    account_id=acc_data["resourceId"],
-                    account_number=account,
-                    name=acc_data.get("name", "Ukendt konto"),
-                    balance=balance_amount,
-                    balance_updated_at=datetime.now(timezone.utc),
-                    iban=acc_data.get("iban"),
-                    currency=acc_data.get("currency", "DKK"),
-                    requisition_id=requisition.id
-                )
-                db.add(new_account)
-                logger.info("New account added to the database with ID: %s", new_account.id)
-            
             account_infos.append({
                 "account_id": acc_data["resourceId"],
                 "account_number": account,
                 "name": acc_data.get("name", "Ukendt konto"),
                 "iban": acc_data.get("iban"),
                 "currency": acc_data.get("currency", "DKK"),
+                "balance": balance_amount,
             })
-            
+
+        # Load the owners of all accounts that already exist in one query
+        resource_ids = [info["account_id"] for info in account_infos]
+        result = await db.execute(
+            select(Account.account_id, BankRequisition.user_id)
+            .join(BankRequisition, Account.requisition_id == BankRequisition.id)
+            .where(Account.account_id.in_(resource_ids))
+        )
+        existing_owners = dict(result.all())
+        # Check if any account exists and belongs to another user, if so block the connection
+        for resource_id, owner_id in existing_owners.items():
+            if owner_id != user.id:
+                logger.warning("Account %s is already connected to another user", resource_id)
+                raise HTTPException(
+                    status_code=403,
+                    detail="This account is already connected to another user"
+                )
+        created_new = any(resource_id not in existing_owners for resource_id in resource_ids)  # Flag to check if new accounts were created
+        await save_accounts(account_infos, requisition.id, db)
+
         # Commit the changes to the database
         logger.info("Committing changes to the database")
         await db.commit()
         
+        for info in account_infos:
+            info.pop("balance")  # Balance is stored, but not part of the response
         return {"message": "Accounts processed successfully", "accounts": account_infos, "created_new": created_new}
     except HTTPException as e:
         # Handle HTTP exceptions separately
         logger.error("HTTP error while processing requisition: %s", e.detail)
         raise e
+    except RateLimitExceeded as e:
+        logger.warning("Rate limited while processing requisition: %s", e)
+        raise rate_limited_exception(e.retry_after)
     except Exception as e:
         logger.warning("General error while processing requisition: %s", e)
         raise HTTPException(
@@ -237,12 +218,14 @@ async def process_requisition(
 class TransactionsRequest(BaseModel):
     account_id: str
     reference: str
+    full_resync: bool = False  # Ignore the sync watermark and fetch the full history
 
 @router.post("/fetch_transactions", summary="Fetch transactions for a specific account")
 async def fetch_transactions(
     payload: TransactionsRequest,
     db: AsyncSession = Depends(get_db),
     user: User = Depends(get_current_user),
+    service: OpenBankingService = Depends(get_openbanking_service),
 ):
     # Find requisition based on reference
     account_result = await db.execute(
@@ -280,24 +263,20 @@ async def fetch_transactions(
     logger.info("Account found for account_id: %s", payload.account_id)
     # Fetch transactions using the OpenBankingService
     try:
-        logger.info("Initializing OpenBankingService to fetch transactions for account: %s", account.account_number)
-        service = OpenBankingService(
-            secret_id=os.getenv("GOCARDLESS_SECRET_ID"),
-            secret_name=os.getenv("GOCARDLESS_SECRET_NAME"),
-            secret_key=os.getenv("GOCARDLESS_SECRET_KEY"),
-        )
-    except Exception as e:
-        logger.error("Error initializing OpenBankingService:", exc_info=True)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to initialize OpenBankingService"
+        # Only fetch the transactions since the last sync, unless a full resync is requested
+        date_from = sync_date_from(account, full_resync=payload.full_resync)
+        logger.info("Attempting to fetch transactions for: %s from %s", account.account_number, date_from or "the beginning")
+        transactions_data = await service.get_account_transactions(
+            account_number=account.account_number,  # Use the account_number from the database
+            date_from=date_from
         )
-
-
-    try:
-        logger.info("Attempting to fetch transactions for: %s", account.account_number)
-        transactions_data = await service.get_account_transactions(account_number=account.account_number)  # Use the account_number from the database
+    except RateLimitExceeded as e:
+        logger.warning("Rate limited while fetching transactions: %s", e)
+        raise rate_limited_exception(e.retry_after)
     except httpx.HTTPStatusError as e:
+        if e.response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+            logger.warning("GoCardless rate limit reached while fetching transactions")
+            raise rate_limited_exception(None)
         logger.error("HTTP error while fetching transactions", exc_info=True)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -312,7 +291,8 @@ async def fetch_transactions(
     logger.info("Transactions fetched successfully for account: %s", account.account_number)
     try:
         logger.info("Saving transactions to the database for account: %s", account.account_number)
-        await save_transactions(transactions_data, account.id, db)  # Save transactions to the database
+        advance_watermarks(account, transactions_data)
+        await save_transactions(transactions_data, account.id, db)  # Save transactions and watermarks to the database
     except Exception as e:
         logger.error("Error while saving transactions: ", exc_info=True)
         raise HTTPException(
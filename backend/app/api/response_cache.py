@@ -0,0 +1,49 @@
+from fastapi import Request, Response, status
+from app.api.responses import dump_json
+from app.core.cache import ResponseCache
+from datetime import datetime
+from functools import wraps
+from app.core.config import settings
+from app.dependencies import read_session
+
+# Memory budget for cached response bodies, per process
+RESPONSE_CACHE_MAX_BYTES = settings.response_cache_max_bytes
+
+response_cache = ResponseCache(max_bytes=RESPONSE_CACHE_MAX_BYTES)
+
+
+def cache_key(request: Request, user) -> tuple:
+    """
+    Responses only change when the user's data_version is bumped or when the day changes,
+    summaries and charts cover periods relative to today
+    """
+    # Sorted by name only, the order of repeated parameters like ?account_id=a&account_id=b can matter
+    params = tuple(sorted(request.query_params.multi_items(), key=lambda item: item[0]))
+    return user.id, user.data_version, datetime.utcnow().date(), request.url.path, params
+
+
+def cached_response(endpoint):
+    """
+    Cache the JSON response of a read endpoint per user, path, query parameters and data version.
+    Responses carry a strong ETag, and a request whose If-None-Match matches a cached entry gets 304 without running the endpoint.
+    The endpoint needs request: Request, current_user and db parameters, db from get_db. On a miss db is replaced with
+    read_session's, so hits and 304s are served without deciding on the replica or touching either database.
+    """
+
+    @wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        request = kwargs["request"]
+        key = cache_key(request, kwargs["current_user"])
+        entry = response_cache.get(key)
+        if entry is None:
+            async with read_session(kwargs["current_user"], kwargs["db"]) as db:
+                content = await endpoint(*args, **{**kwargs, "db": db})
+            entry = response_cache.set(key, dump_json(content))
+        # no-cache makes browsers revalidate with If-None-Match on every use, which is a cheap 304 here
+        headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and entry.etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    return wrapper
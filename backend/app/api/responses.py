@@ -0,0 +1,30 @@
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+import json
+
+try:
+    import orjson
+except ImportError:  # Optional, the standard library encoder is used without it
+    orjson = None
+
+
+def dump_json(content) -> bytes:
+    """
+    Serialize a response body. With orjson, dicts, lists, strings, numbers and datetimes are encoded natively
+    and only other values (Decimal, ORM objects, ...) go through jsonable_encoder, so plain row dicts are encoded
+    without walking them in Python first. Output matches FastAPI's JSONResponse.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=jsonable_encoder, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(
+        jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse rendered with dump_json
+    """
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
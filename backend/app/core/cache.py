@@ -0,0 +1,118 @@
+from app.core.config import settings
+from collections import OrderedDict
+import hashlib
+import time
+
+# Resolved users are cached per process, keyed by user id
+USER_CACHE_SIZE = settings.user_cache_size
+USER_CACHE_TTL = settings.user_cache_ttl
+
+
+class TTLCache:
+    """
+    Small in-process LRU cache where every entry also expires ttl seconds after it was stored.
+    Keeps hit and miss counters so the hit rate can be monitored.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None or item[1] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)  # Least recently used
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Read by get_current_user, invalidated when a user's row or data_version changes in this process
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+class CachedResponse:
+    """
+    Serialized response body with its strong ETag
+    """
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+class ResponseCache:
+    """
+    LRU cache of serialized responses, bounded by the total size of the bodies instead of the number of entries
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key) -> CachedResponse:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key, body: bytes) -> CachedResponse:
+        entry = CachedResponse(body)
+        if len(body) > self.max_bytes:
+            return entry  # Too large to cache at all
+        self.invalidate(key)
+        self._data[key] = entry
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)  # Least recently used
+            self.size -= len(evicted.body)
+        return entry
+
+    def invalidate(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,144 @@
+from pydantic import BaseModel, ConfigDict, Field
+from dotenv import load_dotenv
+from functools import lru_cache
+from typing import Optional
+import os
+
+
+class Settings(BaseModel):
+    """
+    All configuration of the backend, read from environment variables (and .env) once at startup.
+    Every field is set by the environment variable named in its alias, values are converted and validated by pydantic,
+    so a typo like DB_POOL_SIZE=ten fails at startup instead of at the first request.
+    """
+    model_config = ConfigDict(frozen=True)
+
+    # Database
+    database_url: str = Field(alias="DATABASE_URL", min_length=1)
+    db_echo: bool = Field(False, alias="DB_ECHO")
+    # Connections kept open per process, and how many more may be opened when all of them are checked out
+    db_pool_size: int = Field(5, alias="DB_POOL_SIZE", ge=1)
+    db_max_overflow: int = Field(10, alias="DB_MAX_OVERFLOW", ge=0)
+    # Seconds a request waits for a free connection before it fails, instead of queueing forever when the pool is exhausted
+    db_pool_timeout: float = Field(30, alias="DB_POOL_TIMEOUT", gt=0)
+    # Connections older than this many seconds are replaced when checked out, so they don't all age out at once
+    # behind a proxy or load balancer that drops idle connections. -1 keeps connections forever.
+    db_pool_recycle: int = Field(1800, alias="DB_POOL_RECYCLE", ge=-1)
+    # Test each connection with a round trip when it's checked out, so requests after a database restart
+    # get a fresh connection instead of an error
+    db_pool_pre_ping: bool = Field(True, alias="DB_POOL_PRE_PING")
+    # Reuse the most recently returned connection first, so surplus connections sit idle and can be recycled
+    db_pool_use_lifo: bool = Field(False, alias="DB_POOL_USE_LIFO")
+    # Prepared statements cached per connection by asyncpg and by SQLAlchemy's asyncpg dialect.
+    # Set both to 0 behind PgBouncer in transaction pooling mode, where prepared statements don't survive a transaction.
+    db_statement_cache_size: int = Field(100, alias="DB_STATEMENT_CACHE_SIZE", ge=0)
+    db_prepared_statement_cache_size: int = Field(100, alias="DB_PREPARED_STATEMENT_CACHE_SIZE", ge=0)
+    # Seconds a single statement may run before asyncpg cancels it, unset for no limit
+    db_command_timeout: Optional[float] = Field(None, alias="DB_COMMAND_TIMEOUT", gt=0)
+    # Streaming replica for the read-only account and analytics routes, unset to read everything from the primary.
+    # It uses the same pool settings as the primary.
+    replica_database_url: Optional[str] = Field(None, alias="REPLICA_DATABASE_URL")
+    # The replica is skipped while its replay lag is above this many seconds, lag is measured at most every
+    # REPLICA_CHECK_INTERVAL seconds and a check that takes longer than REPLICA_CHECK_TIMEOUT counts as down
+    replica_max_lag: float = Field(5, alias="REPLICA_MAX_LAG", ge=0)
+    replica_check_interval: float = Field(5, alias="REPLICA_CHECK_INTERVAL", gt=0)
+    replica_check_timeout: float = Field(1, alias="REPLICA_CHECK_TIMEOUT", gt=0)
+    # After a user's data changes in this process their reads stay on the primary for this many seconds
+    replica_pin_seconds: float = Field(30, alias="REPLICA_PIN_SECONDS", ge=0)
+
+    # Authentication
+    jwt_secret: str = Field("dev-secret", alias="JWT_SECRET", min_length=1)
+    gocardless_secret_id: Optional[str] = Field(None, alias="GOCARDLESS_SECRET_ID")
+    gocardless_secret_name: Optional[str] = Field(None, alias="GOCARDLESS_SECRET_NAME")
+    gocardless_secret_key: Optional[str] = Field(None, alias="GOCARDLESS_SECRET_KEY")
+
+    # GoCardless HTTP client. Point GOCARDLESS_BASE_URL at scripts/mock_gocardless.py to sync without the real API
+    gocardless_base_url: str = Field(
+        "https://bankaccountdata.gocardless.com/api/v2", alias="GOCARDLESS_BASE_URL", min_length=1
+    )
+    http_max_connections: int = Field(20, alias="OPENBANKING_HTTP_MAX_CONNECTIONS", ge=1)
+    http_max_keepalive_connections: int = Field(10, alias="OPENBANKING_HTTP_MAX_KEEPALIVE_CONNECTIONS", ge=0)
+    http_keepalive_expiry: float = Field(30, alias="OPENBANKING_HTTP_KEEPALIVE_EXPIRY", ge=0)
+    http2: bool = Field(False, alias="OPENBANKING_HTTP2")
+    http_connect_timeout: float = Field(5, alias="OPENBANKING_HTTP_CONNECT_TIMEOUT", gt=0)
+    http_transactions_timeout: float = Field(60, alias="OPENBANKING_TRANSACTIONS_TIMEOUT", gt=0)
+    openbanking_max_concurrency: int = Field(8, alias="OPENBANKING_MAX_CONCURRENCY", ge=1)
+    openbanking_max_retries: int = Field(3, alias="OPENBANKING_MAX_RETRIES", ge=0)
+    openbanking_backoff_base: float = Field(0.5, alias="OPENBANKING_BACKOFF_BASE", ge=0)
+    openbanking_backoff_max: float = Field(30, alias="OPENBANKING_BACKOFF_MAX", ge=0)
+    rate_limit_account_daily_calls: int = Field(4, alias="RATE_LIMIT_ACCOUNT_DAILY_CALLS", ge=1)
+    rate_limit_max_wait: float = Field(10, alias="RATE_LIMIT_MAX_WAIT", ge=0)
+    institutions_ttl_hours: float = Field(24, alias="INSTITUTIONS_TTL_HOURS", gt=0)
+    institutions_browser_max_age: int = Field(3600, alias="INSTITUTIONS_BROWSER_MAX_AGE", ge=0)
+
+    # Background sync
+    sync_scheduler_enabled: bool = Field(False, alias="SYNC_SCHEDULER_ENABLED")
+    sync_workers: int = Field(4, alias="SYNC_WORKERS", ge=1)
+    syncs_per_day: int = Field(4, alias="SYNCS_PER_DAY", ge=1)
+    sync_scheduler_interval: float = Field(60, alias="SYNC_SCHEDULER_INTERVAL", gt=0)
+    sync_poll_interval: float = Field(5, alias="SYNC_POLL_INTERVAL", gt=0)
+    sync_job_max_attempts: int = Field(3, alias="SYNC_JOB_MAX_ATTEMPTS", ge=1)
+    sync_job_timeout_minutes: int = Field(15, alias="SYNC_JOB_TIMEOUT_MINUTES", ge=1)
+    sync_job_retention_days: int = Field(7, alias="SYNC_JOB_RETENTION_DAYS", ge=0)
+    sync_overlap_days: int = Field(7, alias="SYNC_OVERLAP_DAYS", ge=0)
+
+    # Writes, imports and exports
+    save_transactions_chunk_size: int = Field(1000, alias="SAVE_TRANSACTIONS_CHUNK_SIZE", ge=1)
+    import_batch_size: int = Field(10000, alias="IMPORT_BATCH_SIZE", ge=1)
+    import_max_bytes: int = Field(512 * 1024 * 1024, alias="IMPORT_MAX_BYTES", ge=1)
+    import_spool_bytes: int = Field(8 * 1024 * 1024, alias="IMPORT_SPOOL_BYTES", ge=0)
+    export_batch_size: int = Field(1000, alias="EXPORT_BATCH_SIZE", ge=1)
+
+    # Caches and analytics
+    user_cache_size: int = Field(1024, alias="USER_CACHE_SIZE", ge=0)
+    user_cache_ttl: float = Field(60, alias="USER_CACHE_TTL", ge=0)
+    response_cache_max_bytes: int = Field(64 * 1024 * 1024, alias="RESPONSE_CACHE_MAX_BYTES", ge=0)
+    columnar_cache_max_bytes: int = Field(128 * 1024 * 1024, alias="COLUMNAR_CACHE_MAX_BYTES", ge=0)
+    columnar_max_patch: int = Field(5000, alias="COLUMNAR_MAX_PATCH", ge=0)
+    dashboard_concurrency: int = Field(4, alias="DASHBOARD_CONCURRENCY", ge=1)
+
+    # Serve /metrics and record request metrics. The endpoint isn't authenticated, keep it off the public network.
+    metrics_enabled: bool = Field(True, alias="METRICS_ENABLED")
+    # Share of requests whose statements are counted, reported in a Server-Timing header and a log line
+    # and checked for N+1 patterns. 1 in development, a small fraction in production.
+    query_stats_sample_rate: float = Field(0, alias="QUERY_STATS_SAMPLE_RATE", ge=0, le=1)
+    # The same statement run this many times in one sampled request is logged as a likely N+1
+    query_repeat_threshold: int = Field(5, alias="QUERY_REPEAT_THRESHOLD", ge=2)
+    # Statements slower than this many seconds are logged with their plan, 0 turns it off
+    slow_query_seconds: float = Field(1, alias="SLOW_QUERY_SECONDS", ge=0)
+    slow_query_explain: bool = Field(True, alias="SLOW_QUERY_EXPLAIN")
+
+    def engine_options(self) -> dict:
+        """
+        Keyword arguments for create_async_engine
+        """
+        connect_args = {
+            "statement_cache_size": self.db_statement_cache_size,
+            "prepared_statement_cache_size": self.db_prepared_statement_cache_size,
+        }
+        if self.db_command_timeout is not None:
+            connect_args["command_timeout"] = self.db_command_timeout
+        return {
+            "echo": self.db_echo,
+            "pool_size": self.db_pool_size,
+            "max_overflow": self.db_max_overflow,
+            "pool_timeout": self.db_pool_timeout,
+            "pool_recycle": self.db_pool_recycle,
+            "pool_pre_ping": self.db_pool_pre_ping,
+            "pool_use_lifo": self.db_pool_use_lifo,
+            "connect_args": connect_args,
+        }
+
+
+@lru_cache
+def get_settings() -> Settings:
+    """
+    The settings of this process, read from the environment the first time they're needed.
+    Variables already set in the environment take precedence over .env.
+    """
+    load_dotenv()
+    names = {field.alias for field in Settings.model_fields.values()}
+    return Settings.model_validate({name: value for name, value in os.environ.items() if name in names})
+
+
+settings = get_settings()
@@ -0,0 +1,136 @@
+from bisect import bisect_left
+import math
+
+# Seconds, from a fast indexed query or cached response up to a slow upstream call
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Registry:
+    """
+    The metrics of this process, rendered in the Prometheus text exposition format
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        if any(existing.name == metric.name for existing in self.metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{format_labels(labels)} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_value(value) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    A metric with a value per combination of label values.
+    Values are either recorded as things happen, or read at scrape time from function, which returns
+    a value or a dict of values keyed by tuples of label values.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), function=None, registry: Registry = registry):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.function = function
+        self._values = {}
+        registry.register(self)
+
+    def _labels(self, values: tuple) -> dict:
+        return dict(zip(self.labels, values))
+
+    def values(self) -> dict:
+        if self.function is None:
+            return self._values
+        values = self.function()
+        return values if isinstance(values, dict) else {(): values}
+
+    def samples(self):
+        for key, value in self.values().items():
+            if value is not None:
+                yield "", self._labels(key), value
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, *label_values):
+        self._values[label_values] = value
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(Metric):
+    """
+    Counts of observations per bucket, plus their sum and count. Buckets are upper bounds, inclusive.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 registry: Registry = registry):
+        super().__init__(name, documentation, labels, registry=registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values):
+        entry = self._values.get(label_values)
+        if entry is None:
+            # Observations per bucket, the last one for values above every bucket, and their sum
+            entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def samples(self):
+        for key, (counts, total) in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield "_bucket", {**labels, "le": format_value(float(bound))}, cumulative
+            cumulative += counts[-1]
+            yield "_bucket", {**labels, "le": "+Inf"}, cumulative
+            yield "_sum", labels, total
+            yield "_count", labels, cumulative
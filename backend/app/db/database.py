@@ -1,15 +1,14 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
-from dotenv import load_dotenv
-import os
+from app.core.config import settings
+from app.db.metrics import instrument_engine, timed_pool
 
-load_dotenv()
+DATABASE_URL = settings.database_url
+REPLICA_DATABASE_URL = settings.replica_database_url
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL environment variable not set")
-
-engine = create_async_engine(DATABASE_URL, echo=False)  # Set echo to False to suppress SQLAlchemy logs
+# Pool size, overflow, timeouts, recycling, pre-ping and statement caches all come from settings (DB_* variables)
+engine = create_async_engine(DATABASE_URL, poolclass=timed_pool("primary"), **settings.engine_options())
+instrument_engine(engine, "primary")
 
 AsyncSessionLocal = sessionmaker(
     bind=engine,
@@ -17,9 +16,38 @@ AsyncSessionLocal = sessionmaker(
     expire_on_commit=False
 )
 
+# Optional read replica, see app/db/replica.py for when it's used
+replica_engine = None
+if REPLICA_DATABASE_URL:
+    replica_engine = create_async_engine(
+        REPLICA_DATABASE_URL, poolclass=timed_pool("replica"), **settings.engine_options()
+    )
+    instrument_engine(replica_engine, "replica")
+
+ReadSessionLocal = sessionmaker(
+    bind=replica_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+) if replica_engine is not None else AsyncSessionLocal
+
 Base = declarative_base()
 
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
 
+
+def session_factory(db: AsyncSession):
+    """
+    The sessionmaker of the database db is bound to, so more sessions opened for a request read from the same database
+    """
+    return ReadSessionLocal if replica_engine is not None and db.bind is replica_engine else AsyncSessionLocal
+
+
+async def run_in_session(func, *args, sessions=AsyncSessionLocal, **kwargs):
+    """
+    Run func(*args, db=session, **kwargs) on its own pooled session from sessions.
+    Used to run independent queries concurrently, a single AsyncSession can't run more than one at a time.
+    """
+    async with sessions() as session:
+        return await func(*args, db=session, **kwargs)
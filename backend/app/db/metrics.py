@@ -0,0 +1,93 @@
+from app.core.metrics import Counter, Gauge, Histogram
+from app.db.query_stats import record_query
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import time
+
+QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "Time from sending a statement to its result, per engine and statement type",
+    ("engine", "operation"),
+)
+QUERY_ERRORS = Counter("db_query_errors_total", "Statements that raised an error, per engine", ("engine",))
+POOL_CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection, including opening a new one, per engine",
+    ("engine",),
+)
+POOL_TIMEOUTS = Counter(
+    "db_pool_timeouts_total", "Checkouts that gave up after DB_POOL_TIMEOUT because the pool was exhausted", ("engine",)
+)
+
+OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY"}
+
+engines = {}
+
+
+def operation(statement: str) -> str:
+    """
+    First keyword of the statement, everything that isn't a common DML statement is "OTHER"
+    """
+    words = statement[:64].split(None, 1)  # Only the start, statements with many VALUES rows can be long
+    keyword = words[0].upper() if words else ""
+    return keyword if keyword in OPERATIONS else "OTHER"
+
+
+def timed_pool(engine_name: str):
+    """
+    An AsyncAdaptedQueuePool class that records how long checkouts of the named engine wait for a connection.
+    A class per engine rather than an attribute on the pool, so the name survives engine.dispose() recreating the pool.
+    """
+
+    class TimedPool(AsyncAdaptedQueuePool):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            except PoolTimeoutError:
+                POOL_TIMEOUTS.inc(engine_name)
+                raise
+            finally:
+                POOL_CHECKOUT_WAIT.observe(time.perf_counter() - start, engine_name)
+
+    return TimedPool
+
+
+def instrument_engine(engine: AsyncEngine, engine_name: str):
+    """
+    Time every statement run on the engine, for the metrics and for the request's QueryStats and slow query log.
+    The engine's pool is reported at scrape time, see POOL_CONNECTIONS.
+    """
+    engines[engine_name] = engine
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context._query_start
+        QUERY_DURATION.observe(duration, engine_name, operation(statement))
+        record_query(engine, statement, parameters, duration, executemany)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def query_error(exception_context):
+        QUERY_ERRORS.inc(engine_name)
+
+
+def pool_connections() -> dict:
+    values = {}
+    for name, engine in engines.items():
+        pool = engine.pool
+        values[(name, "size")] = pool.size()
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "idle")] = pool.checkedin()
+        values[(name, "overflow")] = max(pool.overflow(), 0)
+    return values
+
+
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Connections of each engine's pool: configured size, checked out, idle and overflow",
+    ("engine", "state"), function=pool_connections,
+)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Numeric, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Numeric, DateTime, Date, Boolean, Index, JSON, func
 from .database import Base
 from sqlalchemy.orm import relationship
 from uuid import uuid4
@@ -13,6 +13,8 @@ class User(Base):
     name = Column(String)
     picture = Column(String)
     google_id = Column(String, unique=True)  # sub from Google
+    # Bumped whenever the user's accounts or transactions change, part of the response cache key
+    data_version = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Create link to bank requisitions
     requisitions = relationship("BankRequisition", back_populates="user", cascade="all, delete-orphan")
@@ -53,6 +55,9 @@ class Account(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     balance = Column(Numeric, nullable=False)                # Account balance
     balance_updated_at = Column(DateTime(timezone=True), default=datetime.now(timezone.utc))
+    # Sync watermarks: when transactions were last synced and the latest booking date seen so far
+    last_synced_at = Column(DateTime(timezone=True), nullable=True)
+    last_booked_date = Column(DateTime, nullable=True)
 
     transactions = relationship("Transaction", back_populates="account", cascade="all, delete-orphan")
     requisition = relationship("BankRequisition", back_populates="accounts")
@@ -75,6 +80,13 @@ class Transaction(Base):
     account = relationship("Account", back_populates="transactions")
     status = Column(String, nullable=True)  # Status of the transaction (e.g. "pending", "completed")
 
+    __table_args__ = (
+        # Matches the (booking_date DESC, id) order of /transactions, so keyset pages are read straight from the index
+        Index("ix_transactions_account_booking_date_id", account_id, booking_date.desc(), id),
+        # Matches the per account and sign ranking of the top transactions, largest amounts first
+        Index("ix_transactions_account_sign_abs_amount", account_id, func.sign(amount), func.abs(amount).desc()),
+    )
+
     def as_dict(self):
         return {
             "id": self.id,
@@ -92,4 +104,70 @@ class Transaction(Base):
             "transaction_type": self.transaction_type,
             "created_at": self.created_at.isoformat(),
             "status": self.status,
-        }
\ No newline at end of file
+        }
+
+
+class SyncJob(Base):
+    """
+    Queue of background sync jobs for accounts.
+    Jobs are enqueued and claimed (FOR UPDATE SKIP LOCKED) by the scheduler in app/services/sync_scheduler.py
+    """
+    __tablename__ = "sync_jobs"
+    id = Column(Integer, primary_key=True)
+    account_id = Column(String, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String, nullable=False, default="queued")  # queued, running, done or failed
+    run_after = Column(DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # At most one queued or running job per account
+        Index(
+            "uq_sync_jobs_active_account",
+            "account_id",
+            unique=True,
+            postgresql_where=status.in_(["queued", "running"]),
+        ),
+        Index("ix_sync_jobs_status_run_after", "status", "run_after"),
+    )
+
+
+class InstitutionCatalogue(Base):
+    """
+    Persisted copy of the GoCardless institution list per country.
+    Read by the institution cache in app/services/institution_cache.py, so the list survives restarts
+    and can be served while GoCardless is unavailable
+    """
+    __tablename__ = "institution_catalogues"
+    country_code = Column(String, primary_key=True)  # fx "DK"
+    institutions = Column(JSON, nullable=False)  # Institutions as returned by GoCardless
+    etag = Column(String, nullable=False)
+    fetched_at = Column(DateTime(timezone=True), nullable=False)
+
+
+class AccountTransactionCount(Base):
+    """
+    Number of transactions per account and status, kept up to date by save_transactions
+    so pagination totals don't have to count the transactions table
+    """
+    __tablename__ = "account_transaction_counts"
+    account_id = Column(String, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String, primary_key=True)  # booked, pending or unknown for old rows without a status
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DailyAccountRollup(Base):
+    """
+    Income, expenses and number of transactions per account, booking day and currency.
+    Kept up to date by save_transactions so summaries and charts aggregate days instead of transactions
+    """
+    __tablename__ = "daily_account_rollups"
+    account_id = Column(String, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    currency = Column(String, primary_key=True)
+    income = Column(Numeric, nullable=False, default=0)  # Sum of positive amounts
+    expenses = Column(Numeric, nullable=False, default=0)  # Sum of negative amounts, stays negative
+    tx_count = Column(Integer, nullable=False, default=0)
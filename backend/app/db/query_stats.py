@@ -0,0 +1,124 @@
+from app.core.cache import TTLCache
+from app.core.config import settings
+from contextvars import ContextVar
+from sqlalchemy.ext.asyncio import AsyncEngine
+import asyncio
+import logging
+import random
+import re
+
+logger = logging.getLogger(__name__)  # Set up a logger for this module
+
+QUERY_STATS_SAMPLE_RATE = settings.query_stats_sample_rate
+QUERY_REPEAT_THRESHOLD = settings.query_repeat_threshold
+SLOW_QUERY_SECONDS = settings.slow_query_seconds
+SLOW_QUERY_EXPLAIN = settings.slow_query_explain
+# The same slow statement is explained at most once in this many seconds
+EXPLAIN_INTERVAL = 300
+
+# Expanded IN lists get a placeholder per value, "$3, $4, $5" is collapsed so every length counts as the same statement
+PLACEHOLDER_LIST = re.compile(r"\$\d+(?:\s*,\s*\$\d+)*")
+# Statements EXPLAIN accepts
+EXPLAINABLE = {"SELECT", "WITH", "INSERT", "UPDATE", "DELETE"}
+
+
+class QueryStats:
+    """
+    Statements run while handling one request, with the total time they took.
+    Every request gets one so slow queries can say where they came from, only sampled requests count statements.
+    """
+
+    __slots__ = ("label", "sampled", "count", "duration", "statements")
+
+    def __init__(self, label: str, sampled: bool):
+        self.label = label
+        self.sampled = sampled
+        self.count = 0
+        self.duration = 0.0
+        self.statements = {}  # Times each statement ran, with IN lists collapsed
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        key = PLACEHOLDER_LIST.sub("$n", statement)
+        self.statements[key] = self.statements.get(key, 0) + 1
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> list:
+        """
+        (times run, statement) of the statements run at least threshold times, most repeated first
+        """
+        return sorted(((count, key) for key, count in self.statements.items() if count >= threshold), reverse=True)
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.duration * 1000:.1f};desc="{self.count} queries"'
+
+    def report(self):
+        logger.info("%s: %d queries, %.1fms in the database", self.label, self.count, self.duration * 1000)
+        for count, statement in self.repeated():
+            logger.warning("%s ran the same statement %d times, likely N+1: %s", self.label, count, shorten(statement))
+
+
+current_stats: ContextVar = ContextVar("query_stats", default=None)
+
+explained = TTLCache(maxsize=1024, ttl=EXPLAIN_INTERVAL)
+# Running EXPLAIN tasks, referenced so they aren't garbage collected before they finish
+explains = set()
+
+
+def start_request(label: str) -> QueryStats:
+    """
+    QueryStats for a request, sampled with probability QUERY_STATS_SAMPLE_RATE
+    """
+    sampled = QUERY_STATS_SAMPLE_RATE > 0 and random.random() < QUERY_STATS_SAMPLE_RATE
+    return QueryStats(label, sampled)
+
+
+def shorten(statement: str, length: int = 500) -> str:
+    statement = " ".join(statement.split())
+    return statement if len(statement) <= length else statement[:length] + "..."
+
+
+def record_query(engine: AsyncEngine, statement: str, parameters, duration: float, executemany: bool):
+    """
+    Called for every statement with the time it took
+    """
+    stats = current_stats.get()
+    if stats is not None and stats.sampled:
+        stats.record(statement, duration)
+    if SLOW_QUERY_SECONDS and duration >= SLOW_QUERY_SECONDS:
+        slow_query(engine, statement, parameters, duration, executemany, stats)
+
+
+def slow_query(engine: AsyncEngine, statement: str, parameters, duration: float, executemany: bool,
+               stats: QueryStats = None):
+    """
+    Log a slow statement, and its plan once per EXPLAIN_INTERVAL. The plan is fetched on another connection
+    in the background, the statement's own connection is still in use.
+    """
+    origin = f" in {stats.label}" if stats is not None else ""
+    logger.warning("Slow query%s took %.0fms: %s", origin, duration * 1000, shorten(statement))
+    key = PLACEHOLDER_LIST.sub("$n", statement)
+    words = statement[:64].split(None, 1)
+    if (
+        not SLOW_QUERY_EXPLAIN or executemany or not words or words[0].upper() not in EXPLAINABLE
+        or explained.get(key) is not None
+    ):
+        return
+    explained.set(key, True)
+    task = asyncio.get_running_loop().create_task(explain(engine, statement, parameters))
+    explains.add(task)
+    task.add_done_callback(explains.discard)
+
+
+async def explain(engine: AsyncEngine, statement: str, parameters):
+    """
+    Log the plan of a statement with the parameters it ran with. EXPLAIN without ANALYZE, the statement isn't run again.
+    """
+    try:
+        async with engine.connect() as connection:
+            raw = await connection.get_raw_connection()
+            rows = await raw.driver_connection.fetch("EXPLAIN " + statement, *(parameters or ()))
+    except Exception as e:
+        logger.warning("Couldn't explain slow query: %s", e)
+        return
+    logger.warning("Plan of slow query %s\n%s", shorten(statement, 120), "\n".join(row[0] for row in rows))
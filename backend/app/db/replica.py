@@ -0,0 +1,130 @@
+from app.core.cache import TTLCache
+from app.core.config import settings
+from app.db.database import replica_engine
+from app.db.models import User
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.future import select
+from sqlalchemy import text
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)  # Set up a logger for this module
+
+REPLICA_MAX_LAG = settings.replica_max_lag
+REPLICA_CHECK_INTERVAL = settings.replica_check_interval
+REPLICA_CHECK_TIMEOUT = settings.replica_check_timeout
+REPLICA_PIN_SECONDS = settings.replica_pin_seconds
+
+# Seconds the replica is behind the primary. A replica that has replayed everything it received from a streaming
+# primary is up to date, even when the last replayed transaction is old because the primary had nothing to send.
+# Otherwise the age of the last replayed transaction is the lag, infinite when nothing was replayed yet.
+LAG_QUERY = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+            AND EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN 0
+        ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 'Infinity')
+    END
+""")
+
+
+class ReplicaRouter:
+    """
+    Decides per request whether a user's reads can go to the read replica.
+
+    The replica is used while its measured lag is at most max_lag, and never for a user who is pinned to the primary.
+    Users are pinned for pin_seconds when a commit in this process bumps their data_version, so the requests right
+    after a sync or import read what was just written. Otherwise the data_version of the cached user, the same one the
+    response cache is keyed on, is compared with the one on the replica, which only takes a replica query the first
+    time each version is seen. Writes from other processes are seen once their cached user expires after
+    USER_CACHE_TTL, until then both caches serve the version before the write.
+    """
+
+    def __init__(self, engine: AsyncEngine = replica_engine, max_lag: float = REPLICA_MAX_LAG,
+                 check_interval: float = REPLICA_CHECK_INTERVAL, check_timeout: float = REPLICA_CHECK_TIMEOUT,
+                 pin_seconds: float = REPLICA_PIN_SECONDS):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.check_timeout = check_timeout
+        # Last measured lag in seconds, None when the replica couldn't be reached
+        self.lag = None
+        self.checked_at = float("-inf")
+        self.pins = TTLCache(maxsize=settings.user_cache_size, ttl=pin_seconds)
+        # Highest data_version of each user known to be on the replica, versions only go up so this never goes stale
+        self.versions = TTLCache(maxsize=settings.user_cache_size, ttl=float("inf"))
+        self.reads = {"replica": 0, "primary": 0}
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.engine is not None
+
+    def pin(self, user_id: int):
+        if self.enabled:
+            self.pins.set(user_id, True)
+
+    async def use_replica(self, user_id: int, data_version: int) -> bool:
+        """
+        Whether the reads of a request by this user, who is at data_version, can go to the replica
+        """
+        replica = (
+            self.enabled
+            and self.pins.get(user_id) is None
+            and await self.healthy()
+            and await self.caught_up(user_id, data_version)
+        )
+        self.reads["replica" if replica else "primary"] += 1
+        return replica
+
+    async def healthy(self) -> bool:
+        """
+        Whether the replica is reachable and at most max_lag behind. The lag is measured at most once per
+        check_interval, requests arriving while a check runs use the previous result instead of waiting for it.
+        """
+        if time.monotonic() - self.checked_at >= self.check_interval and not self._lock.locked():
+            async with self._lock:
+                self.lag = await self._measure_lag()
+                self.checked_at = time.monotonic()
+        return self.lag is not None and self.lag <= self.max_lag
+
+    async def caught_up(self, user_id: int, data_version: int) -> bool:
+        known = self.versions.get(user_id)
+        if known is not None and known >= data_version:
+            return True
+        try:
+            version = await self._scalar(select(User.data_version).where(User.id == user_id))
+        except Exception as e:
+            logger.warning("Couldn't read data_version of user %s from the replica: %s", user_id, e)
+            return False
+        if version is None or version < data_version:
+            return False
+        self.versions.set(user_id, version)
+        return True
+
+    async def _scalar(self, stmt):
+        """
+        Run stmt on the replica, giving up after check_timeout including the time to connect
+        """
+        async def scalar():
+            async with self.engine.connect() as connection:
+                return await connection.scalar(stmt)
+
+        return await asyncio.wait_for(scalar(), self.check_timeout)
+
+    async def _measure_lag(self):
+        try:
+            lag = float(await self._scalar(LAG_QUERY))
+        except Exception as e:
+            logger.warning("Replica lag check failed, reading from the primary: %s", e)
+            return None
+        if lag > self.max_lag:
+            logger.warning("Replica is %.1fs behind, reading from the primary", lag)
+        return lag
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "lag": self.lag, "pinned_users": len(self.pins), **self.reads}
+
+
+replica_router = ReplicaRouter()
@@ -1,21 +1,29 @@
-from fastapi import Depends, HTTPException, status, Header
+from fastapi import Depends, HTTPException, status, Header, Request
+from contextlib import asynccontextmanager
 from jose import JWTError, jwt
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.db.database import get_db
+from app.db.database import get_db, ReadSessionLocal
+from app.db.replica import replica_router
 from app.db.models import User
+from app.services.openbanking import OpenBankingService
+from app.services.institution_cache import InstitutionCache
 from sqlalchemy.future import select
-from dotenv import load_dotenv
-import os
-load_dotenv()
+from sqlalchemy import event
+from app.core.cache import user_cache
+from app.core.config import settings
 
-JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret")
+JWT_SECRET = settings.jwt_secret
+GOCARDLESS_SECRET_ID = settings.gocardless_secret_id
+GOCARDLESS_SECRET_NAME = settings.gocardless_secret_name
+GOCARDLESS_SECRET_KEY = settings.gocardless_secret_key
 
 async def get_current_user(
         authorization: str = Header(...),
         db: AsyncSession = Depends(get_db)
 ) -> User:
     """
-    Dependency to get the current user from the JWT token in the Authorization header
+    Dependency to get the current user from the JWT token in the Authorization header.
+    Users are served from user_cache, so most authenticated requests don't query the database for the user.
     """
     try:
         token = authorization.split(" ")[1]
@@ -23,13 +31,82 @@ async def get_current_user(
         user_id = payload.get("user_id")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
-        
+
+        user = user_cache.get(user_id)
+        if user is not None:
+            return user
+
         result = await db.execute(select(User).where(User.id == user_id))
         user = result.scalar_one_or_none()
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
+        # Detach the user so the cached copy isn't tied to this request's session
+        db.expunge(user)
+        user_cache.set(user_id, user)
         return user
     
     except (JWTError, IndexError):
         raise HTTPException(status_code=401, detail="Invalid authorization header")
-        
\ No newline at end of file
+
+
+@asynccontextmanager
+async def read_session(user: User, db: AsyncSession):
+    """
+    A session for the user's reads: the replica when one is configured, is caught up with the user's data_version
+    and isn't lagging, otherwise db, the request's primary session
+    """
+    if not await replica_router.use_replica(user.id, user.data_version):
+        yield db
+        return
+    async with ReadSessionLocal() as session:
+        yield session
+
+
+async def get_read_db(
+        current_user: User = Depends(get_current_user),
+        db: AsyncSession = Depends(get_db)
+):
+    """
+    Dependency to get a session for read-only routes, see read_session.
+    Routes wrapped in cached_response take get_db instead, the wrapper only routes the reads of a cache miss.
+    """
+    async with read_session(current_user, db) as session:
+        yield session
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_user(mapper, connection, target):
+    """
+    Drop a user from user_cache when the row is changed through the ORM.
+    Other processes and bulk UPDATE statements are not seen here, for those the entry expires after USER_CACHE_TTL.
+    """
+    user_cache.invalidate(target.id)
+
+
+def build_openbanking_service(state) -> OpenBankingService:
+    """
+    Build an OpenBankingService that uses the shared HTTP client, token manager and rate limiter kept on the app state
+    """
+    return OpenBankingService(
+        secret_id=GOCARDLESS_SECRET_ID,
+        secret_name=GOCARDLESS_SECRET_NAME,
+        secret_key=GOCARDLESS_SECRET_KEY,
+        client=getattr(state, "http_client", None),
+        token_manager=getattr(state, "token_manager", None),
+        rate_limiter=getattr(state, "rate_limiter", None),
+    )
+
+
+def get_openbanking_service(request: Request) -> OpenBankingService:
+    """
+    Dependency to get an OpenBankingService that uses the shared HTTP client, token manager and rate limiter created in the app lifespan
+    """
+    return build_openbanking_service(request.app.state)
+
+
+def get_institution_cache(request: Request) -> InstitutionCache:
+    """
+    Dependency to get the institution cache created in the app lifespan
+    """
+    return request.app.state.institution_cache
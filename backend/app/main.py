@@ -5,6 +5,16 @@ from app.api.auth_router import router as auth_router
 from app.api.openbanking_router import router as openbanking_router
 from fastapi.middleware.cors import CORSMiddleware
 from app.api.account_info_router import router as account_info_router
+from app.api.metrics import router as metrics_router, MetricsMiddleware, QueryStatsMiddleware
+from app.api.responses import FastJSONResponse
+from app.core.config import settings
+from app.services.openbanking import create_http_client
+from app.services.token_manager import TokenManager
+from app.services.rate_limit import RateLimiter
+from app.services.institution_cache import InstitutionCache
+from app.services.sync_scheduler import SyncScheduler, SYNC_SCHEDULER_ENABLED
+from app.dependencies import GOCARDLESS_SECRET_ID, GOCARDLESS_SECRET_KEY, build_openbanking_service
+from contextlib import asynccontextmanager
 import logging
 
 # Configure global logging config
@@ -21,8 +31,35 @@ if not logger.handlers:
     logger.addHandler(handler)
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled client for all GoCardless calls, so connections are reused between requests
+    app.state.http_client = create_http_client()
+    # Access tokens are cached for the whole process instead of being issued per request
+    app.state.token_manager = TokenManager(
+        secret_id=GOCARDLESS_SECRET_ID,
+        secret_key=GOCARDLESS_SECRET_KEY,
+        client=app.state.http_client,
+    )
+    # Rate limit buckets per (account, endpoint), shared by requests and the sync scheduler
+    app.state.rate_limiter = RateLimiter()
+    # Institution lists are cached per country and refreshed in the background once stale
+    app.state.institution_cache = InstitutionCache(lambda: build_openbanking_service(app.state))
+    # Background sync of all accounts, so requests read fresh data without syncing inline
+    scheduler = None
+    if SYNC_SCHEDULER_ENABLED:
+        scheduler = SyncScheduler(lambda: build_openbanking_service(app.state))
+        scheduler.start()
+    try:
+        yield
+    finally:
+        if scheduler is not None:
+            await scheduler.stop()
+        await app.state.institution_cache.close()
+        await app.state.http_client.aclose()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -37,3 +74,12 @@ app.include_router(router)
 app.include_router(auth_router, tags=["Auth"])
 app.include_router(openbanking_router, tags=["Open Banking"])
 app.include_router(account_info_router, tags=["Account Info"])
+
+# Statement counts per request, N+1 warnings and the origin of slow queries, see QUERY_STATS_SAMPLE_RATE
+app.add_middleware(QueryStatsMiddleware)
+
+# Latency, status and in-flight requests per route, exposed with the database and upstream metrics on /metrics.
+# Added last so it's the outermost middleware and times the whole request.
+if settings.metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router)
@@ -0,0 +1,249 @@
+from app.db.database import run_in_session, session_factory
+from app.db.models import Account, BankRequisition, Transaction, DailyAccountRollup
+from app.services.rollups import first_day_from
+from app.services.pagination import keyset_page_query, transaction_columns, transaction_listing, listing_dicts
+from app.services.columnar import UserColumns
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import func, cast, column, values, true, DateTime, Integer, String
+from fastapi.encoders import jsonable_encoder
+from datetime import datetime, date, time, timedelta
+import asyncio
+from app.core.config import settings
+
+# Most queries a single dashboard request runs at the same time, each on its own pooled connection
+DASHBOARD_CONCURRENCY = settings.dashboard_concurrency
+
+# Start of the chart window and the date_trunc unit for each chart interval
+CHART_INTERVALS = {
+    "daily": (timedelta(days=7), "day"),
+    "weekly": (timedelta(weeks=6), "week"),
+    "monthly": (timedelta(days=30 * 6), "month"),
+    "yearly": (timedelta(days=365 * 5), "year"),
+}
+
+# Top transactions with equal amounts are ranked by id in byte order, like UserColumns.top_transactions does,
+# so the ranking doesn't depend on the database collation or on whether the columnar cache is warm
+TOP_TIE_BREAK = Transaction.id.collate("C")
+
+
+async def user_accounts(user_id: int, db: AsyncSession) -> list:
+    """
+    All accounts belonging to the user
+    """
+    result = await db.execute(
+        select(Account)
+        .join(BankRequisition)
+        .where(BankRequisition.user_id == user_id)
+    )
+    return result.scalars().all()
+
+
+async def account_summaries(account_ids: list, db: AsyncSession, columns: UserColumns = None) -> dict:
+    """
+    Money in and out over the last 30 days per account, read from the daily rollups in one query,
+    or computed from the user's cached columns when given.
+    Accounts without transactions in the period are left out.
+    """
+    thirty_days_ago = datetime.now() - timedelta(days=30)
+    if columns is not None:
+        return columns.account_summaries(account_ids, first_day_from(thirty_days_ago))
+    result = await db.execute(
+        select(
+            DailyAccountRollup.account_id,
+            func.sum(DailyAccountRollup.expenses),
+            func.sum(DailyAccountRollup.income),
+        )
+        .where(
+            DailyAccountRollup.account_id.in_(account_ids),
+            DailyAccountRollup.day >= first_day_from(thirty_days_ago),
+        )
+        .group_by(DailyAccountRollup.account_id)
+    )
+    return {
+        account_id: {
+            "money_out": float(money_out or 0),
+            "money_in": abs(float(money_in or 0)),  # absolute value for money in
+        }
+        for account_id, money_out, money_in in result.all()
+    }
+
+
+async def revenue_chart(account_ids: list, interval: str, db: AsyncSession, columns: UserColumns = None) -> list:
+    """
+    Income and expenses per period for the chart on the dashboard.
+    Aggregated from the daily rollups, so the cost depends on the number of days and not on the number of transactions,
+    or from the user's cached columns when given.
+    """
+    # Brug naive datetimes (uden timezone)
+    now = datetime.utcnow()
+    window, unit = CHART_INTERVALS[interval]
+    if columns is not None:
+        periods = columns.revenue_chart(account_ids, unit, first_day_from(now - window))
+    else:
+        periods = await revenue_chart_periods(account_ids, unit, first_day_from(now - window), db)
+    return [
+        {
+            "date": period.strftime("%d %b" if interval != "yearly" else "%Y"),
+            "income": float(income),
+            "expenses": abs(float(expenses)),
+        }
+        for period, income, expenses in periods
+    ]
+
+
+async def revenue_chart_periods(account_ids: list, unit: str, since: date, db: AsyncSession) -> list:
+    """
+    (start of period, income, expenses) per date_trunc unit from the daily rollups, for days on or after since
+    """
+    period = func.date_trunc(unit, cast(DailyAccountRollup.day, DateTime))
+    stmt = (
+        select(
+            period.label("period"),
+            func.sum(DailyAccountRollup.income).label("income"),
+            func.sum(DailyAccountRollup.expenses).label("expenses"),
+        )
+        .where(
+            DailyAccountRollup.account_id.in_(account_ids),
+            DailyAccountRollup.day >= since
+        )
+        .group_by("period")
+        # Days whose transactions have all moved or been deleted are left with a zero count
+        .having(func.sum(DailyAccountRollup.tx_count) > 0)
+        .order_by("period")
+    )
+    result = await db.execute(stmt)
+    return result.all()
+
+
+def period_start(period: str, today: date = None) -> datetime:
+    """
+    Midnight on the first day of the current week, month, quarter or year, or None for "all"
+    """
+    today = today or datetime.utcnow().date()
+    if period == "week":
+        start = today - timedelta(days=today.weekday())
+    elif period == "month":
+        start = today.replace(day=1)
+    elif period == "quarter":
+        start = today.replace(month=(today.month - 1) // 3 * 3 + 1, day=1)
+    elif period == "year":
+        start = today.replace(month=1, day=1)
+    elif period == "all":
+        return None
+    else:
+        raise ValueError(f"Unknown period {period}")
+    return datetime.combine(start, time())
+
+
+async def top_transactions_by_account(
+    account_ids: list, db: AsyncSession, n: int = 3, period: str = "month", columns: UserColumns = None
+) -> dict:
+    """
+    The n largest incomes and expenses of every account in the period, in a single query.
+    Every (account, sign of the amount) pair reads its n largest amounts straight from ix_transactions_account_sign_abs_amount
+    through a LATERAL subquery, and ROW_NUMBER() ranks them per pair. The cost grows with accounts * n instead of with
+    the number of transactions in the period. Returns {account_id: {"income": [...], "expenses": [...]}}.
+    With the user's cached columns the ranking is done on the arrays and only the winning rows are read, by primary key.
+    """
+    top = {account_id: {"income": [], "expenses": []} for account_id in account_ids}
+    if not account_ids or n < 1:
+        return top
+    start = period_start(period)
+    if columns is not None:
+        ranked = columns.top_transactions(account_ids, n, first_day_from(start) if start is not None else None)
+        if ranked:
+            result = await db.execute(transaction_listing().where(Transaction.id.in_([tx_id for tx_id, _, _ in ranked])))
+            rows = {tx["id"]: tx for tx in listing_dicts(result)}
+            for tx_id, account_id, sign in ranked:
+                if tx_id in rows:
+                    top[account_id]["income" if sign > 0 else "expenses"].append(rows[tx_id])
+        return top
+    pairs = values(column("account_id", String), column("sign", Integer), name="pairs").data(
+        [(account_id, sign) for account_id in account_ids for sign in (1, -1)]
+    )
+    largest = (
+        select(Transaction.id, func.abs(Transaction.amount).label("abs_amount"))
+        .where(Transaction.account_id == pairs.c.account_id, func.sign(Transaction.amount) == pairs.c.sign)
+        .order_by(func.abs(Transaction.amount).desc(), TOP_TIE_BREAK)
+        .limit(n)
+    )
+    if start is not None:
+        largest = largest.where(Transaction.booking_date >= start)
+    # Only pairs comes from the outer query, transactions is joined again outside the subquery
+    largest = largest.correlate(pairs).lateral("largest")
+    rank = func.row_number().over(
+        partition_by=(pairs.c.account_id, pairs.c.sign),
+        order_by=(largest.c.abs_amount.desc(), largest.c.id.collate("C")),
+    )
+    result = await db.execute(
+        select(*transaction_columns(), pairs.c.sign)
+        .select_from(pairs)
+        .join(largest, true())
+        .join(Transaction, Transaction.id == largest.c.id)
+        .join(Account, Account.id == Transaction.account_id)
+        .order_by(pairs.c.account_id, pairs.c.sign.desc(), rank)
+    )
+    for tx in listing_dicts(result):
+        sign = tx.pop("sign")
+        top[tx["account_id"]]["income" if sign > 0 else "expenses"].append(tx)
+    return top
+
+
+async def top_transactions(
+    account_id: str, db: AsyncSession, n: int = 3, period: str = "month", columns: UserColumns = None
+) -> dict:
+    """
+    The n largest incomes and expenses on a single account in the period
+    """
+    top = await top_transactions_by_account([account_id], db, n=n, period=period, columns=columns)
+    return {**top[account_id], "account_id": account_id}
+
+
+async def latest_transactions(account_ids: list, db: AsyncSession, limit: int = 10) -> list:
+    """
+    The most recent transactions across the accounts, newest first. Same order as the first page of /transactions.
+    """
+    if not account_ids:
+        return []
+    result = await db.execute(keyset_page_query(account_ids, limit))
+    return listing_dicts(result)
+
+
+async def dashboard(
+    user_id: int, db: AsyncSession, interval: str = "weekly", latest: int = 10, columns: UserColumns = None
+) -> dict:
+    """
+    Everything the dashboard page shows: the accounts with their summary and top transactions,
+    the revenue chart and the latest transactions.
+    The accounts are looked up once, after that the queries only depend on the account IDs and run concurrently.
+    With the user's cached columns the summaries and the chart don't query at all.
+    """
+    accounts = await user_accounts(user_id, db)
+    account_ids = [account.id for account in accounts]
+    semaphore = asyncio.Semaphore(DASHBOARD_CONCURRENCY)
+    sessions = session_factory(db)  # The replica when db reads from it
+
+    async def run(func, *args, **kwargs):
+        async with semaphore:
+            return await run_in_session(func, *args, sessions=sessions, **kwargs)
+
+    summaries, chart, latest_transactions_, tops = await asyncio.gather(
+        run(account_summaries, account_ids, columns=columns),
+        run(revenue_chart, account_ids, interval, columns=columns),
+        run(latest_transactions, account_ids, limit=latest),
+        run(top_transactions_by_account, account_ids, columns=columns),
+    )
+    return {
+        "accounts": [
+            {
+                **jsonable_encoder(account),
+                "summary": summaries.get(account.id, {"money_out": 0.0, "money_in": 0.0}),
+                "top_transactions": tops[account.id],
+            }
+            for account in accounts
+        ],
+        "revenue_chart": chart,
+        "latest_transactions": latest_transactions_,
+        "interval": interval,
+    }
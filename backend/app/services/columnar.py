@@ -0,0 +1,311 @@
+from app.db.models import User, BankRequisition, Account, Transaction
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy import func, cast, type_coerce, literal, BigInteger, Date, Integer
+from collections import OrderedDict
+from datetime import date
+import asyncio
+import logging
+from app.core.config import settings
+import weakref
+
+try:
+    import numpy as np
+except ImportError:  # Optional, analytics run as SQL queries without it
+    np = None
+
+logger = logging.getLogger(__name__)  # Set up a logger for this module
+
+# Memory budget for the arrays of all cached users, per process. 0 turns the cache off.
+COLUMNAR_CACHE_MAX_BYTES = settings.columnar_cache_max_bytes
+# Amounts are kept as integers in minor units, øre and cents
+MINOR_UNITS = 100
+# Above this many changed transactions a cached user is rebuilt instead of patched
+COLUMNAR_MAX_PATCH = settings.columnar_max_patch
+
+EPOCH = date(1970, 1, 1)
+
+
+def day_number(day: date) -> int:
+    """
+    Days since 1970-01-01, the unit of UserColumns.day
+    """
+    return (day - EPOCH).days
+
+
+def column_query():
+    """
+    The cached columns of transactions as one row per account with an array per column, converted by Postgres:
+    amount in minor units and booking date as a day number
+    """
+    return select(
+        Transaction.account_id,
+        func.array_agg(Transaction.id),
+        func.array_agg(cast(func.round(Transaction.amount * MINOR_UNITS), BigInteger)),
+        func.array_agg(type_coerce(cast(Transaction.booking_date, Date) - literal(EPOCH), Integer)),
+        func.array_agg(func.coalesce(Transaction.transaction_type, "Unknown")),
+    ).group_by(Transaction.account_id)
+
+
+class UserColumns:
+    """
+    All transactions of one user as NumPy arrays, one element per transaction:
+    id, amount in minor units, booking date as a day number, account index and category code (transaction_type).
+    The arrays are sorted by day, so a period is a slice found by binary search, and analytics on them
+    are array operations instead of queries.
+    """
+
+    def __init__(self, user_id: int, version: int, accounts: list, rows: list):
+        self.user_id = user_id
+        self.version = version  # data_version of the user the arrays are up to date with
+        self.pending = set()  # GoCardless transaction IDs saved since, applied on the next use
+        self.accounts = list(accounts)
+        self.categories = []
+        self._account_index = {account_id: index for index, account_id in enumerate(self.accounts)}
+        self._category_index = {}
+        self._sort(*self._arrays(rows))
+
+    @property
+    def nbytes(self) -> int:
+        return self.id.nbytes + self.amount.nbytes + self.day.nbytes + self.account.nbytes + self.category.nbytes
+
+    def __len__(self):
+        return len(self.id)
+
+    def _arrays(self, rows: list) -> tuple:
+        """
+        Arrays of the column_query rows. Raises KeyError for an account the user doesn't have.
+        """
+        arrays = ([], [], [], [], [])
+        for account_id, ids, amounts, days, categories in rows:
+            for category in set(categories) - self._category_index.keys():
+                self._category_index[category] = len(self.categories)
+                self.categories.append(category)
+            arrays[0].append(np.array(ids, dtype="S36"))
+            arrays[1].append(np.array(amounts, dtype=np.int64))
+            arrays[2].append(np.array(days, dtype=np.int32))
+            arrays[3].append(np.full(len(ids), self._account_index[account_id], dtype=np.int32))
+            arrays[4].append(np.array([self._category_index[category] for category in categories], dtype=np.int32))
+        dtypes = ("S36", np.int64, np.int32, np.int32, np.int32)
+        return tuple(np.concatenate(parts) if parts else np.empty(0, dtype) for parts, dtype in zip(arrays, dtypes))
+
+    def _sort(self, ids, amount, day, account, category):
+        order = np.argsort(day, kind="stable")
+        self.id, self.amount, self.day = ids[order], amount[order], day[order]
+        self.account, self.category = account[order], category[order]
+
+    def patch(self, rows: list):
+        """
+        Replace the transactions in the column_query rows that are already cached and append the new ones
+        """
+        ids, amount, day, account, category = self._arrays(rows)
+        keep = ~np.isin(self.id, ids)
+        self._sort(
+            np.concatenate([self.id[keep], ids]),
+            np.concatenate([self.amount[keep], amount]),
+            np.concatenate([self.day[keep], day]),
+            np.concatenate([self.account[keep], account]),
+            np.concatenate([self.category[keep], category]),
+        )
+
+    def _window(self, account_ids: list, since: date = None):
+        """
+        Start of the transactions booked on or after since, and a mask of the ones on the given accounts
+        from there on, or None when all of the user's accounts are given
+        """
+        start = 0 if since is None else int(np.searchsorted(self.day, day_number(since)))
+        indexes = {self._account_index[account_id] for account_id in account_ids if account_id in self._account_index}
+        if len(indexes) == len(self.accounts):
+            return start, None
+        selected = np.zeros(len(self.accounts), dtype=bool)
+        selected[list(indexes)] = True
+        return start, selected[self.account[start:]]
+
+    def account_summaries(self, account_ids: list, since: date) -> dict:
+        """
+        Same as analytics.account_summaries, for transactions booked on or after since
+        """
+        start, mask = self._window(account_ids, since)
+        amount, account = self.amount[start:], self.account[start:]
+        if mask is not None:
+            amount, account = amount[mask], account[mask]
+        size = len(self.accounts)
+        counts = np.bincount(account, minlength=size)
+        income = np.bincount(account, weights=np.where(amount > 0, amount, 0), minlength=size)
+        expenses = np.bincount(account, weights=np.where(amount < 0, amount, 0), minlength=size)
+        return {
+            self.accounts[index]: {
+                "money_out": float(expenses[index]) / MINOR_UNITS,
+                "money_in": abs(float(income[index]) / MINOR_UNITS),
+            }
+            for index in np.flatnonzero(counts)
+        }
+
+    def revenue_chart(self, account_ids: list, unit: str, since: date) -> list:
+        """
+        (start of period, income, expenses) per day, week, month or year, the same periods as date_trunc
+        in analytics.revenue_chart_periods
+        """
+        start, mask = self._window(account_ids, since)
+        days, amount = self.day[start:], self.amount[start:]
+        if mask is not None:
+            days, amount = days[mask], amount[mask]
+        if not len(days):
+            return []
+        # Days are sorted, so every day and every period is a run of equal values. Sum per day first,
+        # then only the distinct days need truncating to their period.
+        day_starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        income = np.add.reduceat(np.where(amount > 0, amount, 0), day_starts)
+        expenses = np.add.reduceat(np.where(amount < 0, amount, 0), day_starts)
+        periods = days[day_starts]
+        if unit == "week":
+            periods = periods - (periods + 3) % 7  # 1970-01-01 was a Thursday, weeks start on Monday
+        elif unit in ("month", "year"):
+            periods = periods.astype("datetime64[D]").astype("datetime64[M]" if unit == "month" else "datetime64[Y]")
+            periods = periods.astype("datetime64[D]").astype(np.int32)
+        starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+        income, expenses = np.add.reduceat(income, starts), np.add.reduceat(expenses, starts)
+        return [
+            (date.fromordinal(EPOCH.toordinal() + int(periods[first])), int(income[i]) / MINOR_UNITS, int(expenses[i]) / MINOR_UNITS)
+            for i, first in enumerate(starts)
+        ]
+
+    def top_transactions(self, account_ids: list, n: int, since: date = None) -> list:
+        """
+        (id, account_id, sign) of the n largest incomes and expenses per account, ranked like
+        analytics.top_transactions_by_account: largest amount first, then by id in byte order, which is what
+        TOP_TIE_BREAK sorts by in SQL
+        """
+        start, _ = self._window(account_ids, since)
+        amount, account = self.amount[start:], self.account[start:]
+        top = []
+        for account_id in dict.fromkeys(account_ids):
+            index = self._account_index.get(account_id)
+            if index is None:
+                continue
+            on_account = account == index
+            for sign, in_group in ((1, amount > 0), (-1, amount < 0)):
+                rows = np.flatnonzero(on_account & in_group)
+                size = np.abs(amount[rows])
+                if len(rows) > n:
+                    # Only the rows at least as large as the n-th largest need sorting, ties included
+                    nth = np.partition(size, len(rows) - n)[len(rows) - n]
+                    rows, size = rows[size >= nth], size[size >= nth]
+                rows = rows[np.lexsort((self.id[start:][rows], -size))][:n]
+                top.extend((tx_id.decode(), account_id, sign) for tx_id in self.id[start:][rows])
+        return top
+
+
+class ColumnarCache:
+    """
+    LRU cache of UserColumns per user, bounded by the total size of the arrays.
+    Users are loaded on first use. Transactions saved in this process are patched in on the next use,
+    any other change to the user's data (seen as a data_version the cache doesn't know) reloads the user.
+    """
+
+    def __init__(self, max_bytes: int = COLUMNAR_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}  # Size of each entry when it was stored, patching changes nbytes
+        self._locks = weakref.WeakValueDictionary()
+
+    @property
+    def enabled(self) -> bool:
+        return np is not None and self.max_bytes > 0
+
+    async def get(self, user: User, db: AsyncSession) -> UserColumns:
+        """
+        The user's columns, up to date with user.data_version. None when the cache is turned off,
+        in which case the analytics fall back to SQL.
+        """
+        if not self.enabled:
+            return None
+        lock = self._locks.get(user.id)
+        if lock is None:
+            lock = self._locks[user.id] = asyncio.Lock()
+        async with lock:
+            entry = self._entries.get(user.id)
+            if entry is not None and entry.version == user.data_version:
+                self.hits += 1
+                self._entries.move_to_end(user.id)
+                if entry.pending:
+                    entry = await self._patch(entry, db)
+                if entry is not None:
+                    return entry
+            self.misses += 1
+            return await self._load(user, db)
+
+    async def _load(self, user: User, db: AsyncSession) -> UserColumns:
+        accounts = await db.execute(
+            select(Account.id).join(BankRequisition).where(BankRequisition.user_id == user.id)
+        )
+        account_ids = accounts.scalars().all()
+        result = await db.execute(column_query().where(Transaction.account_id.in_(account_ids)))
+        entry = UserColumns(user.id, user.data_version, account_ids, result.all())
+        self._store(entry)
+        logger.debug("Loaded %s transactions for user %s into the columnar cache", len(entry), user.id)
+        return entry
+
+    async def _patch(self, entry: UserColumns, db: AsyncSession) -> UserColumns:
+        """
+        Apply the pending transactions, or drop the entry when it can't be patched
+        """
+        pending = set(entry.pending)
+        if len(pending) <= COLUMNAR_MAX_PATCH:
+            result = await db.execute(column_query().where(Transaction.transaction_id.in_(pending)))
+            try:
+                entry.patch(result.all())
+            except KeyError:
+                pass  # Moved to an account that isn't cached, reload the user
+            else:
+                entry.pending -= pending
+                self._store(entry)
+                return entry
+        self.invalidate(entry.user_id)
+        return None
+
+    def _store(self, entry: UserColumns):
+        self.invalidate(entry.user_id)
+        if entry.nbytes > self.max_bytes:
+            return  # Too large to cache at all, used for this request only
+        self._entries[entry.user_id] = entry
+        self._sizes[entry.user_id] = entry.nbytes
+        self.size += entry.nbytes
+        while self.size > self.max_bytes:
+            user_id, _ = self._entries.popitem(last=False)  # Least recently used
+            self.size -= self._sizes.pop(user_id)
+
+    def committed(self, versions: dict, written: dict):
+        """
+        Called after a commit that bumped the data_version of users ({user_id: new data_version}) and
+        saved transactions ({account_id: transaction IDs}). An entry that was current before the commit
+        and owns the saved accounts is kept and patched on its next use, other entries of those users are dropped.
+        """
+        for user_id, version in versions.items():
+            entry = self._entries.get(user_id)
+            if entry is None:
+                continue
+            saved = [ids for account_id, ids in written.items() if account_id in entry._account_index]
+            if entry.version == version - 1 and saved:
+                entry.version = version
+                entry.pending.update(*saved)
+            else:
+                self.invalidate(user_id)
+
+    def invalidate(self, user_id: int):
+        if self._entries.pop(user_id, None) is not None:
+            self.size -= self._sizes.pop(user_id)
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {"users": len(self._entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+columnar_cache = ColumnarCache()
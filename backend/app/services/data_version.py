@@ -0,0 +1,59 @@
+from app.db.models import User, BankRequisition, Account
+from app.db.replica import replica_router
+from app.core.cache import user_cache
+from app.services.columnar import columnar_cache
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from sqlalchemy.orm import Session
+from sqlalchemy import event, update
+
+
+async def bump_data_version(db: AsyncSession, account_ids: list = None, requisition_id: str = None):
+    """
+    Bump data_version of the users owning the given accounts or requisition, in the caller's transaction.
+    Cached responses are keyed on data_version, so this makes them miss once the change is committed.
+    """
+    owners = select(BankRequisition.user_id)
+    if account_ids is not None:
+        owners = owners.join(Account).where(Account.id.in_(account_ids))
+    if requisition_id is not None:
+        owners = owners.where(BankRequisition.id == requisition_id)
+    result = await db.execute(
+        update(User)
+        .where(User.id.in_(owners))
+        .values(data_version=User.data_version + 1)
+        .returning(User.id, User.data_version)
+        .execution_options(synchronize_session=False)
+    )
+    db.sync_session.info.setdefault("bumped_users", {}).update(result.tuples().all())
+
+
+def record_saved_transactions(db: AsyncSession, account_id: str, transaction_ids):
+    """
+    Remember the transactions saved on an account in the caller's transaction, so the columnar cache
+    can patch them in after the commit instead of reloading the user
+    """
+    db.sync_session.info.setdefault("saved_transactions", {}).setdefault(account_id, set()).update(transaction_ids)
+
+
+@event.listens_for(Session, "after_commit")
+def refresh_bumped_users(session):
+    """
+    Drop users whose data_version was bumped from user_cache once the new version is committed,
+    so the next request reads it. Doing it before the commit could cache the old version again.
+    The columnar cache is told which versions and transactions were committed, and the users' reads are pinned
+    to the primary until the replica has the change.
+    """
+    versions = session.info.pop("bumped_users", {})
+    saved = session.info.pop("saved_transactions", {})
+    for user_id in versions:
+        user_cache.invalidate(user_id)
+        replica_router.pin(user_id)
+    if versions:
+        columnar_cache.committed(versions, saved)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_bumped_users(session):
+    session.info.pop("bumped_users", None)
+    session.info.pop("saved_transactions", None)
@@ -0,0 +1,134 @@
+from app.db.database import AsyncSessionLocal
+from app.db.models import InstitutionCatalogue
+from app.services.openbanking import OpenBankingService
+from sqlalchemy.dialects.postgresql import insert
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+import asyncio
+import hashlib
+import json
+import logging
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)  # Set up a logger for this module
+
+# How long a fetched institution list is served without checking GoCardless again
+INSTITUTIONS_TTL = timedelta(hours=settings.institutions_ttl_hours)
+# max-age sent to browsers, kept short so they pick up a refreshed list reasonably fast
+INSTITUTIONS_BROWSER_MAX_AGE = settings.institutions_browser_max_age
+
+
+class CatalogueEntry:
+    """
+    Institution list for one country, with the JSON response body serialized once up front
+    """
+
+    def __init__(self, country_code: str, institutions: list, fetched_at: datetime, etag: str = None):
+        self.country_code = country_code
+        self.institutions = institutions
+        self.fetched_at = fetched_at
+        self.body = json.dumps({"banks": institutions}, separators=(",", ":")).encode()
+        self.etag = etag or '"%s"' % hashlib.sha256(self.body).hexdigest()[:32]
+
+    def is_stale(self, ttl: timedelta) -> bool:
+        return datetime.now(timezone.utc) - self.fetched_at > ttl
+
+
+class InstitutionCache:
+    """
+    Per-country cache of the GoCardless institution list, kept in memory and persisted in institution_catalogues.
+    Stale entries are served right away while a background task refreshes them (stale-while-revalidate),
+    and they keep being served when the refresh fails. GoCardless is only called inline when nothing is cached at all.
+    """
+
+    def __init__(self, service_factory: Callable[[], OpenBankingService], ttl: timedelta = INSTITUTIONS_TTL):
+        self.service_factory = service_factory
+        self.ttl = ttl
+        self._entries = {}
+        self._locks = {}
+        self._refreshes = {}
+
+    async def get(self, country_code: str) -> CatalogueEntry:
+        entry = self._entries.get(country_code)
+        if entry is None:
+            entry = await self._load(country_code)
+        if entry.is_stale(self.ttl):
+            self._schedule_refresh(country_code)
+        return entry
+
+    async def _load(self, country_code: str) -> CatalogueEntry:
+        """
+        First request for a country: use the persisted copy if there is one, otherwise fetch from GoCardless
+        """
+        lock = self._locks.setdefault(country_code, asyncio.Lock())
+        async with lock:
+            # Another request may have loaded it while this one waited for the lock
+            entry = self._entries.get(country_code)
+            if entry is not None:
+                return entry
+            entry = await self._read_persisted(country_code)
+            if entry is None:
+                logger.info("No cached institutions for %s, fetching from GoCardless", country_code)
+                entry = await self._fetch(country_code)
+            self._entries[country_code] = entry
+            return entry
+
+    def _schedule_refresh(self, country_code: str):
+        task = self._refreshes.get(country_code)
+        if task is not None and not task.done():
+            return
+        self._refreshes[country_code] = asyncio.create_task(self.refresh(country_code))
+
+    async def refresh(self, country_code: str):
+        """
+        Fetch the institution list again. On failure the current entry is kept and served as is.
+        """
+        try:
+            self._entries[country_code] = await self._fetch(country_code)
+            logger.info("Refreshed institutions for %s", country_code)
+        except Exception as e:
+            logger.warning("Could not refresh institutions for %s, serving cached list: %s", country_code, e)
+
+    async def _fetch(self, country_code: str) -> CatalogueEntry:
+        service = self.service_factory()
+        institutions = await service.get_banks(country_code=country_code)
+        # The ETag is a hash of the body, so an unchanged list keeps the ETag browsers already have
+        entry = CatalogueEntry(country_code, institutions, datetime.now(timezone.utc))
+        await self._persist(entry)
+        return entry
+
+    async def _read_persisted(self, country_code: str) -> CatalogueEntry:
+        try:
+            async with AsyncSessionLocal() as db:
+                row = await db.get(InstitutionCatalogue, country_code)
+        except Exception as e:
+            logger.warning("Could not read persisted institutions for %s: %s", country_code, e)
+            return None
+        if row is None:
+            return None
+        return CatalogueEntry(row.country_code, row.institutions, row.fetched_at, row.etag)
+
+    async def _persist(self, entry: CatalogueEntry):
+        stmt = insert(InstitutionCatalogue).values(
+            country_code=entry.country_code,
+            institutions=entry.institutions,
+            etag=entry.etag,
+            fetched_at=entry.fetched_at,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[InstitutionCatalogue.country_code],
+            set_={"institutions": stmt.excluded.institutions, "etag": stmt.excluded.etag, "fetched_at": stmt.excluded.fetched_at},
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(stmt)
+                await db.commit()
+        except Exception as e:
+            # The in-memory copy still works, it just won't survive a restart
+            logger.warning("Could not persist institutions for %s: %s", entry.country_code, e)
+
+    async def close(self):
+        tasks = [task for task in self._refreshes.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
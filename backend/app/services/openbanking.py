@@ -1,34 +1,205 @@
 import httpx
-import os
-from dotenv import load_dotenv
 import asyncio
 import uuid
 import logging
+import time
+from datetime import date
+from app.services.rate_limit import RateLimitExceeded, retry_delay, MAX_RETRIES, RATE_LIMIT_MAX_WAIT, BACKOFF_MAX
+from app.core.config import settings
+from app.core.metrics import Counter, Histogram
 
 logger = logging.getLogger("openbanking.service")
-load_dotenv()
+
+GOCARDLESS_BASE_URL = settings.gocardless_base_url.rstrip("/")
+
+# Connection pool settings for the shared upstream client
+HTTP_MAX_CONNECTIONS = settings.http_max_connections
+HTTP_MAX_KEEPALIVE_CONNECTIONS = settings.http_max_keepalive_connections
+HTTP_KEEPALIVE_EXPIRY = settings.http_keepalive_expiry
+HTTP2_ENABLED = settings.http2
+HTTP_CONNECT_TIMEOUT = settings.http_connect_timeout
+# Maximum number of upstream calls in flight when fanning out over several accounts
+MAX_CONCURRENCY = settings.openbanking_max_concurrency
+
+# Timeouts per upstream endpoint. Transactions can take a long time for accounts with a long history,
+# while the small metadata endpoints should fail fast.
+DEFAULT_TIMEOUT = httpx.Timeout(10.0, connect=HTTP_CONNECT_TIMEOUT)
+ENDPOINT_TIMEOUTS = {
+    "token": httpx.Timeout(10.0, connect=HTTP_CONNECT_TIMEOUT),
+    "institutions": httpx.Timeout(10.0, connect=HTTP_CONNECT_TIMEOUT),
+    "requisitions": httpx.Timeout(15.0, connect=HTTP_CONNECT_TIMEOUT),
+    "accounts": httpx.Timeout(15.0, connect=HTTP_CONNECT_TIMEOUT),
+    "details": httpx.Timeout(15.0, connect=HTTP_CONNECT_TIMEOUT),
+    "balances": httpx.Timeout(15.0, connect=HTTP_CONNECT_TIMEOUT),
+    "transactions": httpx.Timeout(settings.http_transactions_timeout, connect=HTTP_CONNECT_TIMEOUT),
+}
+
+UPSTREAM_DURATION = Histogram(
+    "openbanking_request_duration_seconds", "Latency of each attempt of a call to GoCardless, per endpoint",
+    ("endpoint", "method"),
+)
+UPSTREAM_RESPONSES = Counter(
+    "openbanking_responses_total", "GoCardless responses per endpoint and status code, error when none was received",
+    ("endpoint", "status"),
+)
+UPSTREAM_RETRIES = Counter(
+    "openbanking_retries_total", "Calls retried after a 429 or 5xx response, per endpoint and status code",
+    ("endpoint", "status"),
+)
+UPSTREAM_RATE_LIMITED = Counter(
+    "openbanking_rate_limited_total", "Calls given up on because of the rate limit, per endpoint", ("endpoint",)
+)
+
+
+async def send_timed(client: httpx.AsyncClient, method: str, url: str, endpoint: str, **kwargs) -> httpx.Response:
+    """
+    client.request(method, url, **kwargs), recording its latency and status for the endpoint
+    """
+    start = time.perf_counter()
+    status = "error"
+    try:
+        response = await client.request(method, url, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        UPSTREAM_DURATION.observe(time.perf_counter() - start, endpoint, method)
+        UPSTREAM_RESPONSES.inc(endpoint, status)
+
+
+def create_http_client(
+    max_connections: int = HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections: int = HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry: float = HTTP_KEEPALIVE_EXPIRY,
+    http2: bool = HTTP2_ENABLED,
+) -> httpx.AsyncClient:
+    """
+    Create the long-lived, pooled HTTP client used for all calls to GoCardless.
+    The client is created and closed by the app lifespan in app/main.py.
+    """
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning("HTTP/2 requested but the 'h2' package is not installed, falling back to HTTP/1.1")
+            http2 = False
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=DEFAULT_TIMEOUT, http2=http2)
+
 
 class OpenBankingService:
-    def __init__(self, secret_id=None, secret_name=None, secret_key=None):
-        self.base_url = "https://bankaccountdata.gocardless.com/api/v2"
+    def __init__(self, secret_id=None, secret_name=None, secret_key=None, client: httpx.AsyncClient = None,
+                 token_manager=None, rate_limiter=None, base_url: str = GOCARDLESS_BASE_URL):
+        self.base_url = base_url
         self.secret_id = secret_id
         self.secret_name = secret_name
         self.secret_key = secret_key
         self.token = None
-    
+        # Shared pooled client. Without one every call opens (and closes) its own connection.
+        self.client = client
+        # Shared TokenManager. Without one the service requests its own token from /token/new/.
+        self.token_manager = token_manager
+        # Shared RateLimiter. Without one calls are only retried, not limited locally.
+        self.rate_limiter = rate_limiter
+
+    async def _send(self, method: str, url: str, endpoint: str, **kwargs) -> httpx.Response:
+        if self.client is not None:
+            return await send_timed(self.client, method, url, endpoint, **kwargs)
+        async with httpx.AsyncClient() as client:
+            return await send_timed(client, method, url, endpoint, **kwargs)
+
+    async def _request(self, method: str, path: str, endpoint: str, authenticated: bool = True, account: str = None,
+                       **kwargs) -> httpx.Response:
+        """
+        Send a request to the GoCardless API using the shared client when available.
+        Calls are rate limited per (account, endpoint) and 429 and 5xx responses are retried with jittered backoff.
+        The local quota is taken once per call, retries and the re-authentication don't spend it again.
+        A retry is only waited for up to BACKOFF_MAX seconds (and RATE_LIMIT_MAX_WAIT for a 429), when upstream
+        asks for a longer pause the call fails right away instead of holding the request or sync worker.
+        If an authenticated call is rejected with 401 the token is renewed and the call is retried once.
+        """
+        headers = kwargs.pop("headers", {})
+        timeout = ENDPOINT_TIMEOUTS.get(endpoint, DEFAULT_TIMEOUT)
+        url = f"{self.base_url}{path}"
+        reauthenticated = False
+        attempt = 0
+        if self.rate_limiter is not None:
+            try:
+                await self.rate_limiter.acquire(account, endpoint)
+            except RateLimitExceeded:
+                UPSTREAM_RATE_LIMITED.inc(endpoint)
+                raise
+        while True:
+            request_headers = dict(headers)
+            if authenticated:
+                if not self.token:
+                    await self.authenticate()
+                request_headers["Authorization"] = f"Bearer {self.token}"
+            response = await self._send(method, url, endpoint, headers=request_headers, timeout=timeout, **kwargs)
+            if self.rate_limiter is not None:
+                self.rate_limiter.update_from_headers(account, endpoint, response.headers)
+
+            if authenticated and response.status_code == 401 and not reauthenticated:
+                logger.info("Access token rejected by GoCardless, re-authenticating and retrying once")
+                if self.token_manager is not None:
+                    self.token_manager.invalidate(self.token)
+                self.token = None
+                reauthenticated = True
+                continue
+
+            # POSTs are only retried on 429, a 5xx may have created the resource already
+            retryable = response.status_code == 429 or (response.status_code >= 500 and method == "GET")
+            if not retryable or attempt >= MAX_RETRIES:
+                return response
+            delay = retry_delay(response.headers, attempt, response.status_code)
+            if response.status_code == 429:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.block(account, endpoint, delay)
+                if delay > min(RATE_LIMIT_MAX_WAIT, BACKOFF_MAX):
+                    UPSTREAM_RATE_LIMITED.inc(endpoint)
+                    raise RateLimitExceeded(account, endpoint, delay)
+            elif delay > BACKOFF_MAX:
+                logger.warning(
+                    "GoCardless returned %s for %s and asked to retry in %.0fs, giving up", response.status_code, endpoint, delay
+                )
+                return response
+            attempt += 1
+            UPSTREAM_RETRIES.inc(endpoint, str(response.status_code))
+            logger.warning(
+                "GoCardless returned %s for %s, retrying in %.2fs (attempt %s of %s)",
+                response.status_code, endpoint, delay, attempt, MAX_RETRIES
+            )
+            await asyncio.sleep(delay)
+
+    def remaining_quota(self, account_number: str, endpoint: str):
+        """
+        Calls left for the account and endpoint according to the rate limiter, or None if unknown
+        """
+        if self.rate_limiter is None:
+            return None
+        return self.rate_limiter.remaining(account_number, endpoint)
+
     async def authenticate(self):
         if not self.secret_id or not self.secret_key or not self.secret_name:
             raise ValueError("Secret ID, Secret Name and Secret Key must be set.")
+        if self.token_manager is not None:
+            self.token = await self.token_manager.get_token()
+            return
         logger.info("Authenticating with GoCardless Open Banking API...")
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/token/new/",
-                    data={"secret_id": self.secret_id, "secret_key": self.secret_key}
-                )
-                response.raise_for_status()
-                self.token = response.json()["access"]
-                logger.debug("Access token retrieved successfully.")
+            response = await self._request(
+                "POST",
+                "/token/new/",
+                endpoint="token",
+                authenticated=False,
+                data={"secret_id": self.secret_id, "secret_key": self.secret_key}
+            )
+            response.raise_for_status()
+            self.token = response.json()["access"]
+            logger.debug("Access token retrieved successfully.")
         except httpx.HTTPStatusError as e:
             logger.error(
                 "HTTP error during authentication: %s - %s",
@@ -39,6 +210,9 @@ class OpenBankingService:
         except httpx.RequestError as e:
             logger.error("Network error during authentication: %s", e)
             raise
+        except RateLimitExceeded as e:
+            logger.warning("Rate limited during authentication: %s", e)
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred during authentication: %s", e)
             raise
@@ -47,13 +221,12 @@ class OpenBankingService:
         if not self.token:
             logger.debug("No access token found, authenticating...")
             await self.authenticate()
-        # Set timeout for requests to avoid timeouts
-        timeout = httpx.Timeout(10.0, connect=5.0)
         try:
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                response = await client.get(
-                f"{self.base_url}/institutions/?country={country_code}",
-                headers={"Authorization": f"Bearer {self.token}"}
+            response = await self._request(
+                "GET",
+                "/institutions/",
+                endpoint="institutions",
+                params={"country": country_code}
             )
             response.raise_for_status()
             return response.json()
@@ -66,16 +239,19 @@ class OpenBankingService:
         except httpx.RequestError as e:
             logger.error("Network error while fetching banks: %s", e)
             raise
+        except RateLimitExceeded as e:
+            logger.warning("Rate limited while fetching banks: %s", e)
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred while fetching banks: %s", e)
             raise
-    
+
     async def create_requisition(self, institution_id: str, redirect_url: str, reference: str = None, agreement: str = None):
         # Authenticate if token is not set
         if not self.token:
             logger.debug("No access token found, authenticating...")
             await self.authenticate()
-        
+
         # Create payload
         payload = {
             "institution_id": institution_id,
@@ -99,20 +275,18 @@ class OpenBankingService:
         logger.info(f"Creating requisition with institution_id: {institution_id} for reference: {reference}")
         try:
             logger.info("Creating requisition with payload: %s", payload)
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.base_url}/requisitions/",
-                    headers={
-                        "Authorization": f"Bearer {self.token}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload
-                )
-                
-                response.raise_for_status() # Raise an error for bad responses
-                data = response.json()
-                logger.info("Requisition created successfully with ID: %s", data.get("id"))
-                return data  # Includes link, id etc.
+            response = await self._request(
+                "POST",
+                "/requisitions/",
+                endpoint="requisitions",
+                headers={"Content-Type": "application/json"},
+                json=payload
+            )
+
+            response.raise_for_status() # Raise an error for bad responses
+            data = response.json()
+            logger.info("Requisition created successfully with ID: %s", data.get("id"))
+            return data  # Includes link, id etc.
         except httpx.HTTPStatusError as e:
             logger.error(
                 "HTTP error while creating requisition: %s - %s",
@@ -123,32 +297,33 @@ class OpenBankingService:
         except httpx.RequestError as e:
             logger.error("Network error while creating requisition: %s", e)
             raise
+        except RateLimitExceeded as e:
+            logger.warning("Rate limited while creating requisition: %s", e)
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred while creating requisition: %s", e)
             raise
-        
+
     async def list_accounts(self, requisition_id: str):
         if not self.token:
             logger.debug("No access token found, authenticating...")
             await self.authenticate()
         logger.info("Listing accounts for requisition ID: %s", requisition_id)
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/requisitions/{requisition_id}/",
-                    headers={
-                        "Authorization": f"Bearer {self.token}",
-                        "Content-Type": "application/json"
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-                # Check if accounts exists
-                if len(data["accounts"]) == 0:
-                    logger.warning("No accounts found for the given requisition ID.")
-                    return []
-                logger.info("Accounts retrieved successfully for requisition ID: %s", requisition_id)
-                return data
+            response = await self._request(
+                "GET",
+                f"/requisitions/{requisition_id}/",
+                endpoint="requisitions",
+                headers={"Content-Type": "application/json"}
+            )
+            response.raise_for_status()
+            data = response.json()
+            # Check if accounts exists
+            if len(data["accounts"]) == 0:
+                logger.warning("No accounts found for the given requisition ID.")
+                return []
+            logger.info("Accounts retrieved successfully for requisition ID: %s", requisition_id)
+            return data
         except httpx.HTTPStatusError as e:
             logger.error(
                 "HTTP error while creating requisition: %s - %s",
@@ -159,10 +334,13 @@ class OpenBankingService:
         except httpx.RequestError as e:
             logger.error("Network error while creating requisition: %s", e)
             raise
+        except RateLimitExceeded as e:
+            logger.warning("Rate limited while listing accounts: %s", e)
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred while creating requisition: %s", e)
             raise
-    
+
     # Functions for getting account details: transactions, balances etc.
     async def get_account_metadata(self, account_number: str):
         if not self.token:
@@ -170,18 +348,17 @@ class OpenBankingService:
             await self.authenticate()
         logger.info("Getting metadata for account number: %s", account_number)
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/accounts/{account_number}/",
-                    headers={
-                        "Authorization": f"Bearer {self.token}",
-                        "Content-Type": "application/json"
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-                logger.info("Metadata retrieved successfully for account number: %s", account_number) 
-                return data
+            response = await self._request(
+                "GET",
+                f"/accounts/{account_number}/",
+                endpoint="accounts",
+                account=account_number,
+                headers={"Content-Type": "application/json"}
+            )
+            response.raise_for_status()
+            data = response.json()
+            logger.info("Metadata retrieved successfully for account number: %s", account_number)
+            return data
         except httpx.HTTPStatusError as e:
             logger.error(
                 "HTTP error fetching account metadata: %s - %s",
@@ -192,29 +369,31 @@ class OpenBankingService:
         except httpx.RequestError as e:
             logger.error("Network error while fetching account metadata: %s", e)
             raise
+        except RateLimitExceeded as e:
+            logger.warning("Rate limited while fetching account metadata: %s", e)
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred while fetching account metadata: %s", e)
             raise
-    
+
     async def get_account_balance(self, account_number: str):
         if not self.token:
             logger.debug("No access token found, authenticating...")
             await self.authenticate()
         logger.info("Getting balance for account number: %s", account_number)
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/accounts/{account_number}/balances/",
-                    headers={
-                        "Authorization": f"Bearer {self.token}",
-                        "Content-Type": "application/json"
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-                logger.info("Account details fetched successfully for account: %s", account_number)
+            response = await self._request(
+                "GET",
+                f"/accounts/{account_number}/balances/",
+                endpoint="balances",
+                account=account_number,
+                headers={"Content-Type": "application/json"}
+            )
+            response.raise_for_status()
+            data = response.json()
+            logger.info("Account details fetched successfully for account: %s", account_number)
 
-                return data
+            return data
         except httpx.HTTPStatusError as e:
             logger.error(
                 "HTTP error fetching account balance: %s - %s",
@@ -225,27 +404,29 @@ class OpenBankingService:
         except httpx.RequestError as e:
             logger.error("Network error while fetching account balance: %s", e)
             raise
+        except RateLimitExceeded as e:
+            logger.warning("Rate limited while fetching account balance: %s", e)
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred while fetching account balance: %s", e)
             raise
-        
+
     async def get_account_details(self, account_number: str):
         if not self.token:
             logger.debug("No access token found, authenticating...")
             await self.authenticate()
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/accounts/{account_number}/details/",
-                    headers={
-                        "Authorization": f"Bearer {self.token}",
-                        "Content-Type": "application/json"
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-                logger.info("Account details fetched successfully for account: %s", account_number)
-                return data
+            response = await self._request(
+                "GET",
+                f"/accounts/{account_number}/details/",
+                endpoint="details",
+                account=account_number,
+                headers={"Content-Type": "application/json"}
+            )
+            response.raise_for_status()
+            data = response.json()
+            logger.info("Account details fetched successfully for account: %s", account_number)
+            return data
         except httpx.HTTPStatusError as e:
             logger.error(
                 "HTTP error fetching account details: %s - %s",
@@ -256,53 +437,89 @@ class OpenBankingService:
         except httpx.RequestError as e:
             logger.error("Network error while fetching account details: %s", e)
             raise
+        except RateLimitExceeded as e:
+            logger.warning("Rate limited while fetching account details: %s", e)
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred while fetching account details: %s", e)
             raise
-    
-    async def get_account_transactions(self, account_number: str):
+
+    async def get_account_snapshots(self, account_numbers: list, max_concurrency: int = MAX_CONCURRENCY):
+        """
+        Fetch details and balances for several accounts concurrently, with at most max_concurrency calls in flight.
+        Returns a list of (account_number, details, balance) tuples in the same order as account_numbers.
+        """
+        # Authenticate once up front so the fanned out calls share the token
         if not self.token:
             logger.debug("No access token found, authenticating...")
             await self.authenticate()
-        logger.info("Getting transactions for account number: %s", account_number)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def limited(fetch, account_number):
+            async with semaphore:
+                return await fetch(account_number=account_number)
+
+        async def snapshot(account_number):
+            details, balance = await asyncio.gather(
+                limited(self.get_account_details, account_number),
+                limited(self.get_account_balance, account_number),
+            )
+            return account_number, details, balance
+
+        return await asyncio.gather(*(snapshot(account_number) for account_number in account_numbers))
+
+    async def get_account_transactions(self, account_number: str, date_from: date = None, date_to: date = None):
+        if not self.token:
+            logger.debug("No access token found, authenticating...")
+            await self.authenticate()
+        logger.info("Getting transactions for account number: %s (from %s to %s)", account_number, date_from, date_to)
+        # Without a date range GoCardless returns the full available history
+        params = {}
+        if date_from:
+            params["date_from"] = date_from.isoformat()
+        if date_to:
+            params["date_to"] = date_to.isoformat()
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    f"{self.base_url}/accounts/{account_number}/transactions/",
-                    headers={
-                        "Authorization": f"Bearer {self.token}",
-                        "Content-Type": "application/json"
-                    }
-                )
-                response.raise_for_status()
-                data = response.json()
-                
-                logger.info("Transactions fetched successfully for account: %s", account_number)
-                return data
+            response = await self._request(
+                "GET",
+                f"/accounts/{account_number}/transactions/",
+                endpoint="transactions",
+                account=account_number,
+                headers={"Content-Type": "application/json"},
+                params=params
+            )
+            response.raise_for_status()
+            data = response.json()
+
+            logger.info("Transactions fetched successfully for account: %s", account_number)
+            return data
         except httpx.HTTPStatusError as e:
             logger.error(
                 "HTTP error while fetching transactions: %s - %s",
                 e.response.status_code,
                 e.response.text
             )
-            
+
             raise
         except httpx.RequestError as e:
             logger.error("Network error while fetching transactions: %s", e)
             raise
+        except RateLimitExceeded as e:
+            logger.warning("Rate limited while fetching transactions: %s", e)
+            raise
         except Exception as e:
             logger.exception("An unexpected error occurred while fetching transactions: %s", e)
             raise
-        
-    
+
+
 
 # #Example usage
 # async def main():
-#     load_dotenv()
-#     GOCARDLESS_SECRET_ID = os.getenv("GOCARDLESS_SECRET_ID")
-#     GOCARDLESS_SECRET_NAME = os.getenv("GOCARDLESS_SECRET_NAME")
-#     GOCARDLESS_SECRET_KEY = os.getenv("GOCARDLESS_SECRET_KEY")
-#     service = OpenBankingService(secret_id=GOCARDLESS_SECRET_ID, secret_name=GOCARDLESS_SECRET_NAME, secret_key=GOCARDLESS_SECRET_KEY)
+#     service = OpenBankingService(
+#         secret_id=settings.gocardless_secret_id,
+#         secret_name=settings.gocardless_secret_name,
+#         secret_key=settings.gocardless_secret_key,
+#     )
 #     await service.authenticate()
 #     account_data = await service.get_banks()
 #     print(account_data)
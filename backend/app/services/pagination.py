@@ -0,0 +1,110 @@
+from app.db.models import Account, Transaction
+from sqlalchemy.engine import Result
+from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
+from sqlalchemy import and_, or_, union_all, cast, String
+from datetime import datetime
+import base64
+import json
+
+# Order of /transactions, backed by the ix_transactions_account_booking_date_id index
+TRANSACTION_ORDER = (Transaction.booking_date.desc(), Transaction.id.asc())
+
+
+def transaction_columns(model=Transaction) -> list:
+    """
+    The columns of Transaction.as_dict(), account_name needs accounts joined in
+    """
+    return [
+        model.id,
+        model.account_id,
+        Account.name.label("account_name"),
+        model.transaction_id,
+        cast(model.amount, String).label("amount"),  # As text, the same as str(Decimal)
+        model.currency,
+        model.booking_date,
+        model.value_date,
+        model.description,
+        model.remittance_information,
+        model.creditor_name,
+        model.debtor_name,
+        model.transaction_type,
+        model.created_at,
+        model.status,
+    ]
+
+
+def transaction_listing(model=Transaction):
+    """
+    Select the columns of Transaction.as_dict() directly, with the account name joined in,
+    so listings skip building ORM objects and loading Transaction.account
+    """
+    return select(*transaction_columns(model)).join(Account, Account.id == model.account_id)
+
+
+def listing_dicts(result: Result) -> list:
+    """
+    Plain dicts of a transaction_listing result. Dates are left as datetimes for the JSON encoder.
+    """
+    return [dict(row) for row in result.mappings()]
+
+
+def encode_cursor(transaction: dict) -> str:
+    """
+    Opaque cursor pointing just after the given transaction row in TRANSACTION_ORDER
+    """
+    raw = json.dumps([transaction["booking_date"].isoformat(), transaction["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """
+    (booking_date, id) of a cursor made by encode_cursor. Raises ValueError for anything else.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        booking_date, transaction_id = json.loads(raw)
+        return datetime.fromisoformat(booking_date), str(transaction_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def after_cursor(model, booking_date: datetime, transaction_id: str):
+    """
+    Rows that come after (booking_date, id) when ordered by booking_date DESC, id ASC
+    """
+    return and_(
+        # Redundant with the OR below, but it gives the planner an index range to start from instead of filtering from the top
+        model.booking_date <= booking_date,
+        or_(
+            model.booking_date < booking_date,
+            and_(model.booking_date == booking_date, model.id > transaction_id),
+        ),
+    )
+
+
+def keyset_page_query(account_ids: list, page_size: int, cursor: str = None, status: str = None):
+    """
+    Select the page of transactions after the cursor (or the first page) across the given accounts.
+    Each account is read as its own index range limited to page_size rows and the ranges are merged,
+    so a page costs the same no matter how deep it is or how many transactions the accounts have.
+    """
+    position = decode_cursor(cursor) if cursor else None
+
+    def account_page(account_id, stmt):
+        stmt = stmt.where(Transaction.account_id == account_id)
+        if status is not None:
+            stmt = stmt.where(Transaction.status == status)
+        if position:
+            stmt = stmt.where(after_cursor(Transaction, *position))
+        return stmt.order_by(*TRANSACTION_ORDER).limit(page_size)
+
+    if len(account_ids) == 1:
+        return account_page(account_ids[0], transaction_listing())
+    pages = union_all(*[account_page(account_id, select(Transaction)) for account_id in account_ids])
+    page = aliased(Transaction, pages.subquery())
+    return (
+        transaction_listing(page)
+        .order_by(page.booking_date.desc(), page.id.asc())
+        .limit(page_size)
+    )
@@ -0,0 +1,208 @@
+import asyncio
+import logging
+from app.core.config import settings
+import random
+import time
+
+logger = logging.getLogger("openbanking.ratelimit")
+
+# GoCardless allows 4 successful calls per account per endpoint per day unless the headers say otherwise
+ACCOUNT_DAILY_CALLS = settings.rate_limit_account_daily_calls
+# Longest time a call waits locally for a token before it is rejected
+RATE_LIMIT_MAX_WAIT = settings.rate_limit_max_wait
+
+# Retries of 429 and 5xx responses, with jittered exponential backoff between attempts
+MAX_RETRIES = settings.openbanking_max_retries
+BACKOFF_BASE = settings.openbanking_backoff_base
+BACKOFF_MAX = settings.openbanking_backoff_max
+
+# Endpoints that are limited per account
+ACCOUNT_ENDPOINTS = ("details", "balances", "transactions")
+
+# GoCardless sends its rate limit headers with an HTTP_ prefix, standard names are accepted as well
+GENERAL_HEADERS = (
+    ("http_x_ratelimit_limit", "http_x_ratelimit_remaining", "http_x_ratelimit_reset"),
+    ("x-ratelimit-limit", "x-ratelimit-remaining", "x-ratelimit-reset"),
+)
+ACCOUNT_HEADERS = (
+    ("http_x_ratelimit_account_success_limit", "http_x_ratelimit_account_success_remaining", "http_x_ratelimit_account_success_reset"),
+    ("x-ratelimit-account-success-limit", "x-ratelimit-account-success-remaining", "x-ratelimit-account-success-reset"),
+)
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a call would exceed the upstream rate limit. retry_after is the number of seconds until it can be made.
+    """
+
+    def __init__(self, account: str, endpoint: str, retry_after: float):
+        super().__init__(f"Rate limit reached for {endpoint} (account {account}), retry in {retry_after:.0f}s")
+        self.account = account
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to capacity tokens, refilled evenly over period seconds
+    """
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.rate = capacity / period
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available"""
+        self._refill()
+        blocked = max(self.blocked_until - self.updated, 0.0)
+        if self.tokens >= 1:
+            return blocked
+        return max((1 - self.tokens) / self.rate, blocked)
+
+    def take(self):
+        self._refill()
+        self.tokens -= 1
+
+    def sync(self, limit: float, remaining: float, reset: float):
+        """Align the bucket with the limit, remaining calls and seconds until reset reported by upstream"""
+        self._refill()
+        self.capacity = max(limit, 1)
+        self.tokens = max(min(remaining, self.capacity), 0)
+        # Refill what's missing by the time upstream resets the window
+        self.rate = max(self.capacity - self.tokens, 1) / max(reset, 1)
+
+    def block(self, seconds: float):
+        """Hold back all calls for the given number of seconds"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def remaining(self) -> int:
+        self._refill()
+        return int(self.tokens)
+
+
+class RateLimiter:
+    """
+    Local token buckets per (account, endpoint), kept in line with the rate limit headers GoCardless returns.
+    Calls wait for a token up to max_wait seconds and are rejected with RateLimitExceeded beyond that,
+    so they fail locally instead of spending quota on a 429.
+    """
+
+    def __init__(self, account_daily_calls: int = ACCOUNT_DAILY_CALLS, max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.account_daily_calls = account_daily_calls
+        self.max_wait = max_wait
+        self._buckets = {}
+
+    def _bucket(self, account: str, endpoint: str, create: bool = True) -> TokenBucket:
+        key = (account, endpoint)
+        bucket = self._buckets.get(key)
+        if bucket is None and create and account is not None and endpoint in ACCOUNT_ENDPOINTS:
+            bucket = self._buckets[key] = TokenBucket(self.account_daily_calls, 24 * 3600)
+        return bucket
+
+    def _buckets_for(self, account: str, endpoint: str) -> list:
+        # The account specific bucket and the general bucket for the endpoint, where known
+        buckets = [self._bucket(account, endpoint), self._bucket(None, endpoint, create=False)]
+        return [bucket for bucket in buckets if bucket is not None]
+
+    async def acquire(self, account: str, endpoint: str, max_wait: float = None):
+        """
+        Take a token for the call, waiting up to max_wait seconds for one to become available
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        buckets = self._buckets_for(account, endpoint)
+        while True:
+            wait = max((bucket.wait_time() for bucket in buckets), default=0.0)
+            if wait == 0:
+                for bucket in buckets:
+                    bucket.take()
+                return
+            if wait > max_wait:
+                raise RateLimitExceeded(account, endpoint, wait)
+            logger.debug("Waiting %.2fs for rate limit on %s (account %s)", wait, endpoint, account)
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, account: str, endpoint: str, headers):
+        """
+        Sync the local buckets with the rate limit headers of an upstream response
+        """
+        for names in ACCOUNT_HEADERS if account is not None else ():
+            values = _read_headers(headers, names)
+            if values:
+                self._sync(account, endpoint, *values)
+                break
+        for names in GENERAL_HEADERS:
+            values = _read_headers(headers, names)
+            if values:
+                self._sync(None, endpoint, *values)
+                break
+
+    def _sync(self, account: str, endpoint: str, limit: float, remaining: float, reset: float):
+        bucket = self._bucket(account, endpoint, create=False)
+        if bucket is None:
+            bucket = self._buckets[(account, endpoint)] = TokenBucket(limit, max(reset, 1))
+        bucket.sync(limit, remaining, reset)
+
+    def block(self, account: str, endpoint: str, seconds: float):
+        """
+        Stop calls for the account and endpoint for the given number of seconds, used after a 429
+        """
+        bucket = self._bucket(account, endpoint, create=False)
+        if bucket is None:
+            bucket = self._buckets[(account, endpoint)] = TokenBucket(1, seconds)
+        bucket.block(seconds)
+
+    def remaining(self, account: str, endpoint: str):
+        """
+        Calls left for the account and endpoint, or None if no limit is known
+        """
+        bucket = self._bucket(account, endpoint)
+        return bucket.remaining() if bucket is not None else None
+
+    def wait_time(self, account: str, endpoint: str) -> float:
+        """
+        Seconds until a call to the account and endpoint can be made
+        """
+        return max((bucket.wait_time() for bucket in self._buckets_for(account, endpoint)), default=0.0)
+
+
+def _read_headers(headers, names):
+    try:
+        values = [headers.get(name) for name in names]
+        if any(value is None for value in values):
+            return None
+        return tuple(float(value) for value in values)
+    except ValueError:
+        return None
+
+
+# Headers that say when a call can be retried. GoCardless sends the reset headers on every response,
+# so they only mean "retry then" on a 429.
+RETRY_HEADERS = ("retry-after",)
+RATE_LIMIT_RETRY_HEADERS = (
+    "retry-after", "http_x_ratelimit_account_success_reset", "http_x_ratelimit_reset", "x-ratelimit-reset",
+)
+
+
+def retry_delay(headers, attempt: int, status_code: int = 429) -> float:
+    """
+    Seconds to wait before retrying a failed call.
+    Uses Retry-After, or for a 429 also the rate limit reset headers, when upstream sends one,
+    otherwise full jitter exponential backoff. The delay upstream asks for isn't capped here,
+    callers decide whether it's worth waiting for.
+    """
+    for name in RATE_LIMIT_RETRY_HEADERS if status_code == 429 else RETRY_HEADERS:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return float(value) + random.uniform(0, BACKOFF_BASE)
+            except ValueError:
+                pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
@@ -0,0 +1,86 @@
+from app.db.models import DailyAccountRollup, Transaction
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import event, update
+from collections import defaultdict
+from datetime import datetime, date, time, timedelta
+from decimal import Decimal
+
+
+class RollupDeltas:
+    """
+    Changes to daily_account_rollups collected while saving transactions, keyed by (account_id, day, currency)
+    """
+
+    def __init__(self):
+        self._deltas = defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+
+    def add(self, row: dict, sign: int = 1):
+        """
+        Count a transaction row (sign 1) or take it out again (sign -1)
+        """
+        delta = self._deltas[(row["account_id"], row["booking_date"].date(), row["currency"])]
+        amount = Decimal(row["amount"])
+        if amount > 0:
+            delta[0] += sign * amount
+        elif amount < 0:
+            delta[1] += sign * amount
+        delta[2] += sign
+
+    def rows(self) -> list:
+        return [
+            {"account_id": account_id, "day": day, "currency": currency, "income": income, "expenses": expenses, "tx_count": tx_count}
+            for (account_id, day, currency), (income, expenses, tx_count) in self._deltas.items()
+            if income or expenses or tx_count
+        ]
+
+
+async def apply_rollup_deltas(deltas: RollupDeltas, db: AsyncSession):
+    """
+    Add the collected deltas to daily_account_rollups in the caller's transaction
+    """
+    rows = deltas.rows()
+    if not rows:
+        return
+    table = DailyAccountRollup.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.account_id, table.c.day, table.c.currency],
+        set_={
+            "income": table.c.income + stmt.excluded.income,
+            "expenses": table.c.expenses + stmt.excluded.expenses,
+            "tx_count": table.c.tx_count + stmt.excluded.tx_count,
+        },
+    )
+    await db.execute(stmt, rows)
+
+
+def first_day_from(moment: datetime) -> date:
+    """
+    First day whose transactions satisfy booking_date >= moment. Booking dates are stored at midnight,
+    so filtering rollup days with this gives the same result as filtering the transactions themselves.
+    """
+    if moment.time() == time():
+        return moment.date()
+    return moment.date() + timedelta(days=1)
+
+
+@event.listens_for(Transaction, "after_delete")
+def remove_deleted_transaction(mapper, connection, target):
+    """
+    Take a transaction deleted through the ORM out of its rollup, in the same transaction as the delete
+    """
+    amount = Decimal(target.amount)
+    connection.execute(
+        update(DailyAccountRollup)
+        .where(
+            DailyAccountRollup.account_id == target.account_id,
+            DailyAccountRollup.day == target.booking_date.date(),
+            DailyAccountRollup.currency == target.currency,
+        )
+        .values(
+            income=DailyAccountRollup.income - (amount if amount > 0 else 0),
+            expenses=DailyAccountRollup.expenses - (amount if amount < 0 else 0),
+            tx_count=DailyAccountRollup.tx_count - 1,
+        )
+    )
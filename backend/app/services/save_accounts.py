@@ -0,0 +1,74 @@
+from app.db.models import Account
+from app.services.data_version import bump_data_version
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
+from decimal import Decimal
+from datetime import datetime, timezone
+from uuid import uuid4
+import logging
+
+logger = logging.getLogger(__name__)  # Set up a logger for this module
+
+def extract_balance_amount(balances_data: dict):
+    """
+    Pick the balance shown to the user from a GoCardless balances payload, or None if there is none
+    """
+    balance_entry = next(
+        (b for b in balances_data.get("balances", []) if b["balanceType"] in ["expected", "interimAvailable"]),
+        None
+    )
+    return balance_entry["balanceAmount"]["amount"] if balance_entry else None
+
+def upsert_accounts(rows: list, update_balance: bool):
+    stmt = insert(Account).values(rows)
+    set_ = {
+        "requisition_id": stmt.excluded.requisition_id,
+        "account_number": stmt.excluded.account_number,
+        "name": stmt.excluded.name,
+        "iban": stmt.excluded.iban,
+        "currency": stmt.excluded.currency,
+    }
+    if update_balance:
+        set_.update(balance=stmt.excluded.balance, balance_updated_at=stmt.excluded.balance_updated_at)
+    return stmt.on_conflict_do_update(index_elements=[Account.account_id], set_=set_)
+
+
+async def save_accounts(accounts_data: list, requisition_db_id: str, db: AsyncSession):
+    """
+    Insert new accounts and update existing ones with INSERT ... ON CONFLICT, one statement for the accounts
+    that came with a balance and one for those that didn't.
+    Each entry in accounts_data needs account_id (GoCardless resourceId), account_number, name, iban, currency and balance.
+    The caller is responsible for ownership checks and for committing.
+    """
+    if not accounts_data:
+        return
+    now = datetime.now(timezone.utc)
+    # Key on resourceId, a single statement can't touch the same row twice
+    rows = {}
+    for acc in accounts_data:
+        rows[acc["account_id"]] = {
+            "id": str(uuid4()),
+            "requisition_id": requisition_db_id,
+            "account_id": acc["account_id"],
+            "account_number": acc["account_number"],
+            "name": acc["name"],
+            "iban": acc.get("iban"),
+            "currency": acc["currency"],
+            "balance": Decimal(acc["balance"]) if acc.get("balance") is not None else None,
+            "balance_updated_at": now,
+            "created_at": datetime.utcnow(),
+        }
+
+    with_balance = [row for row in rows.values() if row["balance"] is not None]
+    without_balance = [row for row in rows.values() if row["balance"] is None]
+    if with_balance:
+        await db.execute(upsert_accounts(with_balance, update_balance=True))
+    if without_balance:
+        # balance is NOT NULL and checked on the proposed row before ON CONFLICT, so new accounts start at 0
+        # with an unknown update time, and existing accounts keep their last known balance
+        for row in without_balance:
+            row.update(balance=Decimal(0), balance_updated_at=None)
+        await db.execute(upsert_accounts(without_balance, update_balance=False))
+    await bump_data_version(db, requisition_id=requisition_db_id)
+    logger.info("Upserted %s accounts for requisition %s", len(rows), requisition_db_id)
+
@@ -1,77 +1,191 @@
 from app.db.models import Transaction
+from app.services.transaction_counts import apply_count_deltas, count_key
+from app.services.rollups import RollupDeltas, apply_rollup_deltas
+from app.services.data_version import bump_data_version, record_saved_transactions
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.future import select
+from sqlalchemy import and_, or_, literal_column
+from collections import Counter
 from decimal import Decimal
-from datetime import datetime, timezone
+from datetime import datetime
+from uuid import uuid4
 import logging
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)  # Set up a logger for this module
 
-async def save_transactions(transactions_data: dict, account_db_id: str, db: AsyncSession):
-    all_transactions = transactions_data.get("transactions", {})  # Get the transactions
-    # Check early for no transactions
-    if not all_transactions:
-        logger.warning("No transactions found in the provided data.")
-        return
-    
-    created_count = 0  # Counter for created transactions
-    updated_count = 0  # Counter for updated transactions
+# Rows per INSERT ... ON CONFLICT round trip
+CHUNK_SIZE = settings.save_transactions_chunk_size
+
+# Columns that are overwritten when a transaction already exists. id, account_id and created_at are kept,
+# a transaction ID that already belongs to another account is never moved, see save_transactions.
+UPDATABLE_COLUMNS = [
+    "amount",
+    "currency",
+    "booking_date",
+    "value_date",
+    "description",
+    "remittance_information",
+    "creditor_name",
+    "debtor_name",
+    "transaction_type",
+    "status",
+]
+
+
+def normalize_transaction(tx: dict, tx_type: str, account_db_id: str, created_at: datetime):
+    """
+    Turn a single GoCardless transaction into a row for the transactions table.
+    Returns None if the transaction has no transactionId.
+    """
+    tx_id = tx.get("transactionId")
+    if not tx_id:
+        logger.warning("Transaction ID is missing, skipping this transaction.")
+        return None
+    transactionAmount = tx.get("transactionAmount", {})
+    amount = transactionAmount.get("amount", 0)
+    currency = transactionAmount.get("currency", "DKK")
+    booking_date = datetime.fromisoformat(tx.get("bookingDate", tx.get("valueDate")))  # Much faster than strptime
+    valueDate = datetime.fromisoformat(tx.get("valueDate")) if tx.get("valueDate") else None
+    creditorName = tx.get("creditorName", "Unknown")
+    remittanceInformationUnstructured = tx.get("remittanceInformationUnstructured", "Unknown")
+    # If there's no remittance information try remittanceInformationUnstructuredArray
+    if remittanceInformationUnstructured == "Unknown":
+        remittanceInformationUnstructuredArray = tx.get("remittanceInformationUnstructuredArray", [])
+        if remittanceInformationUnstructuredArray:
+            remittanceInformationUnstructured = remittanceInformationUnstructuredArray[0]
+        else:
+            remittanceInformationUnstructured = "Unknown"
+
+    return {
+        "id": str(uuid4()),
+        "account_id": account_db_id,
+        "transaction_id": tx_id,
+        "amount": Decimal(amount),
+        "currency": currency,
+        "booking_date": booking_date,
+        "value_date": valueDate,
+        "description": tx.get("description", "Unknown"),
+        "remittance_information": remittanceInformationUnstructured,
+        "creditor_name": creditorName,
+        "debtor_name": tx.get("debtorName", "Unknown"),
+        "transaction_type": tx.get("proprietaryBankTransactionCode", "Unknown"),
+        "status": "booked" if tx_type == "booked" else "pending",
+        "created_at": created_at,
+    }
+
 
+def normalize_transactions(transactions_data: dict, account_db_id: str) -> list:
+    """
+    Normalize the booked and pending transactions of a GoCardless payload in memory.
+    A transaction ID that appears more than once is only kept once, booked entries win over pending ones.
+    """
+    all_transactions = transactions_data.get("transactions", {})
+    created_at = datetime.utcnow()
+    rows = {}
     for tx_type in ["booked", "pending"]:
         for tx in all_transactions.get(tx_type, []):  # Loop through booked and pending transactions
-            
-            tx_id = tx.get("transactionId")
-            logger.debug(f"Processing transaction ID: {tx_id} of type: {tx_type}")
-            if not tx_id:
-                logger.warning("Transaction ID is missing, skipping this transaction.")
+            row = normalize_transaction(tx, tx_type, account_db_id, created_at)
+            if row is None or row["transaction_id"] in rows:
                 continue
-            # Check if the transaction already exists in the database
-            result = await db.execute(
-                select(Transaction).where(Transaction.transaction_id == tx_id)
-            )
-            if result.scalar_one_or_none():
-                # For now we skip updating existing transactions
-                logger.debug(f"Transaction ID {tx_id} already exists, skipping update.")
-                continue  # Skip if transaction already exists
-            transactionAmount = tx.get("transactionAmount", {})
-            amount = transactionAmount.get("amount", 0)
-            currency = transactionAmount.get("currency", "DKK")
-            booking_date = datetime.strptime(tx.get("bookingDate", tx.get("valueDate")), "%Y-%m-%d")
-            valueDate = datetime.strptime(tx.get("valueDate"), "%Y-%m-%d") if tx.get("valueDate") else None
-            creditorName = tx.get("creditorName", "Unknown")
-            remittanceInformationUnstructured = tx.get("remittanceInformationUnstructured", "Unknown")
-            # If there's no remittance information try remittanceInformationUnstructuredArray
-            if remittanceInformationUnstructured == "Unknown":
-                remittanceInformationUnstructuredArray = tx.get("remittanceInformationUnstructuredArray", [])
-                if remittanceInformationUnstructuredArray:
-                    remittanceInformationUnstructured = remittanceInformationUnstructuredArray[0]
-                else:
-                    remittanceInformationUnstructured = "Unknown"
+            rows[row["transaction_id"]] = row
+    return list(rows.values())
 
-            bankTransactionCode = tx.get("bankTransactionCode", "Unknown")
-            proprietaryBankTransactionCode = tx.get("proprietaryBankTransactionCode", "Unknown")
-            logger.info("Saving transaction with ID: %s, Amount: %s, Currency: %s, Booking Date: %s, Value Date: %s",
-                        tx_id, amount, currency, booking_date, valueDate)
-            # Create a new transaction object
-            transaction = Transaction(
-                account_id=account_db_id,
-                transaction_id=tx_id,
-                amount=Decimal(amount),
-                currency=currency,
-                booking_date=booking_date,
-                value_date=valueDate,
-                description=tx.get("description", "Unknown"),
-                remittance_information=remittanceInformationUnstructured,
-                creditor_name=creditorName,
-                debtor_name=tx.get("debtorName", "Unknown"),
-                transaction_type=tx.get("proprietaryBankTransactionCode", "Unknown"),
-                status="booked" if tx_type == "booked" else "pending",
-            )
 
-            db.add(transaction)
-            created_count += 1
-    await db.commit()
-    return {"created": created_count, "updated": updated_count}
-            
+async def existing_transactions(transaction_ids: list, db: AsyncSession) -> dict:
+    """
+    The stored values of transactions that already exist, by transaction ID.
+    Used to take updated rows out of the counts and rollups they were in before.
+    """
+    result = await db.execute(
+        select(
+            Transaction.transaction_id, Transaction.account_id, Transaction.status,
+            Transaction.amount, Transaction.currency, Transaction.booking_date
+        )
+        .where(Transaction.transaction_id.in_(transaction_ids))
+    )
+    return {row.transaction_id: row._mapping for row in result.all()}
+
 
-    
\ No newline at end of file
+async def save_transactions(transactions_data: dict, account_db_id: str, db: AsyncSession, chunk_size: int = CHUNK_SIZE):
+    """
+    Save a GoCardless transactions payload with one INSERT ... ON CONFLICT (transaction_id) DO UPDATE per chunk.
+    Existing rows are only rewritten when one of their values changed, and only when they belong to this account:
+    a transaction ID already saved on another account is left alone and counted as a conflict.
+    The per-account counts in account_transaction_counts, the daily_account_rollups and, when anything was written,
+    the owner's data_version are updated in the same transaction.
+    Returns the number of created, updated, unchanged and conflicting transactions.
+    """
+    counts = {"created": 0, "updated": 0, "unchanged": 0, "conflicts": 0}
+    all_transactions = transactions_data.get("transactions", {})  # Get the transactions
+    # Check early for no transactions
+    if not all_transactions:
+        logger.warning("No transactions found in the provided data.")
+        await db.commit()  # The caller's pending changes, like the watermarks and last_synced_at, are still saved
+        return counts
+
+    rows = normalize_transactions(transactions_data, account_db_id)
+    # Built once and executed per chunk, SQLAlchemy batches the parameter sets into multi-row VALUES
+    table = Transaction.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.transaction_id],
+        set_={column: stmt.excluded[column] for column in UPDATABLE_COLUMNS},
+        # Skip the write entirely when nothing changed or the row belongs to another account,
+        # those rows are not returned below
+        where=and_(
+            table.c.account_id == stmt.excluded.account_id,
+            or_(*[table.c[column].is_distinct_from(stmt.excluded[column]) for column in UPDATABLE_COLUMNS]),
+        ),
+    ).returning(
+        table.c.transaction_id,
+        # xmax is 0 for freshly inserted rows and set for rows that were updated
+        literal_column("xmax = 0").label("inserted"),
+    )
+    count_deltas = Counter()
+    rollup_deltas = RollupDeltas()
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        # Needed to move updated rows between counts and rollups, fx when a pending transaction is booked
+        previous = await existing_transactions([row["transaction_id"] for row in chunk], db)
+        result = await db.execute(stmt, chunk)
+        written = result.all()
+        by_id = {row["transaction_id"]: row for row in chunk}
+        created = 0
+        conflicts = sum(1 for transaction_id, old in previous.items() if old["account_id"] != account_db_id)
+        for transaction_id, inserted in written:
+            row = by_id[transaction_id]
+            if inserted:
+                created += 1
+            elif transaction_id in previous:
+                old = previous[transaction_id]
+                count_deltas[count_key(old["account_id"], old["status"])] -= 1
+                rollup_deltas.add(old, sign=-1)
+            else:
+                continue  # Inserted by a concurrent save after the lookup above, which counted it
+            count_deltas[count_key(row["account_id"], row["status"])] += 1
+            rollup_deltas.add(row)
+        record_saved_transactions(db, account_db_id, (transaction_id for transaction_id, _ in written))
+        counts["created"] += created
+        counts["updated"] += len(written) - created
+        counts["unchanged"] += len(chunk) - len(written) - conflicts
+        counts["conflicts"] += conflicts
+        logger.debug("Saved chunk of %s transactions for account %s", len(chunk), account_db_id)
+
+    await apply_count_deltas(count_deltas, db)
+    await apply_rollup_deltas(rollup_deltas, db)
+    if counts["created"] or counts["updated"]:
+        # A sync that wrote nothing keeps the owner's cached responses and columns
+        await bump_data_version(db, account_ids=[account_db_id])
+    await db.commit()
+    if counts["conflicts"]:
+        logger.warning(
+            "%s transactions for account %s already belong to another account and were skipped",
+            counts["conflicts"], account_db_id
+        )
+    logger.info(
+        "Saved transactions for account %s: %s created, %s updated, %s unchanged",
+        account_db_id, counts["created"], counts["updated"], counts["unchanged"]
+    )
+    return counts
@@ -0,0 +1,441 @@
+from app.db.models import Transaction, AccountTransactionCount, DailyAccountRollup
+from app.services.save_transactions import normalize_transaction, UPDATABLE_COLUMNS
+from app.services.transaction_counts import UNKNOWN_STATUS
+from app.services.data_version import bump_data_version
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+from sqlalchemy import (
+    Table, Column, MetaData, BigInteger, Integer, String, Numeric, DateTime, Boolean, Date,
+    and_, cast, func, literal, literal_column, or_, union_all,
+)
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+from itertools import chain, islice
+import xml.etree.ElementTree as ElementTree
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import logging
+from app.core.config import settings
+import re
+
+try:
+    import orjson
+except ImportError:  # Optional, only used to read GoCardless JSON faster
+    orjson = None
+
+logger = logging.getLogger(__name__)  # Set up a logger for this module
+
+# Rows parsed and sent to COPY at a time
+IMPORT_BATCH_SIZE = settings.import_batch_size
+
+IMPORT_FORMATS = ("csv", "camt053", "gocardless")
+
+# Columns written to the staging table, in the order of the COPY records
+COPY_COLUMNS = [column.name for column in Transaction.__table__.columns]
+
+metadata = MetaData()
+
+# Parsed rows are copied here first, then merged into transactions with a single statement
+staging = Table(
+    "transaction_import",
+    metadata,
+    Column("line", BigInteger),  # Position in the file, later lines win over earlier ones with the same ID
+    *[Column(column.name, column.type) for column in Transaction.__table__.columns],
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+# What the merge wrote: the new values (sign 1) and the replaced values (sign -1) of every written row.
+# Counts and rollups are updated from this.
+changes = Table(
+    "transaction_import_changes",
+    metadata,
+    Column("sign", Integer),
+    Column("inserted", Boolean),
+    Column("account_id", String),
+    Column("status", String),
+    Column("amount", Numeric),
+    Column("currency", String),
+    Column("booking_date", DateTime),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+# Normalized CSV header names (lower case, no spaces or underscores) for each GoCardless field,
+# covering common English and Danish bank exports
+CSV_COLUMNS = {
+    "transactionId": ("transactionid", "id", "reference", "referencenummer"),
+    "bookingDate": ("bookingdate", "date", "dato", "bogføringsdato", "bogført", "posteringsdato"),
+    "valueDate": ("valuedate", "rentedato", "valør"),
+    "amount": ("amount", "beløb", "belob"),
+    "currency": ("currency", "valuta"),
+    "remittanceInformationUnstructured": ("remittanceinformation", "description", "text", "tekst", "beskrivelse"),
+    "creditorName": ("creditorname", "creditor", "modtager"),
+    "debtorName": ("debtorname", "debtor", "afsender"),
+    "proprietaryBankTransactionCode": ("transactiontype", "type", "kategori"),
+    "status": ("status",),
+}
+PENDING_STATUSES = {"pending", "pdng", "venter", "reserveret", "afventer"}
+# A plain decimal string as parse_amount leaves it, fx "-1234.56"
+AMOUNT_PATTERN = re.compile(r"[+-]?(\d+\.?\d*|\.\d+)")
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d-%m-%Y", "%d/%m/%Y", "%Y/%m/%d")
+
+
+def detect_format(filename: str) -> str:
+    """
+    Import format from a file name, None when it can't be told
+    """
+    name = filename.lower()
+    if name.endswith(".csv") or name.endswith(".txt"):
+        return "csv"
+    if name.endswith(".xml") or ".camt" in name or ".053" in name:
+        return "camt053"
+    if name.endswith(".json"):
+        return "gocardless"
+    return None
+
+
+def parse_amount(value: str) -> str:
+    """
+    Amount as a plain decimal string, from "-1.234,56", "-1,234.56", "1234.56" or "-1 234,56".
+    Raises ValueError for an empty or non-numeric value, fx the balance line of a bank export.
+    """
+    amount = re.sub(r"[\s ']", "", value or "")
+    if "," in amount and "." in amount:
+        decimal = "," if amount.rindex(",") > amount.rindex(".") else "."
+        amount = amount.replace("." if decimal == "," else ",", "")
+    amount = amount.replace(",", ".")
+    if not AMOUNT_PATTERN.fullmatch(amount):
+        raise ValueError(f"Invalid amount: {value!r}")
+    return amount
+
+
+@lru_cache(maxsize=65536)
+def parse_date(value: str) -> str:
+    """
+    ISO date of a date in one of DATE_FORMATS or with a time part after it.
+    Cached, a statement has far fewer distinct dates than lines and strptime is slow.
+    """
+    value = value.strip()[:10]
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"Unknown date format: {value}")
+
+
+def import_key(account_id: str, tx: dict, reference: str = None) -> tuple:
+    """
+    What identifies a statement line within its account: the bank's reference when the file has one,
+    otherwise its booking date, amount and text
+    """
+    if reference:
+        return account_id, "ref:" + reference
+    return (
+        account_id,
+        tx.get("bookingDate") or "",
+        tx["transactionAmount"]["amount"],
+        tx.get("remittanceInformationUnstructured") or "",
+    )
+
+
+def import_transaction_id(key: tuple, occurrence: int) -> str:
+    """
+    Stable ID for a statement line, so importing the same file again doesn't duplicate it.
+    IDs are derived from the account, so a file can't name transactions of other accounts,
+    and lines with the same key are told apart by their occurrence in the file.
+    """
+    return "import-" + hashlib.sha256("|".join([*key, str(occurrence)]).encode()).hexdigest()[:32]
+
+
+def parse_csv(file, account_id: str, currency: str, encoding: str = "utf-8-sig"):
+    """
+    (status, GoCardless transaction) for every line of a bank CSV export, read line by line.
+    The delimiter is sniffed and the columns are matched by their header names.
+    """
+    text = io.TextIOWrapper(file, encoding=encoding, newline="")
+    first_line = text.readline()
+    try:
+        dialect = csv.Sniffer().sniff(first_line, delimiters=",;\t|")
+    except csv.Error:
+        dialect = csv.excel  # A single column or an unusual header, fall back to commas
+    reader = csv.reader(chain([first_line], text), dialect)
+    header = [re.sub(r"[\s_]", "", name.lower()) for name in next(reader)]
+    positions = {}
+    for field, aliases in CSV_COLUMNS.items():
+        for alias in aliases:
+            if alias in header:
+                positions[field] = header.index(alias)
+                break
+    if "bookingDate" not in positions or "amount" not in positions:
+        raise ValueError("The CSV file needs a date and an amount column")
+    occurrences = Counter()
+    for line in reader:
+        if not any(line):
+            continue
+        values = {field: line[position].strip() for field, position in positions.items() if position < len(line)}
+        try:
+            tx = {
+                "bookingDate": parse_date(values.get("bookingDate", "")),
+                "transactionAmount": {
+                    "amount": parse_amount(values.get("amount")),
+                    "currency": values.get("currency") or currency,
+                },
+            }
+            if values.get("valueDate"):
+                tx["valueDate"] = parse_date(values["valueDate"])
+        except ValueError as e:
+            raise ValueError(f"Line {reader.line_num}: {e}") from e
+        for field in ("remittanceInformationUnstructured", "creditorName", "debtorName", "proprietaryBankTransactionCode"):
+            if values.get(field):
+                tx[field] = values[field]
+        key = import_key(account_id, tx, values.get("transactionId"))
+        occurrences[key] += 1
+        tx["transactionId"] = import_transaction_id(key, occurrences[key])
+        yield ("pending" if values.get("status", "").lower() in PENDING_STATUSES else "booked"), tx
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _find(element, *path):
+    """
+    First descendant following the path of local tag names, CAMT namespaces differ between versions
+    """
+    for name in path:
+        if element is None:
+            return None
+        element = next((child for child in element if _local(child.tag) == name), None)
+    return element
+
+
+def _text(element, *path) -> str:
+    found = _find(element, *path)
+    return found.text.strip() if found is not None and found.text else None
+
+
+def parse_camt053(file, account_id: str, currency: str):
+    """
+    (status, GoCardless transaction) for every entry (Ntry) of an ISO 20022 CAMT.053 statement.
+    The XML is parsed incrementally and every entry is dropped once read, so large statements use little memory.
+    """
+    occurrences = Counter()
+    events = ElementTree.iterparse(file, events=("start", "end"))
+    _, root = next(events)
+    for event, element in events:
+        if event != "end" or _local(element.tag) != "Ntry":
+            continue
+        amount = _find(element, "Amt")
+        value = parse_amount(amount.text)
+        if _text(element, "CdtDbtInd") == "DBIT":
+            value = "-" + value
+        details = _find(element, "NtryDtls", "TxDtls")
+        tx = {
+            "bookingDate": parse_date(_text(element, "BookgDt", "Dt") or _text(element, "BookgDt", "DtTm")),
+            "transactionAmount": {"amount": value, "currency": amount.get("Ccy") or currency},
+        }
+        value_date = _text(element, "ValDt", "Dt") or _text(element, "ValDt", "DtTm")
+        if value_date:
+            tx["valueDate"] = parse_date(value_date)
+        remittance = _text(details, "RmtInf", "Ustrd") or _text(element, "AddtlNtryInf")
+        if remittance:
+            tx["remittanceInformationUnstructured"] = remittance
+        for field, party in (("creditorName", "Cdtr"), ("debtorName", "Dbtr")):
+            # Pty in camt.053.001.08 and later, the name directly under the party before that
+            name = _text(details, "RltdPties", party, "Pty", "Nm") or _text(details, "RltdPties", party, "Nm")
+            if name:
+                tx[field] = name
+        code = _text(element, "BkTxCd", "Prtry", "Cd")
+        if code:
+            tx["proprietaryBankTransactionCode"] = code
+        reference = (
+            _text(element, "AcctSvcrRef") or _text(element, "NtryRef")
+            or _text(details, "Refs", "AcctSvcrRef") or _text(details, "Refs", "EndToEndId")
+        )
+        key = import_key(account_id, tx, reference if reference != "NOTPROVIDED" else None)
+        occurrences[key] += 1
+        tx["transactionId"] = import_transaction_id(key, occurrences[key])
+        status = _text(element, "Sts", "Cd") or _text(element, "Sts")
+        yield ("pending" if (status or "").lower() in PENDING_STATUSES else "booked"), tx
+        root.clear()  # Drop the entries read so far
+
+
+def parse_gocardless(file, account_id: str, currency: str):
+    """
+    (status, GoCardless transaction) for a saved GoCardless transactions response,
+    {"transactions": {"booked": [...], "pending": [...]}}. JSON can't be read incrementally with the
+    standard library, so the file is loaded in one go.
+    The GoCardless transaction IDs are kept so the import lines up with synced transactions, IDs that already belong
+    to another account are skipped by the merge.
+    """
+    data = orjson.loads(file.read()) if orjson is not None else json.load(file)
+    transactions = data.get("transactions", data)
+    for status in ("booked", "pending"):
+        for tx in transactions.get(status, []):
+            yield status, tx
+
+
+PARSERS = {
+    "csv": parse_csv,
+    "camt053": parse_camt053,
+    "gocardless": parse_gocardless,
+}
+
+
+def statement_records(file, format: str, account_id: str, currency: str, **options):
+    """
+    COPY records (line, *COPY_COLUMNS) of a statement file, normalized like save_transactions does
+    """
+    created_at = datetime.utcnow()
+    for line, (status, tx) in enumerate(PARSERS[format](file, account_id, currency, **options)):
+        row = normalize_transaction(tx, status, account_id, created_at)
+        if row is not None:
+            yield (line, *[row.get(column) for column in COPY_COLUMNS])
+
+
+def merge_statement():
+    """
+    Upsert the staged rows into transactions in one statement, the same way save_transactions does per chunk:
+    a transaction ID in the file more than once is only kept once (booked over pending, then the last line),
+    and existing rows are only rewritten when a value changed and they belong to the same account.
+    The new and previous values of the written rows go to the changes table.
+    """
+    table = Transaction.__table__
+    columns = [staging.c[column] for column in COPY_COLUMNS]
+    source = (
+        select(*columns)
+        .distinct(staging.c.transaction_id)
+        .order_by(staging.c.transaction_id, (staging.c.status == "booked").desc(), staging.c.line.desc())
+        .cte("source")
+    )
+    upsert = insert(table).from_select(COPY_COLUMNS, select(*[source.c[column] for column in COPY_COLUMNS]))
+    written = upsert.on_conflict_do_update(
+        index_elements=[table.c.transaction_id],
+        set_={column: upsert.excluded[column] for column in UPDATABLE_COLUMNS},
+        where=and_(
+            table.c.account_id == upsert.excluded.account_id,
+            or_(*[table.c[column].is_distinct_from(upsert.excluded[column]) for column in UPDATABLE_COLUMNS]),
+        ),
+    ).returning(
+        table.c.transaction_id, table.c.account_id, table.c.status, table.c.amount, table.c.currency, table.c.booking_date,
+        literal_column("xmax = 0").label("inserted"),
+    ).cte("written")
+    # Every part of the statement sees the table as it was before it, so this reads the previous values
+    previous = (
+        select(table.c.transaction_id, table.c.account_id, table.c.status, table.c.amount, table.c.currency, table.c.booking_date)
+        .where(table.c.transaction_id.in_(select(source.c.transaction_id)))
+        .cte("previous")
+    )
+    values = ("account_id", "status", "amount", "currency", "booking_date")
+    return insert(changes).from_select(
+        ["sign", "inserted", *values],
+        union_all(
+            select(literal(1), written.c.inserted, *[written.c[column] for column in values]),
+            select(literal(-1), literal(None, Boolean), *[previous.c[column] for column in values])
+            .join(written, written.c.transaction_id == previous.c.transaction_id),
+        ),
+    ).add_cte(source, written, previous)
+
+
+async def apply_changes(db: AsyncSession):
+    """
+    Update account_transaction_counts and daily_account_rollups from the changes table, like the deltas of save_transactions
+    """
+    counts = AccountTransactionCount.__table__
+    status = func.coalesce(changes.c.status, UNKNOWN_STATUS).label("status")
+    stmt = insert(counts).from_select(
+        ["account_id", "status", "count"],
+        select(changes.c.account_id, status, func.sum(changes.c.sign)).group_by(changes.c.account_id, status),
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[counts.c.account_id, counts.c.status],
+        set_={"count": counts.c.count + stmt.excluded.count},
+    ))
+
+    rollups = DailyAccountRollup.__table__
+    signed = changes.c.sign * changes.c.amount
+    day = cast(changes.c.booking_date, Date)
+    stmt = insert(rollups).from_select(
+        ["account_id", "day", "currency", "income", "expenses", "tx_count"],
+        select(
+            changes.c.account_id, day, changes.c.currency,
+            func.coalesce(func.sum(signed).filter(changes.c.amount > 0), 0),
+            func.coalesce(func.sum(signed).filter(changes.c.amount < 0), 0),
+            func.sum(changes.c.sign),
+        ).group_by(changes.c.account_id, day, changes.c.currency),
+    )
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[rollups.c.account_id, rollups.c.day, rollups.c.currency],
+        set_={
+            "income": rollups.c.income + stmt.excluded.income,
+            "expenses": rollups.c.expenses + stmt.excluded.expenses,
+            "tx_count": rollups.c.tx_count + stmt.excluded.tx_count,
+        },
+    ))
+
+
+async def import_statement(file, format: str, account_id: str, currency: str, db: AsyncSession, **options) -> dict:
+    """
+    Import a statement file (binary file object) into an account in one transaction.
+    Lines are parsed in a worker thread IMPORT_BATCH_SIZE at a time and streamed into a temporary staging table
+    with COPY, then merged into transactions with a single INSERT ... SELECT ... ON CONFLICT, which also
+    dedupes the file. Counts, rollups and, when anything was written, the owner's data_version are updated
+    in the same transaction.
+    Returns the number of lines read and of created, updated, unchanged and conflicting transactions.
+    """
+    if format not in PARSERS:
+        raise ValueError(f"Unknown import format {format}")
+    records = statement_records(file, format, account_id, currency, **options)
+    read = 0
+
+    async def batches():
+        nonlocal read
+        while True:
+            batch = await asyncio.to_thread(list, islice(records, IMPORT_BATCH_SIZE))
+            if not batch:
+                return
+            read += len(batch)
+            for record in batch:
+                yield record
+
+    connection = await db.connection()
+    await connection.run_sync(metadata.create_all)
+    raw = await connection.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        staging.name, records=batches(), columns=["line", *COPY_COLUMNS]
+    )
+    await db.execute(merge_statement())
+    result = await db.execute(
+        select(
+            func.count().filter(changes.c.inserted),
+            func.count().filter(changes.c.inserted.is_(False)),
+            select(func.count(func.distinct(staging.c.transaction_id))).scalar_subquery(),
+            # IDs of another account's transactions, which the merge left alone
+            select(func.count(func.distinct(staging.c.transaction_id)))
+            .join(Transaction, Transaction.transaction_id == staging.c.transaction_id)
+            .where(Transaction.account_id != account_id)
+            .scalar_subquery(),
+        )
+    )
+    created, updated, distinct, conflicts = result.one()
+    await apply_changes(db)
+    if created or updated:
+        await bump_data_version(db, account_ids=[account_id])
+    await db.commit()
+    counts = {
+        "read": read,
+        "duplicates": read - distinct,
+        "created": created,
+        "updated": updated,
+        "unchanged": distinct - created - updated - conflicts,
+        "conflicts": conflicts,
+    }
+    logger.info("Imported %s statement into account %s: %s", format, account_id, counts)
+    return counts
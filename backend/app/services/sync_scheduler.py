@@ -0,0 +1,221 @@
+from app.db.database import AsyncSessionLocal
+from app.db.models import Account, SyncJob
+from app.services.openbanking import OpenBankingService
+from app.services.rate_limit import RateLimitExceeded
+from app.services.save_accounts import extract_balance_amount
+from app.services.data_version import bump_data_version
+from app.services.sync_transactions import sync_account_transactions
+from sqlalchemy.dialects.postgresql import BIT, insert
+from sqlalchemy.future import select
+from sqlalchemy import BigInteger, cast, delete, exists, func, literal, or_, update
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Callable
+import asyncio
+import logging
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)  # Set up a logger for this module
+
+SYNC_SCHEDULER_ENABLED = settings.sync_scheduler_enabled
+# Number of worker coroutines running sync jobs concurrently
+SYNC_WORKERS = settings.sync_workers
+# GoCardless allows 4 calls per account per endpoint per day, so sync each account at most that often
+SYNCS_PER_DAY = settings.syncs_per_day
+# Seconds between scheduler runs that enqueue due accounts
+SYNC_SCHEDULER_INTERVAL = settings.sync_scheduler_interval
+# Seconds a worker sleeps when the queue is empty
+SYNC_POLL_INTERVAL = settings.sync_poll_interval
+SYNC_JOB_MAX_ATTEMPTS = settings.sync_job_max_attempts
+# Running jobs older than this are assumed to belong to a crashed worker and are queued again
+SYNC_JOB_TIMEOUT = timedelta(minutes=settings.sync_job_timeout_minutes)
+# Finished jobs are kept this long for inspection
+SYNC_JOB_RETENTION = timedelta(days=settings.sync_job_retention_days)
+
+ACTIVE_STATUSES = ["queued", "running"]
+
+
+def sync_period() -> timedelta:
+    return timedelta(days=1) / SYNCS_PER_DAY
+
+
+def latest_slot(now: datetime):
+    """
+    Latest scheduled sync time of each account at or before now, as an SQL expression on Account.id.
+    Every account gets a stable offset within the sync period from the md5 of its id, so syncs are spread across
+    the day instead of all accounts hitting the upstream quota at the same moment.
+    """
+    period = sync_period().total_seconds()
+    offset = cast(cast(literal("x").concat(func.substr(func.md5(Account.id), 1, 8)), BIT(32)), BigInteger) % int(period)
+    slot = func.floor((literal(now.timestamp()) - offset) / period) * period + offset
+    return func.to_timestamp(slot)
+
+
+async def enqueue_due_jobs(now: datetime = None) -> int:
+    """
+    Queue a sync job for every account whose last sync is older than its latest slot.
+    Due accounts are selected in SQL and inserted with one INSERT ... SELECT, accounts that already have a queued
+    or running job are skipped. Returns the number of jobs queued.
+    """
+    now = now or datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as db:
+        due = (
+            select(Account.id, literal("queued"), literal(now), literal(0), literal(now))
+            .where(
+                or_(Account.last_synced_at.is_(None), Account.last_synced_at < latest_slot(now)),
+                ~exists().where(SyncJob.account_id == Account.id, SyncJob.status.in_(ACTIVE_STATUSES)),
+            )
+        )
+        stmt = (
+            insert(SyncJob)
+            .from_select(["account_id", "status", "run_after", "attempts", "created_at"], due)
+            .on_conflict_do_nothing(
+                index_elements=[SyncJob.account_id],
+                index_where=SyncJob.status.in_(ACTIVE_STATUSES),
+            )
+            .returning(SyncJob.id)
+        )
+        queued = len((await db.execute(stmt)).all())
+        # Recover jobs from crashed workers and clean up old finished jobs
+        await db.execute(
+            update(SyncJob)
+            .where(SyncJob.status == "running", SyncJob.started_at < now - SYNC_JOB_TIMEOUT)
+            .values(status="queued", run_after=now)
+        )
+        await db.execute(
+            delete(SyncJob)
+            .where(SyncJob.status.in_(["done", "failed"]), SyncJob.finished_at < now - SYNC_JOB_RETENTION)
+        )
+        await db.commit()
+    return queued
+
+
+async def claim_job():
+    """
+    Claim the next runnable job. SKIP LOCKED lets several workers (and processes) poll the queue without blocking each other.
+    """
+    now = datetime.now(timezone.utc)
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(SyncJob)
+            .where(SyncJob.status == "queued", SyncJob.run_after <= now)
+            .order_by(SyncJob.run_after)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = result.scalar_one_or_none()
+        if job is None:
+            return None
+        job.status = "running"
+        job.started_at = now
+        job.attempts += 1
+        await db.commit()
+        return job
+
+
+async def finish_job(job: SyncJob, error: Exception = None):
+    now = datetime.now(timezone.utc)
+    values = {"finished_at": now, "status": "done", "last_error": None}
+    if isinstance(error, RateLimitExceeded):
+        # Out of quota is not a failure, run the job again once the quota allows it
+        values.update(
+            status="queued",
+            finished_at=None,
+            attempts=job.attempts - 1,
+            last_error=str(error),
+            run_after=now + timedelta(seconds=error.retry_after),
+        )
+    elif error is not None:
+        values["last_error"] = str(error)[:1000]
+        if job.attempts < SYNC_JOB_MAX_ATTEMPTS:
+            # Retry later with exponential backoff
+            values.update(status="queued", finished_at=None, run_after=now + timedelta(minutes=2 ** job.attempts))
+        else:
+            values["status"] = "failed"
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(SyncJob).where(SyncJob.id == job.id).values(**values))
+        await db.commit()
+
+
+async def run_job(job: SyncJob, service: OpenBankingService):
+    """
+    Refresh the balance and sync new transactions for the job's account
+    """
+    async with AsyncSessionLocal() as db:
+        account = await db.get(Account, job.account_id)
+        if account is None:
+            return
+        # Don't spend the balance call when the transactions quota is already used up
+        if service.rate_limiter is not None:
+            wait = service.rate_limiter.wait_time(account.account_number, "transactions")
+            if wait > 0:
+                raise RateLimitExceeded(account.account_number, "transactions", wait)
+        balances = await service.get_account_balance(account_number=account.account_number)
+        balance_amount = extract_balance_amount(balances or {})
+        if balance_amount is not None:
+            balance = Decimal(balance_amount)
+            if balance != account.balance:
+                # Cached account and dashboard responses show the balance, while save_transactions only bumps
+                # data_version when transactions were written
+                await bump_data_version(db, account_ids=[account.id])
+            account.balance = balance
+            account.balance_updated_at = datetime.now(timezone.utc)
+        _, counts = await sync_account_transactions(service, account, db)
+        if counts is None:
+            # Nothing to save, commit the balance and the sync time on their own
+            account.last_synced_at = datetime.now(timezone.utc)
+            await db.commit()
+        logger.info("Synced account %s: %s", account.id, counts)
+
+
+class SyncScheduler:
+    """
+    Background scheduler that enqueues per-account sync jobs and runs them with a bounded number of workers.
+    Started and stopped by the app lifespan when SYNC_SCHEDULER_ENABLED is set.
+    """
+
+    def __init__(self, service_factory: Callable[[], OpenBankingService], workers: int = SYNC_WORKERS):
+        self.service_factory = service_factory
+        self.workers = workers
+        self._tasks = []
+
+    def start(self):
+        self._tasks.append(asyncio.create_task(self._schedule_loop()))
+        for _ in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker_loop()))
+        logger.info("Sync scheduler started with %s workers", self.workers)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _schedule_loop(self):
+        while True:
+            try:
+                queued = await enqueue_due_jobs()
+                if queued:
+                    logger.info("Enqueued %s sync jobs for due accounts", queued)
+            except Exception:
+                logger.exception("Error while enqueueing sync jobs")
+            await asyncio.sleep(SYNC_SCHEDULER_INTERVAL)
+
+    async def _worker_loop(self):
+        while True:
+            try:
+                job = await claim_job()
+            except Exception:
+                logger.exception("Error while claiming sync job")
+                job = None
+            if job is None:
+                await asyncio.sleep(SYNC_POLL_INTERVAL)
+                continue
+            try:
+                await run_job(job, self.service_factory())
+                await finish_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Sync job %s for account %s did not complete: %s", job.id, job.account_id, e)
+                await finish_job(job, error=e)
@@ -0,0 +1,60 @@
+from app.db.models import Account
+from app.services.openbanking import OpenBankingService
+from app.services.save_transactions import save_transactions
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone, date
+import logging
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)  # Set up a logger for this module
+
+# Days before the last booked date that are fetched again on every sync.
+# Transactions can be booked late or change from pending to booked, so the window overlaps the previous sync.
+SYNC_OVERLAP_DAYS = settings.sync_overlap_days
+
+
+def sync_date_from(account: Account, full_resync: bool = False) -> date:
+    """
+    First booking date to request for the account, or None to fetch the full history.
+    """
+    if full_resync or account.last_booked_date is None:
+        return None
+    return (account.last_booked_date - timedelta(days=SYNC_OVERLAP_DAYS)).date()
+
+
+def latest_booked_date(transactions_data: dict) -> datetime:
+    """
+    Latest bookingDate among the booked transactions of a GoCardless payload, or None
+    """
+    booked = transactions_data.get("transactions", {}).get("booked", [])
+    dates = [tx.get("bookingDate") or tx.get("valueDate") for tx in booked]
+    dates = [d for d in dates if d]
+    if not dates:
+        return None
+    return datetime.strptime(max(dates), "%Y-%m-%d")  # ISO dates sort as strings
+
+
+def advance_watermarks(account: Account, transactions_data: dict):
+    """
+    Move the account's sync watermarks forward after a successful fetch.
+    The changes are committed together with the transactions by save_transactions.
+    """
+    account.last_synced_at = datetime.now(timezone.utc)
+    latest = latest_booked_date(transactions_data)
+    if latest and (account.last_booked_date is None or latest > account.last_booked_date):
+        account.last_booked_date = latest
+
+
+async def sync_account_transactions(service: OpenBankingService, account: Account, db: AsyncSession, full_resync: bool = False):
+    """
+    Fetch the transactions booked since the account's watermark (minus the overlap window) and save them.
+    Returns the GoCardless payload and the save counts, the counts are None if nothing was returned.
+    """
+    date_from = sync_date_from(account, full_resync)
+    logger.info("Syncing transactions for account %s from %s", account.id, date_from or "the beginning")
+    transactions_data = await service.get_account_transactions(account_number=account.account_number, date_from=date_from)
+    if not transactions_data:
+        return transactions_data, None
+    advance_watermarks(account, transactions_data)
+    counts = await save_transactions(transactions_data, account.id, db)  # Commits the watermarks as well
+    return transactions_data, counts
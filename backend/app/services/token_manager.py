@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import time
+
+import httpx
+
+from app.services.openbanking import GOCARDLESS_BASE_URL, ENDPOINT_TIMEOUTS, send_timed
+
+logger = logging.getLogger("openbanking.tokens")
+
+
+class TokenManager:
+    """
+    Process-wide cache of the GoCardless access token.
+    Tokens are reused until shortly before they expire, renewed through /token/refresh/ while the
+    refresh token is valid, and only re-issued through /token/new/ as a last resort.
+    Concurrent callers share a single in-flight authentication.
+    """
+
+    def __init__(self, secret_id=None, secret_key=None, client: httpx.AsyncClient = None,
+                 base_url: str = GOCARDLESS_BASE_URL, leeway: float = 60.0):
+        self.secret_id = secret_id
+        self.secret_key = secret_key
+        self.client = client
+        self.base_url = base_url
+        self.leeway = leeway  # Seconds before expiry at which a token is treated as expired
+
+        self._access = None
+        self._access_expires_at = 0.0
+        self._refresh = None
+        self._refresh_expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _access_valid(self) -> bool:
+        return self._access is not None and time.monotonic() < self._access_expires_at
+
+    def _refresh_valid(self) -> bool:
+        return self._refresh is not None and time.monotonic() < self._refresh_expires_at
+
+    async def get_token(self) -> str:
+        """
+        Return a valid access token, authenticating against GoCardless only when needed
+        """
+        if self._access_valid():
+            return self._access
+        async with self._lock:
+            # Another request may have renewed the token while we were waiting for the lock
+            if self._access_valid():
+                return self._access
+            if self._refresh_valid():
+                try:
+                    await self._refresh_access_token()
+                    return self._access
+                except httpx.HTTPStatusError as e:
+                    logger.warning("Token refresh failed with status %s, requesting a new token", e.response.status_code)
+            await self._new_token()
+            return self._access
+
+    def invalidate(self, token: str):
+        """
+        Drop the cached access token after upstream rejected it.
+        A token that has already been replaced is left alone, so late 401s don't throw away a fresh token.
+        """
+        if token is not None and token == self._access:
+            self._access = None
+            self._access_expires_at = 0.0
+
+    async def _post(self, path: str, data: dict) -> dict:
+        url = f"{self.base_url}{path}"
+        timeout = ENDPOINT_TIMEOUTS["token"]
+        if self.client is not None:
+            response = await send_timed(self.client, "POST", url, "token", data=data, timeout=timeout)
+        else:
+            async with httpx.AsyncClient() as client:
+                response = await send_timed(client, "POST", url, "token", data=data, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    async def _new_token(self):
+        if not self.secret_id or not self.secret_key:
+            raise ValueError("Secret ID and Secret Key must be set.")
+        logger.info("Requesting new access token from GoCardless")
+        data = await self._post("/token/new/", {"secret_id": self.secret_id, "secret_key": self.secret_key})
+        now = time.monotonic()
+        self._access = data["access"]
+        self._access_expires_at = now + data.get("access_expires", 0) - self.leeway
+        self._refresh = data.get("refresh")
+        self._refresh_expires_at = now + data.get("refresh_expires", 0) - self.leeway
+
+    async def _refresh_access_token(self):
+        logger.info("Refreshing GoCardless access token")
+        data = await self._post("/token/refresh/", {"refresh": self._refresh})
+        self._access = data["access"]
+        self._access_expires_at = time.monotonic() + data.get("access_expires", 0) - self.leeway
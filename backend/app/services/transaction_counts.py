@@ -0,0 +1,63 @@
+from app.db.models import AccountTransactionCount, Transaction
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+from sqlalchemy import event, func, update
+from collections import Counter
+
+UNKNOWN_STATUS = "unknown"  # Counted status of transactions stored without one
+
+
+def count_key(account_id: str, status: str) -> tuple:
+    return account_id, status or UNKNOWN_STATUS
+
+
+async def apply_count_deltas(deltas: Counter, db: AsyncSession):
+    """
+    Add the (account_id, status) -> change deltas to account_transaction_counts.
+    Runs in the caller's transaction, so the counts are committed together with the transactions they describe.
+    """
+    rows = [
+        {"account_id": account_id, "status": status, "count": delta}
+        for (account_id, status), delta in deltas.items() if delta
+    ]
+    if not rows:
+        return
+    table = AccountTransactionCount.__table__
+    stmt = insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.account_id, table.c.status],
+        set_={"count": table.c.count + stmt.excluded.count},
+    )
+    await db.execute(stmt, rows)
+
+
+async def count_transactions(account_ids: list, db: AsyncSession, status: str = None) -> int:
+    """
+    Number of transactions on the given accounts, optionally only with the given status.
+    Reads one row per account and status instead of counting the transactions table.
+    """
+    if not account_ids:
+        return 0
+    stmt = (
+        select(func.coalesce(func.sum(AccountTransactionCount.count), 0))
+        .where(AccountTransactionCount.account_id.in_(account_ids))
+    )
+    if status is not None:
+        stmt = stmt.where(AccountTransactionCount.status == status)
+    result = await db.execute(stmt)
+    return result.scalar_one()
+
+
+@event.listens_for(Transaction, "after_delete")
+def decrement_deleted_transaction(mapper, connection, target):
+    """
+    Keep the counts right when a transaction is deleted through the ORM, in the same transaction as the delete.
+    Deleting an account removes its counts through the foreign key cascade.
+    """
+    account_id, status = count_key(target.account_id, target.status)
+    connection.execute(
+        update(AccountTransactionCount)
+        .where(AccountTransactionCount.account_id == account_id, AccountTransactionCount.status == status)
+        .values(count=AccountTransactionCount.count - 1)
+    )
@@ -1,21 +1,65 @@
+"""
+Add a test account for a user, creating the user and a requisition for it if needed.
+
+Usage:
+    python scripts/add_test_account.py --email test@example.com --name "Test Account"
+"""
 import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
+import argparse
 import asyncio
-from app.db.database import AsyncSessionLocal
-from app.db.models import Account
+from uuid import uuid4
+
+from sqlalchemy import select
+
+from app.db.database import AsyncSessionLocal, engine
+from app.db.models import User, BankRequisition, Account
+
+TEST_INSTITUTION_ID = "TEST"
 
-async def add_test_account():
+
+async def add_test_account(email: str, name: str, iban: str, currency: str, balance: float):
     async with AsyncSessionLocal() as session:
+        user = await session.scalar(select(User).where(User.email == email))
+        if user is None:
+            user = User(email=email, name="Test User")
+            session.add(user)
+            await session.flush()
+        # One requisition per test user holds all their test accounts
+        requisition = await session.scalar(
+            select(BankRequisition)
+            .where(BankRequisition.user_id == user.id, BankRequisition.institution_id == TEST_INSTITUTION_ID)
+        )
+        if requisition is None:
+            requisition = BankRequisition(
+                requisition_id=str(uuid4()), institution_id=TEST_INSTITUTION_ID, link="http://localhost",
+                status="LN", user_id=user.id,
+            )
+            session.add(requisition)
+            await session.flush()
         test_account = Account(
-            name="Test Account",
-            iban="DK1234567890123456",
-            currency="DKK"
+            requisition_id=requisition.id,
+            account_id=str(uuid4()),
+            account_number=str(uuid4()),
+            name=name,
+            iban=iban,
+            currency=currency,
+            balance=balance,
         )
         session.add(test_account)
         await session.commit()
-        print("Test account added.")
+        print(f"Test account {test_account.id} added for user {user.id} ({email}).")
+    await engine.dispose()
+
 
 if __name__ == "__main__":
-    asyncio.run(add_test_account())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--email", default="test@example.com", help="E-mail of the user, created if it doesn't exist")
+    parser.add_argument("--name", default="Test Account", help="Name of the account")
+    parser.add_argument("--iban", default="DK1234567890123456")
+    parser.add_argument("--currency", default="DKK")
+    parser.add_argument("--balance", type=float, default=0)
+    args = parser.parse_args()
+    asyncio.run(add_test_account(args.email, args.name, args.iban, args.currency, args.balance))
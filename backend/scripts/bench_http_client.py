@@ -0,0 +1,86 @@
+"""
+Benchmark per-call latency of OpenBankingService with and without the shared, pooled HTTP client.
+
+Runs a small stub of the GoCardless balances endpoint on localhost and calls it sequentially,
+first opening a new client per call (the old behaviour) and then through one pooled client.
+
+Usage:
+    python scripts/bench_http_client.py --calls 500
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import asyncio
+import logging
+import socket
+import statistics
+import time
+
+import uvicorn
+from fastapi import FastAPI
+
+from app.services.openbanking import OpenBankingService, create_http_client
+
+stub = FastAPI()
+
+
+@stub.get("/api/v2/accounts/{account_number}/balances/")
+async def balances(account_number: str):
+    return {"balances": [{"balanceType": "expected", "balanceAmount": {"amount": "100.00", "currency": "DKK"}}]}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_calls(service: OpenBankingService, calls: int) -> list[float]:
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        await service.get_account_balance("bench-account")
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label: str, timings: list[float]):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{label:<22} mean {statistics.mean(timings):7.3f} ms   p50 {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms")
+
+
+async def main(calls: int):
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(stub, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    logging.getLogger("openbanking.service").disabled = True  # The service logs every call at INFO level
+
+    try:
+        per_call = OpenBankingService()
+        per_call.base_url = f"http://127.0.0.1:{port}/api/v2"
+        per_call.token = "bench"
+        await run_calls(per_call, 10)  # warm up
+        report("new client per call", await run_calls(per_call, calls))
+
+        async with create_http_client() as client:
+            pooled = OpenBankingService(client=client)
+            pooled.base_url = f"http://127.0.0.1:{port}/api/v2"
+            pooled.token = "bench"
+            await run_calls(pooled, 10)  # warm up
+            report("shared pooled client", await run_calls(pooled, calls))
+    finally:
+        server.should_exit = True
+        await server_task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=500, help="Number of sequential calls per mode")
+    args = parser.parse_args()
+    asyncio.run(main(args.calls))
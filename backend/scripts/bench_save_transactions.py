@@ -0,0 +1,109 @@
+"""
+Benchmark save_transactions against the database in DATABASE_URL.
+
+For each size a throwaway user, requisition and account is created and a synthetic GoCardless payload is saved three times:
+    insert     - every transaction is new
+    unchanged  - the same payload again, nothing is written
+    update     - 10% of the transactions changed amount
+The throwaway rows are deleted afterwards.
+
+Usage:
+    python scripts/bench_save_transactions.py --sizes 10000 100000 --chunk-size 1000
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import asyncio
+import logging
+import random
+import time
+from datetime import date, timedelta
+from uuid import uuid4
+
+from sqlalchemy import delete
+
+from app.db.database import AsyncSessionLocal, engine
+from app.db.models import User, BankRequisition, Account, Transaction
+from app.services.save_transactions import save_transactions
+
+
+def synthetic_payload(size: int, seed: int = 42) -> dict:
+    rng = random.Random(seed)
+    today = date.today()
+    booked = []
+    for i in range(size):
+        booking_date = today - timedelta(days=rng.randint(0, 730))
+        booked.append({
+            "transactionId": f"bench-{seed}-{i}",
+            "bookingDate": booking_date.isoformat(),
+            "valueDate": booking_date.isoformat(),
+            "transactionAmount": {"amount": f"{rng.uniform(-2500, 1500):.2f}", "currency": "DKK"},
+            "creditorName": rng.choice(["Netto", "Føtex", "DSB", "Spotify", "Landlord ApS"]),
+            "remittanceInformationUnstructured": f"Purchase {i}",
+            "proprietaryBankTransactionCode": rng.choice(["Dankort", "Overførsel", "Betalingsservice"]),
+        })
+    return {"transactions": {"booked": booked, "pending": []}}
+
+
+async def create_fixture() -> tuple:
+    async with AsyncSessionLocal() as db:
+        user = User(email=f"bench-{uuid4()}@example.com", name="Benchmark")
+        db.add(user)
+        await db.flush()
+        requisition = BankRequisition(
+            requisition_id=str(uuid4()), institution_id="BENCH", link="http://localhost", user_id=user.id
+        )
+        db.add(requisition)
+        await db.flush()
+        account = Account(
+            requisition_id=requisition.id, account_id=str(uuid4()), account_number=str(uuid4()),
+            name="Benchmark account", currency="DKK", balance=0
+        )
+        db.add(account)
+        await db.commit()
+        return user.id, requisition.id, account.id
+
+
+async def drop_fixture(user_id: int, requisition_id: str, account_id: str):
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Transaction).where(Transaction.account_id == account_id))
+        await db.execute(delete(Account).where(Account.id == account_id))
+        await db.execute(delete(BankRequisition).where(BankRequisition.id == requisition_id))
+        await db.execute(delete(User).where(User.id == user_id))
+        await db.commit()
+
+
+async def timed_save(label: str, payload: dict, account_id: str, chunk_size: int):
+    size = len(payload["transactions"]["booked"])
+    async with AsyncSessionLocal() as db:
+        start = time.perf_counter()
+        counts = await save_transactions(payload, account_id, db, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+    print(f"  {label:<10} {elapsed:8.2f} s  {size / elapsed:10.0f} tx/s  {counts}")
+
+
+async def main(sizes: list, chunk_size: int):
+    logging.getLogger("app.services.save_transactions").setLevel(logging.WARNING)
+    for size in sizes:
+        print(f"{size} transactions, chunk size {chunk_size}")
+        payload = synthetic_payload(size)
+        fixture = await create_fixture()
+        try:
+            await timed_save("insert", payload, fixture[2], chunk_size)
+            await timed_save("unchanged", payload, fixture[2], chunk_size)
+            for tx in payload["transactions"]["booked"][::10]:
+                tx["transactionAmount"]["amount"] = f"{float(tx['transactionAmount']['amount']) - 1:.2f}"
+            await timed_save("update", payload, fixture[2], chunk_size)
+        finally:
+            await drop_fixture(*fixture)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000], help="Payload sizes to benchmark")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per INSERT ... ON CONFLICT statement")
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.chunk_size))
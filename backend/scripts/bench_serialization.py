@@ -0,0 +1,110 @@
+"""
+Compare the ORM listing path with the column listing path used by /transactions, against the database in DATABASE_URL.
+
+    orm      select(Transaction) + selectinload(Transaction.account), as_dict(), jsonable_encoder + json.dumps
+    columns  transaction_listing() row mappings, dump_json (orjson when installed)
+
+A throwaway user, requisition and account with --transactions synthetic transactions is created and removed afterwards.
+Both paths must produce the same JSON, the script stops if they don't.
+
+Usage:
+    python scripts/bench_serialization.py --page-sizes 50 200 500 1000 --repeat 20
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.future import select
+from sqlalchemy import text
+from sqlalchemy.orm import selectinload
+
+from app.api.responses import dump_json, orjson
+from app.db.database import AsyncSessionLocal, engine
+from app.db.models import Transaction
+from app.services.pagination import TRANSACTION_ORDER, transaction_listing, listing_dicts
+from app.services.save_transactions import save_transactions
+from scripts.bench_save_transactions import synthetic_payload, create_fixture, drop_fixture
+
+
+async def orm_path(account_id: str, page_size: int) -> tuple:
+    async with AsyncSessionLocal() as db:
+        start = time.perf_counter()
+        result = await db.execute(
+            select(Transaction)
+            .options(selectinload(Transaction.account))
+            .where(Transaction.account_id == account_id)
+            .order_by(*TRANSACTION_ORDER)
+            .limit(page_size)
+        )
+        transactions = [tx.as_dict() for tx in result.scalars().all()]
+        loaded = time.perf_counter()
+        body = json.dumps(
+            jsonable_encoder({"transactions": transactions}),
+            ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+        return loaded - start, time.perf_counter() - loaded, body
+
+
+async def column_path(account_id: str, page_size: int) -> tuple:
+    async with AsyncSessionLocal() as db:
+        start = time.perf_counter()
+        result = await db.execute(
+            transaction_listing()
+            .where(Transaction.account_id == account_id)
+            .order_by(*TRANSACTION_ORDER)
+            .limit(page_size)
+        )
+        transactions = listing_dicts(result)
+        loaded = time.perf_counter()
+        body = dump_json({"transactions": transactions})
+        return loaded - start, time.perf_counter() - loaded, body
+
+
+async def measure(path, account_id: str, page_size: int, repeat: int) -> tuple:
+    await path(account_id, page_size)  # Warm up the connection and the statement cache
+    runs = [await path(account_id, page_size) for _ in range(repeat)]
+    load = statistics.median(run[0] for run in runs) * 1000
+    dump = statistics.median(run[1] for run in runs) * 1000
+    return load, dump, runs[-1][2]
+
+
+async def main(transactions: int, page_sizes: list, repeat: int):
+    logging.getLogger("app.services.save_transactions").setLevel(logging.WARNING)
+    print(f"JSON encoder: {'orjson ' + orjson.__version__ if orjson else 'json (orjson not installed)'}")
+    fixture = await create_fixture()
+    try:
+        async with AsyncSessionLocal() as db:
+            await save_transactions(synthetic_payload(transactions), fixture[2], db)
+            # Fresh statistics, as autovacuum would have them, so the planner sees the real table size
+            await db.execute(text("ANALYZE transactions"))
+            await db.execute(text("ANALYZE accounts"))
+            await db.commit()
+        print(f"{'page size':>9}  {'path':<8} {'load ms':>8} {'dump ms':>8} {'total ms':>9}")
+        for page_size in page_sizes:
+            orm = await measure(orm_path, fixture[2], page_size, repeat)
+            columns = await measure(column_path, fixture[2], page_size, repeat)
+            if json.loads(orm[2]) != json.loads(columns[2]):
+                raise SystemExit(f"Output differs at page size {page_size}")
+            for name, (load, dump, _) in (("orm", orm), ("columns", columns)):
+                print(f"{page_size:>9}  {name:<8} {load:8.2f} {dump:8.2f} {load + dump:9.2f}")
+            print(f"{'':>9}  speedup  {(orm[0] + orm[1]) / (columns[0] + columns[1]):.1f}x")
+    finally:
+        await drop_fixture(*fixture)
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transactions", type=int, default=5000, help="Transactions on the benchmark account")
+    parser.add_argument("--page-sizes", type=int, nargs="+", default=[50, 200, 500, 1000], help="Page sizes to compare")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per page size, the median is reported")
+    args = parser.parse_args()
+    asyncio.run(main(args.transactions, args.page_sizes, args.repeat))
@@ -0,0 +1,183 @@
+"""
+Benchmark syncing accounts against the mock GoCardless API in scripts/mock_gocardless.py.
+
+Creates a throwaway user with --accounts accounts and runs the scheduler's sync job (balance, then transactions
+since the watermark) for all of them with --concurrency jobs at once, through one OpenBankingService setup like the
+app's: the pooled HTTP client, TokenManager and RateLimiter. The first round fetches the full history, later
+rounds are incremental syncs. Per round the wall time, job latency percentiles, failures, upstream retries and the
+mock's responses per status are printed. The throwaway rows are deleted afterwards.
+
+The mock runs in this process unless --mock-url points at one started separately. Retries and backoff follow
+OPENBANKING_MAX_RETRIES, OPENBANKING_BACKOFF_BASE and OPENBANKING_BACKOFF_MAX as in the app.
+
+Usage:
+    python scripts/bench_sync.py --accounts 200 --concurrency 20 --latency 0.2 --rate-limit-rate 0.05
+    python scripts/bench_sync.py --mock-url http://127.0.0.1:8001/api/v2 --accounts 50
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import asyncio
+import logging
+import socket
+import time
+from collections import Counter
+from uuid import uuid4
+
+import uvicorn
+from sqlalchemy import delete, func, select
+
+from app.db.database import AsyncSessionLocal, engine
+from app.db.models import User, BankRequisition, Account, Transaction, SyncJob
+from app.services.openbanking import OpenBankingService, UPSTREAM_RETRIES, create_http_client
+from app.services.rate_limit import RateLimiter
+from app.services.sync_scheduler import run_job
+from app.services.token_manager import TokenManager
+from mock_gocardless import MockConfig, MockGoCardless
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))] if values else 0.0
+
+
+async def create_accounts(count: int) -> tuple:
+    async with AsyncSessionLocal() as db:
+        user = User(email=f"bench-sync-{uuid4()}@example.com", name="Sync benchmark")
+        requisition = BankRequisition(
+            requisition_id=str(uuid4()), institution_id="MOCK_BANK", link="http://localhost", status="LN", user=user
+        )
+        accounts = [
+            Account(
+                account_id=str(uuid4()), account_number=f"bench-sync-{uuid4()}", name=f"Sync benchmark {i}",
+                currency="DKK", balance=0, requisition=requisition,
+            )
+            for i in range(count)
+        ]
+        db.add(user)
+        await db.commit()
+        return user.id, requisition.id, [account.id for account in accounts]
+
+
+async def drop_accounts(user_id: int, requisition_id: str, account_ids: list):
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Transaction).where(Transaction.account_id.in_(account_ids)))
+        await db.execute(delete(Account).where(Account.id.in_(account_ids)))
+        await db.execute(delete(BankRequisition).where(BankRequisition.id == requisition_id))
+        await db.execute(delete(User).where(User.id == user_id))
+        await db.commit()
+
+
+async def saved_transactions(account_ids: list) -> int:
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count()).where(Transaction.account_id.in_(account_ids)))
+
+
+def retries() -> int:
+    return sum(UPSTREAM_RETRIES.values().values())
+
+
+async def sync_round(service: OpenBankingService, account_ids: list, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = Counter()
+
+    async def sync(account_id: str):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await run_job(SyncJob(account_id=account_id), service)
+            except Exception as e:
+                failures[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - start)
+
+    retries_before = retries()
+    start = time.perf_counter()
+    await asyncio.gather(*(sync(account_id) for account_id in account_ids))
+    return {
+        "elapsed": time.perf_counter() - start,
+        "latencies": latencies,
+        "failures": failures,
+        "retries": retries() - retries_before,
+    }
+
+
+def report(label: str, result: dict, accounts: int, mock: MockGoCardless = None):
+    latencies = result["latencies"]
+    failures = ", ".join(f"{name} {count}" for name, count in result["failures"].items()) or "none"
+    print(
+        f"{label:<14} {result['elapsed']:7.2f}s   {accounts / result['elapsed']:7.1f} accounts/s   "
+        f"p50 {percentile(latencies, 0.5) * 1000:7.0f} ms   p95 {percentile(latencies, 0.95) * 1000:7.0f} ms   "
+        f"p99 {percentile(latencies, 0.99) * 1000:7.0f} ms   retries {result['retries']}   failed: {failures}   "
+        f"{result['saved']:,} transactions saved"
+    )
+    if mock is not None:
+        statuses = Counter()
+        for (endpoint, status), count in mock.calls.items():
+            statuses[status] += count
+        print(f"{'':<14} upstream responses: {', '.join(f'{status} x{count}' for status, count in sorted(statuses.items()))}")
+        mock.calls.clear()
+
+
+async def main(args):
+    logging.getLogger("openbanking").setLevel(logging.ERROR)  # The service logs every call
+    logging.getLogger("app.services").setLevel(logging.ERROR)
+
+    mock = server = server_task = None
+    base_url = args.mock_url
+    if base_url is None:
+        mock = MockGoCardless(MockConfig(
+            latency=args.latency, jitter=args.jitter, years=args.years, error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+            account_daily_calls=args.account_daily_calls,
+        ))
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(mock.app, host="127.0.0.1", port=port, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+        base_url = f"http://127.0.0.1:{port}/api/v2"
+
+    user_id, requisition_id, account_ids = await create_accounts(args.accounts)
+    try:
+        async with create_http_client() as client:
+            token_manager = TokenManager(secret_id="bench", secret_key="bench", client=client, base_url=base_url)
+            service = OpenBankingService(
+                secret_id="bench", secret_name="bench", secret_key="bench", client=client,
+                token_manager=token_manager, rate_limiter=RateLimiter(), base_url=base_url,
+            )
+            for round_number in range(args.rounds):
+                result = await sync_round(service, account_ids, args.concurrency)
+                result["saved"] = await saved_transactions(account_ids)
+                report("full sync" if round_number == 0 else f"incremental {round_number}", result, args.accounts, mock)
+    finally:
+        await drop_accounts(user_id, requisition_id, account_ids)
+        if server is not None:
+            server.should_exit = True
+            await server_task
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--accounts", type=int, default=100, help="Accounts to sync per round")
+    parser.add_argument("--concurrency", type=int, default=10, help="Sync jobs running at once")
+    parser.add_argument("--rounds", type=int, default=2, help="Sync rounds, the first fetches the full history")
+    parser.add_argument("--mock-url", help="Base URL of a running mock, fx http://127.0.0.1:8001/api/v2")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the in-process mock adds per response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Up to this many seconds more, at random")
+    parser.add_argument("--years", type=float, default=2, help="Years of transaction history per account")
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of data calls answered with a 5xx")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Share of data calls answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After of injected 429s, in seconds")
+    parser.add_argument("--account-daily-calls", type=int, default=4,
+                        help="Successful calls per account and endpoint the mock allows per day, 0 for no quota")
+    asyncio.run(main(parser.parse_args()))
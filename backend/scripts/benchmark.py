@@ -0,0 +1,313 @@
+"""
+End-to-end benchmark of the read endpoints and of transaction ingestion, against the database in DATABASE_URL.
+
+Requests are sent as the users created by scripts/generate_data.py, with tokens signed with JWT_SECRET.
+By default the app runs in this process behind an in-memory transport, so no server is needed; with --base-url
+the requests go to a running server instead, which must use the same database and JWT_SECRET.
+Each scenario runs on its own after a warm-up, with --concurrency requests in flight:
+    transactions     - /transactions for all accounts, a random page of 50
+    revenue_chart    - /revenue_chart_data with a random interval
+    account_summary  - /accounts/{id}/summary of a random account
+    top_transactions - /top_transactions of a random account and period
+    ingestion        - save_transactions of a generated account history into a new account, then the same
+                       payload again as a re-sync. Always in this process, timed per call.
+p50, p95, p99, mean and max latency and throughput per scenario are printed and written to --output as JSON,
+together with the commit, settings and data size, so runs can be compared with --compare.
+
+Usage:
+    python scripts/generate_data.py --users 1000 --accounts 3 --years 3
+    python scripts/benchmark.py --requests 2000 --concurrency 20 --no-cache
+    python scripts/benchmark.py --compare benchmark-before.json --max-regression 0.2
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+
+SCENARIOS = ["transactions", "revenue_chart", "account_summary", "top_transactions", "ingestion"]
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Nearest-rank percentile of values sorted ascending
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def summarize(latencies: list, errors: int, elapsed: float, **extra) -> dict:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        **extra,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def load_users(limit: int) -> list:
+    """
+    (user id, account ids) of generated users with accounts
+    """
+    from sqlalchemy import select
+    from app.db.database import AsyncSessionLocal
+    from app.db.models import User, BankRequisition, Account
+    from generate_data import GENERATED_DOMAIN
+
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(User.id, Account.id)
+            .join(BankRequisition, BankRequisition.user_id == User.id)
+            .join(Account, Account.requisition_id == BankRequisition.id)
+            .where(User.email.like(f"%@{GENERATED_DOMAIN}"))
+            .order_by(User.id, Account.id)
+        )
+        users = {}
+        for user_id, account_id in result.all():
+            if user_id in users or len(users) < limit:
+                users.setdefault(user_id, []).append(account_id)
+    return list(users.items())
+
+
+async def data_size(user_ids: list) -> dict:
+    from sqlalchemy import func, select
+    from app.db.database import AsyncSessionLocal
+    from app.db.models import BankRequisition, Account, Transaction
+
+    async with AsyncSessionLocal() as db:
+        accounts = select(Account.id).join(BankRequisition).where(BankRequisition.user_id.in_(user_ids))
+        transactions = await db.scalar(select(func.count()).where(Transaction.account_id.in_(accounts.scalar_subquery())))
+        total = await db.scalar(select(func.count()).select_from(Transaction))
+    return {"users": len(user_ids), "transactions_of_users": transactions, "transactions_in_table": total}
+
+
+def request_for(scenario: str, user: tuple, rng: random.Random) -> tuple:
+    """
+    (path, query parameters) of a request of the scenario for the user
+    """
+    _, account_ids = user
+    if scenario == "transactions":
+        return "/transactions", {"account_id": "all", "page": rng.randint(1, 20), "page_size": 50}
+    if scenario == "revenue_chart":
+        return "/revenue_chart_data", {"interval": rng.choice(["daily", "weekly", "monthly", "yearly"])}
+    if scenario == "account_summary":
+        return f"/accounts/{rng.choice(account_ids)}/summary", {}
+    return "/top_transactions", {
+        "account_id": rng.choice(account_ids), "n": 3, "period": rng.choice(["week", "month", "quarter", "year", "all"])
+    }
+
+
+async def run_http(client, scenario: str, users: list, headers: dict, requests: int, concurrency: int,
+                   warmup: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    plan = []
+    for _ in range(warmup + requests):
+        user = rng.choice(users)
+        plan.append((user[0], *request_for(scenario, user, rng)))
+    latencies = []
+    errors = 0
+    position = 0
+
+    async def worker(stop: int, record: bool):
+        nonlocal position, errors
+        while position < stop:
+            user_id, path, params = plan[position]
+            position += 1
+            start = time.perf_counter()
+            try:
+                response = await client.get(path, params=params, headers=headers[user_id])
+                ok = response.status_code == 200
+            except Exception as e:
+                logging.getLogger(__name__).warning("%s %s failed: %s", path, params, e)
+                ok = False
+            if record:
+                latencies.append(time.perf_counter() - start)
+                errors += not ok
+
+    await asyncio.gather(*(worker(warmup, False) for _ in range(concurrency)))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(warmup + requests, True) for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def run_ingestion(runs: int, years: float, seed: int) -> dict:
+    """
+    Insert and re-sync of a generated salary account history per run, each into a new throwaway account
+    """
+    from app.db.database import AsyncSessionLocal
+    from app.services.save_transactions import save_transactions
+    from bench_save_transactions import create_fixture, drop_fixture
+    from generate_data import account_history
+
+    rng = random.Random(seed)
+    latencies = {"insert": [], "resync": []}
+    rows = 0
+    errors = 0
+    start = time.perf_counter()
+    for run in range(runs):
+        fixture = await create_fixture()
+        try:
+            payload = account_history("salary", f"bench-{seed}-{run}-{fixture[2]}", years, 1, rng).payload()
+            size = len(payload["transactions"]["booked"]) + len(payload["transactions"]["pending"])
+            for phase in ("insert", "resync"):
+                phase_start = time.perf_counter()
+                async with AsyncSessionLocal() as db:
+                    await save_transactions(payload, fixture[2], db)
+                latencies[phase].append(time.perf_counter() - phase_start)
+                rows += size
+        except Exception as e:
+            logging.getLogger(__name__).warning("Ingestion run %d failed: %s", run, e)
+            errors += 1
+        finally:
+            await drop_fixture(*fixture)
+    elapsed = time.perf_counter() - start
+    result = summarize(latencies["insert"] + latencies["resync"], errors, elapsed, rows_per_second=round(rows / elapsed))
+    for phase, values in latencies.items():
+        result[phase] = summarize(values, 0, sum(values))
+    return result
+
+
+def print_results(results: dict, previous: dict = None):
+    print(f"{'scenario':<18}{'requests':>9}{'errors':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}")
+    for name, stats in results["scenarios"].items():
+        line = (
+            f"{name:<18}{stats['requests']:>9}{stats['errors']:>7}{stats['p50_ms']:>10.1f}"
+            f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['throughput_rps']:>9.1f}"
+        )
+        old = (previous or {}).get("scenarios", {}).get(name)
+        if old and old["p95_ms"]:
+            line += f"   p95 {(stats['p95_ms'] / old['p95_ms'] - 1) * 100:+.0f}% vs {previous.get('git_commit')}"
+        print(line)
+
+
+def regressions(results: dict, previous: dict, max_regression: float) -> list:
+    """
+    Scenarios whose p95 grew by more than max_regression, as a fraction, since the previous run
+    """
+    slower = []
+    for name, stats in results["scenarios"].items():
+        old = previous.get("scenarios", {}).get(name)
+        if old and old["p95_ms"] and stats["p95_ms"] > old["p95_ms"] * (1 + max_regression):
+            slower.append(name)
+    return slower
+
+
+async def main(args) -> int:
+    if args.no_cache:
+        # Read when the app is imported below, so every request reaches the database
+        os.environ["RESPONSE_CACHE_MAX_BYTES"] = "0"
+        os.environ["COLUMNAR_CACHE_MAX_BYTES"] = "0"
+    os.environ["SYNC_SCHEDULER_ENABLED"] = "false"
+    logging.getLogger("app.services.save_transactions").setLevel(logging.ERROR)
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # A line per request otherwise
+
+    import httpx
+    from jose import jwt
+    from app.core.config import settings
+    from app.db.database import engine
+
+    users = await load_users(args.users)
+    if not users:
+        print("No generated users found, run scripts/generate_data.py first")
+        return 1
+    headers = {
+        user_id: {"Authorization": f"Bearer {jwt.encode({'user_id': user_id}, settings.jwt_secret, algorithm='HS256')}"}
+        for user_id, _ in users
+    }
+    results = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "target": args.base_url or "in-process",
+        "settings": {
+            "requests": args.requests, "concurrency": args.concurrency, "warmup": args.warmup, "seed": args.seed,
+            "response_cache": not args.no_cache, "db_pool_size": settings.db_pool_size,
+            "db_max_overflow": settings.db_max_overflow, "replica": settings.replica_database_url is not None,
+        },
+        "data": await data_size([user_id for user_id, _ in users]),
+        "scenarios": {},
+    }
+    http_scenarios = [scenario for scenario in args.scenarios if scenario != "ingestion"]
+    try:
+        if http_scenarios:
+            if args.base_url:
+                client = httpx.AsyncClient(base_url=args.base_url, timeout=60)
+                lifespan = None
+            else:
+                from app.main import app
+                client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=60)
+                lifespan = app.router.lifespan_context(app)
+            async with client:
+                if lifespan is not None:
+                    await lifespan.__aenter__()
+                try:
+                    for scenario in http_scenarios:
+                        results["scenarios"][scenario] = await run_http(
+                            client, scenario, users, headers, args.requests, args.concurrency, args.warmup, args.seed
+                        )
+                finally:
+                    if lifespan is not None:
+                        await lifespan.__aexit__(None, None, None)
+        if "ingestion" in args.scenarios:
+            results["scenarios"]["ingestion"] = await run_ingestion(args.ingest_runs, args.ingest_years, args.seed)
+    finally:
+        await engine.dispose()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+    output = args.output or f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{results['git_commit']}.json"
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+    if previous is not None and args.max_regression is not None:
+        slower = regressions(results, previous, args.max_regression)
+        if slower:
+            print(f"p95 regressed by more than {args.max_regression:.0%}: {', '.join(slower)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS, help="Scenarios to run")
+    parser.add_argument("--requests", type=int, default=1000, help="Timed requests per HTTP scenario")
+    parser.add_argument("--concurrency", type=int, default=10, help="Requests in flight at once")
+    parser.add_argument("--warmup", type=int, default=50, help="Untimed requests per HTTP scenario before timing")
+    parser.add_argument("--users", type=int, default=1000, help="Generated users to send requests as")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed for the requests and ingested histories")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Disable the response and columnar caches of the in-process app")
+    parser.add_argument("--base-url", help="URL of a running server to benchmark instead of the in-process app")
+    parser.add_argument("--ingest-runs", type=int, default=10, help="Accounts saved by the ingestion scenario")
+    parser.add_argument("--ingest-years", type=float, default=3, help="Years of history per ingested account")
+    parser.add_argument("--output", help="JSON file for the results, default benchmark-<time>-<commit>.json")
+    parser.add_argument("--compare", help="Results of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float,
+                        help="With --compare, exit with status 1 if a p95 grew by more than this fraction, fx 0.2")
+    sys.exit(asyncio.run(main(parser.parse_args())))
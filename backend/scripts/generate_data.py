@@ -0,0 +1,266 @@
+"""
+Generate synthetic users, bank accounts and years of transactions in the database in DATABASE_URL, for load tests
+and benchmarks (see scripts/benchmark.py).
+
+Every user gets a salary account, and with more accounts per user a savings account and a credit card.
+Transactions follow a household's month: salary and rent, subscriptions and utility bills on fixed days,
+groceries, transport, restaurants and shopping at random with log-normal amounts, transfers to savings,
+card bill payments and a few pending card payments in the last days.
+Rows are written like synced GoCardless transactions, with COPY, and transaction counts and daily rollups are
+filled in for the generated accounts, so every endpoint works on the data as if it had been synced.
+
+Generated users have e-mail addresses at @loadtest.invalid and can be removed again with --drop.
+At --scale 1 a user with the three kinds of accounts gets about 500 transactions a year, so 2000 users
+over 3 years is around 3 million transactions.
+
+Usage:
+    python scripts/generate_data.py --users 1000 --accounts 3 --years 3
+    python scripts/generate_data.py --drop
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import asyncio
+import calendar
+import logging
+import random
+import time
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy import delete, select, text
+
+from app.db.database import AsyncSessionLocal, engine
+from app.db.models import User, BankRequisition, Account, Transaction
+from app.services.save_transactions import normalize_transaction
+
+GENERATED_DOMAIN = "loadtest.invalid"
+COPY_COLUMNS = [column.name for column in Transaction.__table__.columns]
+
+# Discretionary spending: creditors, bank transaction code, visits per month, and mu and sigma of the log-normal amount
+SPENDING = {
+    "groceries": (["Netto", "Føtex", "Rema 1000", "Lidl", "Irma", "Coop 365", "Meny"], "Dankort", 11, 5.2, 0.7),
+    "transport": (["DSB", "Rejsekort", "Circle K", "Q8", "Movia"], "Dankort", 6, 4.3, 0.8),
+    "restaurants": (["Joe & The Juice", "Sticks'n'Sushi", "Mash", "Espresso House", "Wolt"], "Dankort", 4, 5.3, 0.6),
+    "shopping": (["Magasin", "Elgiganten", "H&M", "Zalando", "IKEA", "Power"], "Visa", 2, 6.0, 0.9),
+}
+# Fixed monthly payments: creditor, bank transaction code, day of the month and amount
+BILLS = [
+    ("Boligselskabet ApS", "Betalingsservice", 1, 8200),
+    ("Ørsted", "Betalingsservice", 5, 640),
+    ("Telia", "Betalingsservice", 8, 199),
+    ("Spotify", "Betalingsservice", 12, 119),
+    ("Netflix", "Betalingsservice", 14, 149),
+    ("Tryg Forsikring", "Betalingsservice", 20, 780),
+]
+EMPLOYERS = ["Novo Nordisk A/S", "Maersk A/S", "Region Hovedstaden", "Københavns Kommune", "Danske Bank A/S", "Netcompany"]
+ACCOUNT_KINDS = ["salary", "savings", "credit"]
+ACCOUNT_NAMES = {"salary": "Lønkonto", "savings": "Opsparing", "credit": "Kreditkort"}
+
+
+class History:
+    """
+    GoCardless transactions of one account, built day by day
+    """
+
+    def __init__(self, account_key: str, rng: random.Random, today: date):
+        self.account_key = account_key
+        self.rng = rng
+        self.today = today
+        self.booked = []
+        self.pending = []
+
+    def add(self, day: date, amount: float, name: str, code: str, text: str, income: bool = False):
+        tx = {
+            "transactionId": f"gen-{self.account_key}-{len(self.booked) + len(self.pending)}",
+            "bookingDate": day.isoformat(),
+            "valueDate": day.isoformat(),
+            "transactionAmount": {"amount": f"{amount:.2f}", "currency": "DKK"},
+            "remittanceInformationUnstructured": text,
+            "proprietaryBankTransactionCode": code,
+        }
+        tx["debtorName" if income else "creditorName"] = name
+        # Card payments of the last days haven't settled yet
+        if code in ("Dankort", "Visa") and (self.today - day).days < 3 and self.rng.random() < 0.6:
+            self.pending.append(tx)
+        else:
+            self.booked.append(tx)
+
+    def spend(self, day: date, categories: dict, scale: float):
+        for creditors, code, per_month, mu, sigma in categories.values():
+            if self.rng.random() < per_month * scale / 30:
+                name = self.rng.choice(creditors)
+                self.add(day, -round(self.rng.lognormvariate(mu, sigma), 2), name, code, f"{name} {self.rng.randint(1000, 9999)}")
+
+    def payload(self) -> dict:
+        return {"transactions": {"booked": self.booked, "pending": self.pending}}
+
+
+def account_history(kind: str, account_key: str, years: float, scale: float, rng: random.Random) -> History:
+    """
+    Transactions of an account of the given kind over the last years, oldest first, as a GoCardless payload
+    """
+    today = date.today()
+    history = History(account_key, rng, today)
+    salary = round(rng.uniform(22000, 42000), -2)
+    employer = rng.choice(EMPLOYERS)
+    day = today - timedelta(days=int(years * 365))
+    while day <= today:
+        last_day = calendar.monthrange(day.year, day.month)[1]
+        if kind == "salary":
+            if day.day == last_day:
+                history.add(day, salary * rng.uniform(0.98, 1.05), employer, "Lønoverførsel", "Løn", income=True)
+                history.add(day, -rng.choice([1000, 2000, 3000]), "Opsparing", "Overførsel", "Til opsparing")
+            for name, code, bill_day, amount in BILLS:
+                if day.day == bill_day:
+                    history.add(day, -amount * rng.uniform(0.95, 1.1), name, code, name)
+            history.spend(day, SPENDING, scale)
+        elif kind == "savings":
+            if day.day == last_day:
+                history.add(day, rng.choice([1000, 2000, 3000]), "Lønkonto", "Overførsel", "Fra lønkonto", income=True)
+            if day.month == 12 and day.day == 31:
+                history.add(day, rng.uniform(50, 900), "Banken", "Rente", "Årsrente", income=True)
+            if rng.random() < 0.01 * scale:
+                history.add(day, -round(rng.uniform(2000, 20000), -2), "Lønkonto", "Overførsel", "Til lønkonto")
+        else:
+            if day.day == 15:
+                history.add(day, rng.uniform(3000, 12000), "Lønkonto", "Overførsel", "Betaling af kortregning", income=True)
+            history.spend(day, {key: SPENDING[key] for key in ("restaurants", "shopping")}, scale * 1.5)
+        day += timedelta(days=1)
+    return history
+
+
+def account_records(history: History, account_id: str, created_at: datetime):
+    """
+    Rows for the transactions table in COPY_COLUMNS order, normalized the same way synced transactions are
+    """
+    for tx_type in ("booked", "pending"):
+        for tx in getattr(history, tx_type):
+            row = normalize_transaction(tx, tx_type, account_id, created_at)
+            yield tuple(row[column] for column in COPY_COLUMNS)
+
+
+async def create_users(db, run: str, first: int, count: int, accounts_per_user: int, rng: random.Random) -> list:
+    """
+    Users with a requisition and their accounts, returns (account id, kind) of every account
+    """
+    accounts = []
+    for i in range(first, first + count):
+        user = User(email=f"user-{run}-{i}@{GENERATED_DOMAIN}", name=f"Load test user {i}")
+        requisition = BankRequisition(
+            requisition_id=str(uuid4()), institution_id="LOADTEST", link="http://localhost", status="LN", user=user
+        )
+        for n in range(accounts_per_user):
+            kind = ACCOUNT_KINDS[n % len(ACCOUNT_KINDS)]
+            account = Account(
+                account_id=str(uuid4()), account_number=str(uuid4()), name=ACCOUNT_NAMES[kind],
+                iban=f"DK50{rng.randrange(10 ** 14):014d}", currency="DKK", balance=0, requisition=requisition
+            )
+            accounts.append((account, kind))
+        db.add(user)
+    await db.flush()
+    return [(account.id, kind) for account, kind in accounts]
+
+
+async def fill_aggregates(db, account_ids: list):
+    """
+    Transaction counts, daily rollups and balances of the accounts, from their transactions
+    """
+    params = {"account_ids": account_ids}
+    await db.execute(text(
+        "INSERT INTO account_transaction_counts (account_id, status, count) "
+        "SELECT account_id, COALESCE(status, 'unknown'), count(*) FROM transactions "
+        "WHERE account_id = ANY(:account_ids) GROUP BY account_id, COALESCE(status, 'unknown')"
+    ), params)
+    await db.execute(text(
+        "INSERT INTO daily_account_rollups (account_id, day, currency, income, expenses, tx_count) "
+        "SELECT account_id, booking_date::date, currency, "
+        "COALESCE(SUM(amount) FILTER (WHERE amount > 0), 0), "
+        "COALESCE(SUM(amount) FILTER (WHERE amount < 0), 0), "
+        "count(*) "
+        "FROM transactions WHERE account_id = ANY(:account_ids) GROUP BY account_id, booking_date::date, currency"
+    ), params)
+    await db.execute(text(
+        "UPDATE accounts SET balance = totals.balance, last_synced_at = now(), last_booked_date = totals.last_booked "
+        "FROM (SELECT account_id, SUM(amount) AS balance, MAX(booking_date) AS last_booked FROM transactions "
+        "WHERE account_id = ANY(:account_ids) AND status = 'booked' GROUP BY account_id) AS totals "
+        "WHERE accounts.id = totals.account_id"
+    ), params)
+
+
+async def generate(users: int, accounts_per_user: int, years: float, scale: float, seed: int, batch_users: int):
+    rng = random.Random(seed)
+    run = uuid4().hex[:8]
+    created_at = datetime.utcnow()
+    total = 0
+    start = time.perf_counter()
+    for first in range(0, users, batch_users):
+        count = min(batch_users, users - first)
+        async with AsyncSessionLocal() as db:
+            accounts = await create_users(db, run, first, count, accounts_per_user, rng)
+
+            def records():
+                for account_id, kind in accounts:
+                    history = account_history(kind, account_id, years, scale, rng)
+                    yield from account_records(history, account_id, created_at)
+
+            connection = await db.connection()
+            raw = await connection.get_raw_connection()
+            result = await raw.driver_connection.copy_records_to_table(
+                Transaction.__tablename__, records=records(), columns=COPY_COLUMNS
+            )
+            await fill_aggregates(db, [account_id for account_id, _ in accounts])
+            await db.commit()
+        total += int(result.split()[-1])
+        elapsed = time.perf_counter() - start
+        print(f"{first + count}/{users} users, {total:,} transactions, {total / elapsed:,.0f} transactions/s")
+    async with engine.connect() as connection:
+        # Fresh statistics, so the planner sees the new table sizes right away
+        await connection.execute(text("ANALYZE transactions"))
+        await connection.execute(text("ANALYZE daily_account_rollups"))
+        await connection.commit()
+
+
+async def generated_users(db) -> list:
+    result = await db.execute(select(User.id).where(User.email.like(f"%@{GENERATED_DOMAIN}")).order_by(User.id))
+    return list(result.scalars())
+
+
+async def drop_generated():
+    async with AsyncSessionLocal() as db:
+        user_ids = await generated_users(db)
+        accounts = (
+            select(Account.id).join(BankRequisition).where(BankRequisition.user_id.in_(user_ids)).scalar_subquery()
+        )
+        result = await db.execute(delete(Transaction).where(Transaction.account_id.in_(accounts)))
+        # Counts, rollups and sync jobs go with their accounts (ON DELETE CASCADE)
+        await db.execute(delete(Account).where(Account.id.in_(accounts)))
+        await db.execute(delete(BankRequisition).where(BankRequisition.user_id.in_(user_ids)))
+        await db.execute(delete(User).where(User.id.in_(user_ids)))
+        await db.commit()
+    print(f"Removed {len(user_ids)} generated users and {result.rowcount:,} transactions")
+
+
+async def main(args):
+    logging.getLogger("app.services.save_transactions").setLevel(logging.ERROR)
+    try:
+        if args.drop:
+            await drop_generated()
+        else:
+            await generate(args.users, args.accounts, args.years, args.scale, args.seed, args.batch_users)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100, help="Users to create")
+    parser.add_argument("--accounts", type=int, default=3, help="Accounts per user: salary, savings, credit card, ...")
+    parser.add_argument("--years", type=float, default=3, help="Years of transaction history per account")
+    parser.add_argument("--scale", type=float, default=1, help="Multiplier for the number of card payments")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed, the same seed generates the same amounts")
+    parser.add_argument("--batch-users", type=int, default=50, help="Users written per database transaction")
+    parser.add_argument("--drop", action="store_true", help="Remove all generated users and their data instead")
+    asyncio.run(main(parser.parse_args()))
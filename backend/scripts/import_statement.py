@@ -0,0 +1,57 @@
+"""
+Import bank statement files into an account, against the database in DATABASE_URL.
+
+Supports CSV exports, ISO 20022 CAMT.053 XML statements and saved GoCardless transactions responses (JSON).
+The format is detected from the file name unless --format is given. Files can be imported again,
+transactions that are already stored are updated instead of duplicated.
+
+Usage:
+    python scripts/import_statement.py <account id> statements/2019.csv statements/2020.xml
+    python scripts/import_statement.py <account id> export.csv --format csv --encoding cp1252
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import asyncio
+import time
+
+from app.db.database import AsyncSessionLocal, engine
+from app.db.models import Account
+from app.services.statement_import import IMPORT_FORMATS, detect_format, import_statement
+
+
+async def main(account_id: str, paths: list, format: str, encoding: str):
+    try:
+        async with AsyncSessionLocal() as db:
+            account = await db.get(Account, account_id)
+            if account is None:
+                raise SystemExit(f"Account {account_id} not found")
+        for path in paths:
+            file_format = format or detect_format(path)
+            if file_format is None:
+                raise SystemExit(f"Can't tell the format of {path}, use --format")
+            options = {"encoding": encoding} if file_format == "csv" else {}
+            start = time.perf_counter()
+            with open(path, "rb") as file:
+                async with AsyncSessionLocal() as db:
+                    counts = await import_statement(file, file_format, account.id, account.currency, db, **options)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{path}: {counts['read']} lines, {counts['duplicates']} duplicates, {counts['created']} created, "
+                f"{counts['updated']} updated, {counts['unchanged']} unchanged "
+                f"in {elapsed:.1f}s ({counts['read'] / elapsed:,.0f} lines/s)"
+            )
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("account_id", help="ID of the account in the accounts table")
+    parser.add_argument("paths", nargs="+", help="Statement files to import, in order")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="Format of all files, detected from the file names by default")
+    parser.add_argument("--encoding", default="utf-8-sig", help="Text encoding of CSV files")
+    args = parser.parse_args()
+    asyncio.run(main(args.account_id, args.paths, args.format, args.encoding))
@@ -0,0 +1,352 @@
+"""
+Local stand-in for the GoCardless Bank Account Data API, for syncing and load testing without the real API.
+
+Serves the endpoints OpenBankingService and TokenManager use: token/new, token/refresh, institutions, requisitions,
+accounts, details, balances and transactions. Any secret is accepted, but data endpoints require a token issued here,
+so expiry, refresh and the 401 re-authentication path behave like upstream. Every account id is valid: its kind
+(salary, savings or credit card) and its transaction history, see scripts/generate_data.py, are derived from the id,
+so the same account returns the same transactions on every call. Transactions honour date_from and date_to like
+upstream, which returns the whole range in one response; the size of a response is set by --years and --scale.
+
+Upstream behaviour that can be configured:
+    --latency, --jitter      seconds added to every response, plus --latency-per-1000 per 1000 transactions
+    --error-rate             share of data calls answered with a 500, 502 or 503
+    --rate-limit-rate        share of data calls answered with a 429 and Retry-After
+    --account-daily-calls    successful calls per account and endpoint per --quota-reset seconds (details,
+                             balances and transactions), reported in the http_x_ratelimit_account_success_* headers
+                             and answered with a 429 once used up, 0 for no quota
+Calls per endpoint and status are returned by GET /mock/stats.
+
+Start it and point the app at it:
+    python scripts/mock_gocardless.py --port 8001 --latency 0.2 --rate-limit-rate 0.05
+    GOCARDLESS_BASE_URL=http://127.0.0.1:8001/api/v2 uvicorn app.main:app
+"""
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import argparse
+import asyncio
+import random
+import time
+import zlib
+from collections import Counter
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from urllib.parse import parse_qs
+from uuid import uuid4
+
+import uvicorn
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import JSONResponse
+
+from generate_data import ACCOUNT_KINDS, ACCOUNT_NAMES, account_history
+
+# Endpoints with a quota per account, as upstream
+ACCOUNT_ENDPOINTS = ("details", "balances", "transactions")
+
+
+class MockConfig:
+    """
+    Behaviour of the mock, see the module docstring for what each option does
+    """
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.02, latency_per_1000: float = 0.01,
+                 years: float = 2, scale: float = 1, institutions: int = 60, accounts_per_requisition: int = 2,
+                 error_rate: float = 0, rate_limit_rate: float = 0, retry_after: float = 1,
+                 account_daily_calls: int = 4, quota_reset: float = 24 * 3600,
+                 access_expires: int = 24 * 3600, refresh_expires: int = 30 * 24 * 3600, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_per_1000 = latency_per_1000
+        self.years = years
+        self.scale = scale
+        self.institutions = institutions
+        self.accounts_per_requisition = accounts_per_requisition
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.account_daily_calls = account_daily_calls
+        self.quota_reset = quota_reset
+        self.access_expires = access_expires
+        self.refresh_expires = refresh_expires
+        self.seed = seed
+
+
+class UpstreamError(Exception):
+    """
+    An error response shaped like the ones GoCardless sends
+    """
+
+    def __init__(self, status_code: int, summary: str, detail: str, headers: dict = None):
+        self.status_code = status_code
+        self.body = {"summary": summary, "detail": detail, "status_code": status_code}
+        self.headers = headers or {}
+
+
+async def form_data(request: Request) -> dict:
+    """
+    Fields of a form encoded body, without the python-multipart dependency FastAPI's Form needs
+    """
+    return {name: values[0] for name, values in parse_qs((await request.body()).decode()).items()}
+
+
+class MockGoCardless:
+    """
+    State of the mock: issued tokens, requisitions, quotas and call counts, and the FastAPI app serving them
+    """
+
+    def __init__(self, config: MockConfig = None):
+        self.config = config or MockConfig()
+        self.rng = random.Random(self.config.seed)
+        self.access_tokens = {}  # token -> monotonic expiry
+        self.refresh_tokens = {}
+        self.requisitions = {}
+        self.quotas = {}  # (account, endpoint) -> [successful calls, monotonic start of the window]
+        self.calls = Counter()  # (endpoint, status)
+        self.history = lru_cache(maxsize=256)(self._history)
+        self.app = self._create_app()
+
+    # Accounts
+
+    def account_kind(self, account_id: str) -> str:
+        return ACCOUNT_KINDS[zlib.crc32(account_id.encode()) % len(ACCOUNT_KINDS)]
+
+    def _history(self, account_id: str) -> dict:
+        rng = random.Random(zlib.crc32(account_id.encode()) ^ self.config.seed)
+        history = account_history(self.account_kind(account_id), account_id, self.config.years, self.config.scale, rng)
+        # Upstream lists the newest transactions first
+        return {"booked": history.booked[::-1], "pending": history.pending[::-1]}
+
+    def transactions(self, account_id: str, date_from: str = None, date_to: str = None) -> dict:
+        history = self.history(account_id)
+        if date_from or date_to:
+            # ISO dates compare as strings
+            def in_range(tx):
+                return (not date_from or tx["bookingDate"] >= date_from) and (not date_to or tx["bookingDate"] <= date_to)
+            history = {tx_type: [tx for tx in txs if in_range(tx)] for tx_type, txs in history.items()}
+        return history
+
+    def balance(self, account_id: str) -> str:
+        booked = self.history(account_id)["booked"]
+        return f"{sum(float(tx['transactionAmount']['amount']) for tx in booked):.2f}"
+
+    # Upstream behaviour
+
+    async def delay(self, rows: int = 0):
+        seconds = self.config.latency + self.rng.uniform(0, self.config.jitter) + rows / 1000 * self.config.latency_per_1000
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def authenticate(self, authorization: str):
+        token = (authorization or "").removeprefix("Bearer ").strip()
+        expires = self.access_tokens.get(token)
+        if expires is None or expires < time.monotonic():
+            raise UpstreamError(401, "Invalid token", "Token is invalid or expired")
+
+    def inject_failure(self):
+        """
+        Answer a share of the data calls with a 429 or a 5xx, as configured
+        """
+        draw = self.rng.random()
+        if draw < self.config.rate_limit_rate:
+            raise UpstreamError(
+                429, "Rate limit exceeded", "Too many requests, try again later",
+                {"Retry-After": str(self.config.retry_after)},
+            )
+        if draw < self.config.rate_limit_rate + self.config.error_rate:
+            status = self.rng.choice([500, 502, 503])
+            raise UpstreamError(status, "Service unavailable", "Upstream error injected by the mock")
+
+    def use_quota(self, account_id: str, endpoint: str) -> dict:
+        """
+        Count a successful call against the account's quota for the endpoint, returns the rate limit headers
+        """
+        limit = self.config.account_daily_calls
+        if not limit or endpoint not in ACCOUNT_ENDPOINTS:
+            return {}
+        now = time.monotonic()
+        quota = self.quotas.get((account_id, endpoint))
+        if quota is None or now - quota[1] >= self.config.quota_reset:
+            quota = self.quotas[(account_id, endpoint)] = [0, now]
+        reset = int(max(self.config.quota_reset - (now - quota[1]), 1))
+        if quota[0] >= limit:
+            raise UpstreamError(
+                429, "Rate limit exceeded",
+                f"The daily request limit of {limit} for this account and endpoint has been reached",
+                {
+                    "http_x_ratelimit_account_success_limit": str(limit),
+                    "http_x_ratelimit_account_success_remaining": "0",
+                    "http_x_ratelimit_account_success_reset": str(reset),
+                },
+            )
+        quota[0] += 1
+        return {
+            "http_x_ratelimit_account_success_limit": str(limit),
+            "http_x_ratelimit_account_success_remaining": str(limit - quota[0]),
+            "http_x_ratelimit_account_success_reset": str(reset),
+        }
+
+    async def data_call(self, endpoint: str, authorization: str, account_id: str = None, rows: int = 0) -> dict:
+        """
+        Latency, authentication, injected failures and quota of a call to a data endpoint, returns response headers
+        """
+        await self.delay(rows)
+        self.authenticate(authorization)
+        self.inject_failure()
+        return self.use_quota(account_id, endpoint) if account_id else {}
+
+    def issue_tokens(self, refresh: bool = True) -> dict:
+        now = time.monotonic()
+        access = uuid4().hex
+        self.access_tokens[access] = now + self.config.access_expires
+        tokens = {"access": access, "access_expires": self.config.access_expires}
+        if refresh:
+            refresh_token = uuid4().hex
+            self.refresh_tokens[refresh_token] = now + self.config.refresh_expires
+            tokens.update(refresh=refresh_token, refresh_expires=self.config.refresh_expires)
+        return tokens
+
+    def requisition(self, requisition_id: str) -> dict:
+        """
+        A requisition created here, or a linked one with derived accounts for ids created elsewhere
+        """
+        requisition = self.requisitions.get(requisition_id)
+        if requisition is None:
+            requisition = self.requisitions[requisition_id] = {
+                "id": requisition_id, "created": datetime.now(timezone.utc).isoformat(), "redirect": None,
+                "institution_id": "MOCK_BANK", "agreement": None, "reference": None, "link": None,
+            }
+        # Linked as soon as it's read, as if the user went through the bank's consent flow right away
+        requisition["status"] = "LN"
+        requisition["accounts"] = [f"{requisition_id}-{i}" for i in range(self.config.accounts_per_requisition)]
+        return requisition
+
+    # App
+
+    def _create_app(self) -> FastAPI:
+        app = FastAPI(title="Mock GoCardless")
+
+        @app.middleware("http")
+        async def count_calls(request: Request, call_next):
+            response = await call_next(request)
+            route = request.scope.get("route")
+            self.calls[(route.name if route is not None else "unmatched", response.status_code)] += 1
+            return response
+
+        @app.exception_handler(UpstreamError)
+        async def upstream_error(request: Request, e: UpstreamError):
+            return JSONResponse(e.body, status_code=e.status_code, headers=e.headers)
+
+        @app.post("/api/v2/token/new/", name="token")
+        async def token_new(request: Request):
+            await self.delay()
+            form = await form_data(request)
+            if not form.get("secret_id") or not form.get("secret_key"):
+                raise UpstreamError(400, "Invalid request", "secret_id and secret_key are required")
+            return self.issue_tokens()
+
+        @app.post("/api/v2/token/refresh/", name="token")
+        async def token_refresh(request: Request):
+            await self.delay()
+            expires = self.refresh_tokens.get((await form_data(request)).get("refresh"))
+            if expires is None or expires < time.monotonic():
+                raise UpstreamError(401, "Invalid token", "Refresh token is invalid or expired")
+            return self.issue_tokens(refresh=False)
+
+        @app.get("/api/v2/institutions/", name="institutions")
+        async def institutions(country: str = "DK", authorization: str = Header(None)):
+            await self.data_call("institutions", authorization)
+            return [
+                {
+                    "id": f"MOCK_BANK_{i}_{country}", "name": f"Mock Bank {i}", "bic": f"MOCK{i:04d}",
+                    "transaction_total_days": "730", "countries": [country],
+                    "logo": f"https://cdn.example.com/logos/mock-bank-{i}.png",
+                }
+                for i in range(self.config.institutions)
+            ]
+
+        @app.post("/api/v2/requisitions/", name="requisitions")
+        async def create_requisition(request: Request, authorization: str = Header(None)):
+            await self.data_call("requisitions", authorization)
+            payload = await request.json()
+            requisition_id = str(uuid4())
+            self.requisitions[requisition_id] = {
+                "id": requisition_id, "created": datetime.now(timezone.utc).isoformat(),
+                "redirect": payload.get("redirect"), "status": "CR", "institution_id": payload.get("institution_id"),
+                "agreement": payload.get("agreement"), "reference": payload.get("reference"), "accounts": [],
+                "link": f"{request.base_url}mock/link/{requisition_id}",
+            }
+            return JSONResponse(self.requisitions[requisition_id], status_code=201)
+
+        @app.get("/api/v2/requisitions/{requisition_id}/", name="requisitions")
+        async def get_requisition(requisition_id: str, authorization: str = Header(None)):
+            await self.data_call("requisitions", authorization)
+            return self.requisition(requisition_id)
+
+        @app.get("/api/v2/accounts/{account_id}/", name="accounts")
+        async def get_account(account_id: str, authorization: str = Header(None)):
+            await self.data_call("accounts", authorization)
+            return {
+                "id": account_id, "created": datetime.now(timezone.utc).isoformat(), "status": "READY",
+                "institution_id": "MOCK_BANK", "iban": f"DK50{zlib.crc32(account_id.encode()):014d}",
+            }
+
+        @app.get("/api/v2/accounts/{account_id}/details/", name="details")
+        async def get_details(account_id: str, authorization: str = Header(None)):
+            headers = await self.data_call("details", authorization, account_id)
+            return JSONResponse({"account": {
+                "resourceId": account_id, "iban": f"DK50{zlib.crc32(account_id.encode()):014d}", "currency": "DKK",
+                "ownerName": "Mock Customer", "name": ACCOUNT_NAMES[self.account_kind(account_id)],
+            }}, headers=headers)
+
+        @app.get("/api/v2/accounts/{account_id}/balances/", name="balances")
+        async def get_balances(account_id: str, authorization: str = Header(None)):
+            headers = await self.data_call("balances", authorization, account_id)
+            amount = {"amount": self.balance(account_id), "currency": "DKK"}
+            return JSONResponse({"balances": [
+                {"balanceAmount": amount, "balanceType": "expected", "referenceDate": date.today().isoformat()},
+                {"balanceAmount": amount, "balanceType": "interimAvailable", "referenceDate": date.today().isoformat()},
+            ]}, headers=headers)
+
+        @app.get("/api/v2/accounts/{account_id}/transactions/", name="transactions")
+        async def get_transactions(account_id: str, date_from: str = None, date_to: str = None,
+                                   authorization: str = Header(None)):
+            transactions = self.transactions(account_id, date_from, date_to)
+            rows = len(transactions["booked"]) + len(transactions["pending"])
+            headers = await self.data_call("transactions", authorization, account_id, rows)
+            return JSONResponse({"transactions": transactions}, headers=headers)
+
+        @app.get("/mock/stats", name="stats")
+        async def stats():
+            return {"calls": [
+                {"endpoint": endpoint, "status": status, "count": count}
+                for (endpoint, status), count in sorted(self.calls.items())
+            ]}
+
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="Up to this many seconds more, at random")
+    parser.add_argument("--latency-per-1000", type=float, default=0.01,
+                        help="Seconds added per 1000 transactions in a response")
+    parser.add_argument("--years", type=float, default=2, help="Years of transaction history per account")
+    parser.add_argument("--scale", type=float, default=1, help="Multiplier for the number of card payments")
+    parser.add_argument("--institutions", type=int, default=60, help="Institutions listed per country")
+    parser.add_argument("--accounts-per-requisition", type=int, default=2)
+    parser.add_argument("--error-rate", type=float, default=0, help="Share of data calls answered with a 5xx")
+    parser.add_argument("--rate-limit-rate", type=float, default=0, help="Share of data calls answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After of injected 429s, in seconds")
+    parser.add_argument("--account-daily-calls", type=int, default=4,
+                        help="Successful calls per account and endpoint per quota window, 0 for no quota")
+    parser.add_argument("--quota-reset", type=float, default=24 * 3600, help="Length of the quota window in seconds")
+    parser.add_argument("--access-expires", type=int, default=24 * 3600, help="Lifetime of access tokens in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    options = {name: value for name, value in vars(args).items() if name not in ("host", "port")}
+    uvicorn.run(MockGoCardless(MockConfig(**options)).app, host=args.host, port=args.port, log_level="warning")